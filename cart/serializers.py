@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from core.models import Cart, Product
+from core.models import Cart, Product, Transaction
 from product.serializers import ProductShortInfoSerializer
 
 class CartSerializer(serializers.ModelSerializer):
@@ -16,3 +16,31 @@ class CartCreateSerializer(CartSerializer):
     class Meta(CartSerializer.Meta):
         fields = CartSerializer.Meta.fields
 
+
+class CartLineSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+class CartLineUpdateSerializer(CartLineSerializer):
+    # a quantity of zero removes the line
+    quantity = serializers.IntegerField(min_value=0)
+
+class CartBatchSerializer(serializers.Serializer):
+    add = CartLineSerializer(many=True, required=False)
+    update = CartLineUpdateSerializer(many=True, required=False)
+    remove = serializers.ListField(child=serializers.IntegerField(), required=False)
+
+    def validate(self, attrs):
+        product_ids = {line['product'] for key in ('add', 'update') for line in attrs.get(key, [])}
+        found = set(Product.objects.filter(id__in=product_ids).values_list('id', flat=True))
+        missing = sorted(product_ids - found)
+        if missing:
+            raise serializers.ValidationError({'product': [f'Product not found: {product_id}' for product_id in missing]})
+        return attrs
+
+class TransactionSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Transaction
+        fields = ['id', 'user', 'product', 'quantity', 'item_price_at_purchase', 'total', 'created_at']
+        read_only_fields = fields
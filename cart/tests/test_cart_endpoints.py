@@ -1,14 +1,20 @@
+import threading
 from unittest import TestCase
 
 from rest_framework.test import APIClient
-from core.models import Shop, Product, Cart
+from django.db import connection
+from core.checkout import OutOfStock, checkout
+from core.inventory import reshard
+from core.models import Product, Cart, Transaction
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from rest_framework import status
 import pytest
 from cart.serializers import CartSerializer
+from core.utils.test.test_utils import assert_constant_queries, create_shop
 
 CART_URL = reverse('cart:cart')
+CHECKOUT_URL = reverse('cart:checkout')
 
 def get_cart_detail_url(id):
     return reverse('cart:cart-detail', args=[id])
@@ -24,13 +30,6 @@ def create_user(**params):
     defaults.update(params)
     return get_user_model().objects.create_user(**defaults)
 
-def create_shop(**params):
-    defaults = dict(
-        name='Test Shop'
-    )
-    defaults.update(params)
-    return Shop.objects.create(**defaults)
-
 def create_product(**params):
     defaults = dict(
         name='Product1',
@@ -44,7 +43,7 @@ def create_cart(product, user):
     return Cart.objects.create(product=product, user=user, quantity=1, created_by=user)
 
 def init_data(user, **params):
-    shop = create_shop(**params.get('shop', {}), user=user, created_by=user)
+    shop = create_shop(user, **params.get('shop', {}))
     product = create_product(**params.get('product', {}), shop=shop, created_by=user)
     return shop, product
 
@@ -76,7 +75,7 @@ class TestCartPrivateEndpoints(TestCase):
             product=dict(id=product.id,
                          name=product.name,
                          price=str(product.price),
-                         image=None)
+                         image=None, image_variants=None)
         )
         self.assertEqual(res.data | expected, res.data)
 
@@ -117,6 +116,18 @@ class TestCartPrivateEndpoints(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(len(res.data['results']), 1)
 
+    def test_get_list_cart_query_count(self):
+        """should load the products of every cart record without extra queries"""
+        shop = create_shop(self.user, name='Test Shop')
+
+        def grow():
+            for i in range(5):
+                product = create_product(name=f'Product {i}', shop=shop, created_by=self.user)
+                create_cart(product=product, user=self.user)
+
+        grow()
+        assert_constant_queries(lambda: self.client.get(CART_URL, dict(page_size=20)), grow)
+
     def test_get_detail_cart(self):
         """
         given user is authenticated
@@ -129,3 +140,184 @@ class TestCartPrivateEndpoints(TestCase):
         serializer = CartSerializer(cart)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(res.data, serializer.data)
+
+    def test_get_list_cart_conditional_get(self):
+        """
+        given user has cart records
+        when user asks again with the ETag of the previous response
+        then a 304 should return until a cart record changes
+        """
+        _, product = init_data(user=self.user)
+        cart = create_cart(product=product, user=self.user)
+        etag = self.client.get(CART_URL)['ETag']
+        res = self.client.get(CART_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.patch(get_cart_detail_url(cart.id), dict(quantity=3))
+        res = self.client.get(CART_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_get_missing_cart_with_etag(self):
+        """should answer 404 for a missing cart record, whatever ETag the client sends"""
+        res = self.client.get(get_cart_detail_url(999999), HTTP_IF_NONE_MATCH='*')
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_add_same_product_twice(self):
+        """
+        given product is already in the user's cart
+        when user adds the same product again
+        then the existing cart record should be incremented
+        """
+        _, product = init_data(user=self.user)
+        self.client.post(CART_URL, dict(product=product.id, quantity=1))
+        res = self.client.post(CART_URL, dict(product=product.id, quantity=1))
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data['quantity'], 2)
+        self.assertEqual(Cart.objects.filter(user=self.user, product=product).count(), 1)
+
+    def test_batch_cart(self):
+        """
+        given user has cart records
+        when user sends adds, updates and removals in one request
+        then all of them should be applied
+        """
+        shop = create_shop(self.user)
+        products = [create_product(name=f'Product {i}', shop=shop, created_by=self.user) for i in range(4)]
+        for product in products[:3]:
+            create_cart(product=product, user=self.user)
+        payload = {
+            'add': [dict(product=products[0].id, quantity=2), dict(product=products[3].id, quantity=1)],
+            'update': [dict(product=products[1].id, quantity=5), dict(product=products[2].id, quantity=0)],
+            'remove': [],
+        }
+        res = self.client.post(reverse('cart:cart-batch'), payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        quantities = dict(Cart.objects.filter(user=self.user).values_list('product_id', 'quantity'))
+        self.assertEqual(quantities, {products[0].id: 3, products[1].id: 5, products[3].id: 1})
+
+    def test_batch_cart_unknown_product(self):
+        """should reject the whole batch when a product does not exist"""
+        res = self.client.post(reverse('cart:cart-batch'), {'add': [dict(product=999999, quantity=1)]}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Cart.objects.filter(user=self.user).exists())
+
+    def test_clear_cart(self):
+        """
+        given user has cart records
+        when user clears the cart
+        then all of the user's cart records should be deleted
+        """
+        _, product = init_data(user=self.user)
+        create_cart(product=product, user=self.user)
+        res = self.client.delete(CART_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertFalse(Cart.objects.filter(user=self.user).exists())
+
+    def test_checkout(self):
+        """
+        given user has products in the cart
+        when user checks out
+        then transactions should be created, stock taken and the cart cleared
+        """
+        _, product = init_data(user=self.user, product=dict(quantity=5, price='2.50'))
+        Cart.objects.create(product=product, user=self.user, quantity=2, created_by=self.user)
+        res = self.client.post(CHECKOUT_URL)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data['total'], '5.00')
+        transaction = Transaction.objects.get(user=self.user)
+        self.assertEqual((transaction.quantity, str(transaction.item_price_at_purchase)), (2, '2.50'))
+        product.refresh_from_db()
+        self.assertEqual((product.quantity, product.sold_count), (3, 2))
+        self.assertFalse(Cart.objects.filter(user=self.user).exists())
+
+    def test_checkout_out_of_stock(self):
+        """should leave stock and cart untouched when a line can't be filled"""
+        _, product = init_data(user=self.user, product=dict(quantity=1))
+        Cart.objects.create(product=product, user=self.user, quantity=2, created_by=self.user)
+        res = self.client.post(CHECKOUT_URL)
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(res.data['available'], {product.id: 1})
+        product.refresh_from_db()
+        self.assertEqual(product.quantity, 1)
+        self.assertTrue(Cart.objects.filter(user=self.user).exists())
+        self.assertFalse(Transaction.objects.exists())
+
+
+@pytest.mark.django_db(transaction=True)
+class TestCheckoutConcurrency(TestCase):
+    buyers = 12
+
+    def setUp(self):
+        owner = get_user_model().objects.create_user(email='owner@example.com', password='test123')
+        self.shop = create_shop(owner)
+        self.users = [get_user_model().objects.create_user(email=f'buyer{i}@example.com', password='test123')
+                      for i in range(self.buyers)]
+
+    def run_checkouts(self):
+        """Start every buyer's checkout at the same moment and collect the outcomes"""
+        barrier = threading.Barrier(len(self.users))
+        outcomes = []
+
+        def buy(user):
+            try:
+                barrier.wait()
+                checkout(user)
+                outcomes.append('ok')
+            except OutOfStock:
+                outcomes.append('out of stock')
+            except Exception as error:
+                outcomes.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy, args=(user,)) for user in self.users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return outcomes
+
+    def test_concurrent_checkout_does_not_oversell(self):
+        """many buyers of the same product: exactly the stock is sold, never more"""
+        product = create_product(quantity=5, shop=self.shop, created_by=self.shop.user)
+        for user in self.users:
+            Cart.objects.create(product=product, user=user, quantity=1, created_by=user)
+
+        outcomes = self.run_checkouts()
+
+        self.assertEqual(outcomes.count('ok'), 5)
+        self.assertEqual(outcomes.count('out of stock'), self.buyers - 5)
+        product.refresh_from_db()
+        self.assertEqual((product.quantity, product.sold_count), (0, 5))
+        self.assertEqual(Transaction.objects.filter(product=product).count(), 5)
+
+    def test_concurrent_checkout_does_not_deadlock(self):
+        """carts sharing products in different orders all go through"""
+        first = create_product(name='First', quantity=100, shop=self.shop, created_by=self.shop.user)
+        second = create_product(name='Second', quantity=100, shop=self.shop, created_by=self.shop.user)
+        for index, user in enumerate(self.users):
+            products = (first, second) if index % 2 else (second, first)
+            for product in products:
+                Cart.objects.create(product=product, user=user, quantity=1, created_by=user)
+
+        outcomes = self.run_checkouts()
+
+        self.assertEqual(outcomes, ['ok'] * self.buyers)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.quantity, second.quantity), (100 - self.buyers, 100 - self.buyers))
+
+    def test_concurrent_checkout_from_shards_does_not_oversell(self):
+        """a flash-sale product sells exactly its stock across shards, never more"""
+        product = create_product(quantity=7, shop=self.shop, created_by=self.shop.user)
+        reshard(product.id, 4)
+        for user in self.users:
+            Cart.objects.create(product=product, user=user, quantity=1, created_by=user)
+
+        outcomes = self.run_checkouts()
+
+        self.assertEqual(outcomes.count('ok'), 7)
+        self.assertEqual(outcomes.count('out of stock'), self.buyers - 7)
+        product = Product.objects.with_stock().get(pk=product.pk)
+        self.assertEqual((product.shard_quantity, product.shard_sold), (0, 7))
+        self.assertEqual(Transaction.objects.filter(product=product).count(), 7)
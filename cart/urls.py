@@ -1,9 +1,11 @@
 from django.urls import path
-from cart.views import CartAPIView, CartDetailAPIView
+from cart.views import CartAPIView, CartBatchAPIView, CartDetailAPIView, CheckoutAPIView
 
 app_name = 'cart'
 
 urlpatterns = [
     path('', CartAPIView.as_view(), name='cart'),
+    path('/batch', CartBatchAPIView.as_view(), name='cart-batch'),
+    path('/checkout', CheckoutAPIView.as_view(), name='checkout'),
     path('/<str:cart_id>', CartDetailAPIView.as_view(), name='cart-detail')
 ]
\ No newline at end of file
@@ -1,48 +1,122 @@
 from rest_framework import views
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from django.shortcuts import get_object_or_404
-from cart.serializers import CartCreateSerializer, CartSerializer
-from core.pagination import CustomPagination
+from django.db import IntegrityError, transaction
+from cart.serializers import CartBatchSerializer, CartCreateSerializer, CartSerializer, TransactionSerializer
+from core.authentication import CachedTokenAuthentication
+from core.checkout import EmptyCart, OutOfStock, checkout
+from core.pagination import get_paginator
+from core.conditional import conditional_response, get_validators
 from core.models import Cart
 
 class CartAPIView(views.APIView):
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
+    cursor_orderings = {
+        '-created_at': ('-created_at', '-id'),
+        'created_at': ('created_at', 'id'),
+    }
 
     def get(self, request):
-        paginator = CustomPagination()
-        cart_items = Cart.objects.all()
+        paginator = get_paginator(request, self.cursor_orderings)
+        cart_items = Cart.objects.select_related('product')
         user = self.request.user
         items = cart_items.filter(user=user)
-        paginated_items = paginator.paginate_queryset(items, request)
-        serializer = CartSerializer(paginated_items, many=True)
-        return paginator.get_paginated_response(serializer.data)
+
+        def build():
+            paginated_items = paginator.paginate_queryset(items, request)
+            serializer = CartSerializer(paginated_items, many=True)
+            return paginator.get_paginated_response(serializer.data)
+
+        return conditional_response(request, get_validators(request, items, related=['product']), build)
 
     def post(self, request):
         serializer = CartCreateSerializer(data=request.data)
         if serializer.is_valid():
-            cart = serializer.save(user=self.request.user, created_by=self.request.user)
+            # adding a product that is already in the cart increments its line
+            data = serializer.validated_data
+            [cart_id] = Cart.objects.upsert(request.user, [(data['product'].id, data.get('quantity', 0))])
+            cart = Cart.objects.select_related('product').get(pk=cart_id)
             response_serializer = CartSerializer(cart)
             return Response(response_serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    def delete(self, request):
+        # no signals or cascades hang off Cart, so this is a single DELETE statement
+        deleted, _ = Cart.objects.filter(user=request.user).delete()
+        return Response({'message': 'Cart successfully cleared', 'deleted': deleted}, status=status.HTTP_200_OK)
+
+
+class CartBatchAPIView(views.APIView):
+    """Add, update and remove many cart lines in one request"""
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = CartBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data = serializer.validated_data
+        user = request.user
+        updates = data.get('update', [])
+        remove = set(data.get('remove', [])) | {line['product'] for line in updates if line['quantity'] == 0}
+
+        with transaction.atomic():
+            Cart.objects.upsert(user, [(line['product'], line['quantity']) for line in data.get('add', [])])
+            Cart.objects.upsert(user, [(line['product'], line['quantity']) for line in updates if line['quantity'] > 0],
+                                increment=False)
+            if remove:
+                Cart.objects.filter(user=user, product_id__in=remove).delete()
+
+        items = Cart.objects.select_related('product').filter(user=user).order_by('-created_at', '-id')
+        return Response(CartSerializer(items, many=True).data, status=status.HTTP_200_OK)
+
+
+class CheckoutAPIView(views.APIView):
+    """Buy the contents of the cart (see core.checkout)"""
+    authentication_classes = [CachedTokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        try:
+            transactions = checkout(request.user)
+        except EmptyCart:
+            return Response({'message': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
+        except OutOfStock as error:
+            return Response({'message': 'Not enough stock', 'available': error.shortages},
+                            status=status.HTTP_409_CONFLICT)
+        serializer = TransactionSerializer(transactions, many=True)
+        return Response({
+            'transactions': serializer.data,
+            'total': str(sum(item.total for item in transactions)),
+        }, status=status.HTTP_201_CREATED)
+
+
 class CartDetailAPIView(views.APIView):
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
     def get(self, request, cart_id):
-        cart = get_object_or_404(Cart, pk=cart_id)
-        serializer = CartSerializer(cart)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        cart = get_object_or_404(Cart.objects.select_related('product'), pk=cart_id)
+        validators = get_validators(request, Cart.objects.filter(pk=cart.pk), related=['product'])
+
+        def build():
+            serializer = CartSerializer(cart)
+            return Response(serializer.data, status=status.HTTP_200_OK)
+
+        return conditional_response(request, validators, build)
 
     def patch(self, request, cart_id):
         cart = get_object_or_404(Cart, pk=cart_id)
         serializer = CartCreateSerializer(cart, data=request.data, partial=True)
         if serializer.is_valid():
-            updated_cart = serializer.save()
+            try:
+                with transaction.atomic():
+                    updated_cart = serializer.save()
+            except IntegrityError:
+                return Response({'product': ['Product is already in the cart']}, status=status.HTTP_400_BAD_REQUEST)
             response_serializer = CartSerializer(updated_cart)
             return Response(response_serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,12 @@
+import pytest
+from django.core.cache import caches
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Cached responses and counters must not leak from one test into the next"""
+    from core.authentication import local_tokens
+    for cache in caches.all():
+        cache.clear()
+    local_tokens.clear()
+    yield
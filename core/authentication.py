@@ -0,0 +1,152 @@
+"""
+Token authentication without a database query per request.
+
+TokenAuthentication loads the Token joined to its User on every request. Here
+the user's fields are kept in two tiers: a small LRU in this process, checked
+first and trusted for AUTH_TOKEN_CACHE_LOCAL_TIMEOUT seconds, then the shared
+cache for AUTH_TOKEN_CACHE_TIMEOUT seconds. The database is only read on a miss
+in both. Entries are filed under a hash of the token key and hold neither the
+key nor the password hash; the Token and User are rebuilt from them per request.
+
+Deleting a token or saving its user (password, is_active, ...) drops the
+entry from the shared cache and this process's LRU (see core.signals). Other
+processes may go on accepting their LRU copy until its short TTL runs out.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+
+class LocalTokenCache:
+    """
+    Thread-safe LRU of cached token entries, each trusted for ``timeout`` seconds.
+    """
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + self.timeout)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local_tokens = LocalTokenCache(settings.AUTH_TOKEN_CACHE_LOCAL_SIZE, settings.AUTH_TOKEN_CACHE_LOCAL_TIMEOUT)
+
+
+def get_cache():
+    return caches[settings.AUTH_TOKEN_CACHE_ALIAS]
+
+
+def token_cache_key(key):
+    # hashed, so neither tier holds usable credentials, in its keys or its values
+    return f'auth:token:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def forget_tokens(keys):
+    cache_keys = [token_cache_key(key) for key in keys]
+    for cache_key in cache_keys:
+        local_tokens.delete(cache_key)
+    get_cache().delete_many(cache_keys)
+
+
+def invalidate_tokens(keys):
+    """
+    Forget now, and again once the surrounding transaction commits: a request
+    that reads the token in between would otherwise cache the old row again.
+    """
+    keys = list(keys)
+    if not keys:
+        return
+    forget_tokens(keys)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: forget_tokens(keys))
+
+
+def invalidate_user_tokens(user_id):
+    invalidate_tokens(Token.objects.filter(user_id=user_id).values_list('key', flat=True))
+
+
+def cached_user_fields(user_model):
+    """The user columns a token entry keeps: all but the password hash"""
+    return [field.attname for field in user_model._meta.concrete_fields if field.attname != 'password']
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Drop-in replacement for TokenAuthentication backed by the two token cache tiers"""
+
+    def authenticate_credentials(self, key):
+        cache_key = token_cache_key(key)
+        entry = local_tokens.get(cache_key)
+        if entry is None:
+            entry = get_cache().get(cache_key)
+            if entry is None:
+                try:
+                    token = self.get_model().objects.select_related('user').get(key=key)
+                except self.get_model().DoesNotExist:
+                    raise exceptions.AuthenticationFailed(_('Invalid token.'))
+                entry = self.cache_entry(token)
+                get_cache().set(cache_key, entry, settings.AUTH_TOKEN_CACHE_TIMEOUT)
+            local_tokens.set(cache_key, entry)
+        token = self.rebuild_token(key, entry)
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+        return token.user, token
+
+    def cache_entry(self, token):
+        user = token.user
+        return {
+            'created': token.created,
+            'user': {name: getattr(user, name) for name in cached_user_fields(type(user))},
+        }
+
+    def rebuild_token(self, key, entry):
+        """
+        Fresh Token and User instances for this request. The password is left
+        deferred, so reading it goes to the database and saving the user can't
+        overwrite it. That needs a database alias on the instances: without one,
+        save() reloads and writes back every field.
+        """
+        token_model = self.get_model()
+        user_model = token_model.user.field.related_model
+        names = list(entry['user'])
+        user = user_model.from_db(router.db_for_read(user_model), names, [entry['user'][name] for name in names])
+        token = token_model.from_db(router.db_for_read(token_model), ['key', 'user_id', 'created'],
+                                    [key, user.pk, entry['created']])
+        token.user = user
+        return token
@@ -0,0 +1,130 @@
+"""Helpers shared by the benchmark management commands"""
+import os
+import resource
+import statistics
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+from django.urls import URLResolver, get_resolver, resolve
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(samples):
+    """Latency summary in milliseconds for a list of durations in seconds"""
+    millis = [sample * 1000 for sample in samples]
+    return {
+        'runs': len(millis),
+        'mean_ms': round(statistics.fmean(millis), 3) if millis else 0.0,
+        'p50_ms': round(percentile(millis, 50), 3),
+        'p95_ms': round(percentile(millis, 95), 3),
+        'p99_ms': round(percentile(millis, 99), 3),
+    }
+
+
+@contextmanager
+def timer(samples):
+    """Append the duration of the block, in seconds, to ``samples``"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        samples.append(time.perf_counter() - start)
+
+
+def format_summary(label, summary):
+    return (f"{label:<28} runs={summary['runs']:<5} p50={summary['p50_ms']:.2f}ms "
+            f"p95={summary['p95_ms']:.2f}ms p99={summary['p99_ms']:.2f}ms")
+
+
+def find_regressions(baseline, current, threshold, query_slack=0):
+    """
+    Compare two benchmark result sets ({'endpoints': {name: summary}}). An
+    endpoint regresses when its p95 grew by more than ``threshold`` (0.2 = 20%)
+    or it issues more than ``query_slack`` extra queries per request.
+    Returns one message per regression.
+    """
+    regressions = []
+    for name, now in current['endpoints'].items():
+        before = baseline['endpoints'].get(name)
+        if before is None:
+            continue
+        if before['p95_ms'] and now['p95_ms'] > before['p95_ms'] * (1 + threshold):
+            regressions.append(f"{name}: p95 {before['p95_ms']:.2f}ms -> {now['p95_ms']:.2f}ms")
+        if now['queries'] > before['queries'] + query_slack:
+            regressions.append(f"{name}: queries per request {before['queries']} -> {now['queries']}")
+    return regressions
+
+
+
+def unique_shop_name(prefix):
+    """
+    A shop name no earlier run left behind (after --keep or a crash): shop
+    names are unique, case-insensitively
+    """
+    return f'{prefix} {uuid.uuid4().hex[:8]}'
+
+
+def api_routes(patterns=None, prefix=''):
+    """Every route of the URLconf under api/, spelled like ResolverMatch.route"""
+    for pattern in get_resolver().url_patterns if patterns is None else patterns:
+        route = prefix + str(pattern.pattern)
+        if isinstance(pattern, URLResolver):
+            yield from api_routes(pattern.url_patterns, route)
+        elif route.startswith('api/'):
+            yield route
+
+
+def unmeasured_routes(urls):
+    """The API routes none of ``urls`` resolves to, so new endpoints can't be skipped unnoticed"""
+    measured = {resolve(urlsplit(url).path).route for url in urls}
+    return sorted(set(api_routes()) - measured)
+
+
+def current_rss():
+    """Resident set size of this process in bytes"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # no procfs (macOS): the lifetime peak, in bytes there, is the best available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class PeakRss:
+    """Samples the resident set size in a background thread while the block runs"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.baseline = self.peak = 0
+        self.done = threading.Event()
+
+    def sample(self):
+        while not self.done.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        self.baseline = self.peak = current_rss()
+        self.done.clear()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.done.set()
+        self.thread.join()
+        self.peak = max(self.peak, current_rss())
+
+    @property
+    def growth(self):
+        return self.peak - self.baseline
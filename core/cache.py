@@ -0,0 +1,225 @@
+"""
+Versioned response cache for catalog reads.
+
+Every cached entry records the version of each namespace it was built from
+(e.g. ``product:12``, ``shop:3``, ``catalog:list``). Writes bump the versions of
+the namespaces they touch (see core.signals), and a read only counts as a hit
+while all recorded versions are still current. Invalidation is therefore
+precise and never needs to scan or delete keys.
+
+Sales and reviews only bump their products: the sold_count and rating shown on
+list pages are refreshed at the soft TTL instead.
+"""
+import hashlib
+import math
+import random
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+CATALOG_LIST = 'catalog:list'
+
+STAT_HITS = 'hits'
+STAT_MISSES = 'misses'
+STAT_EVICTIONS = 'evictions'
+# stale copies served while another worker rebuilt the entry
+STAT_STALE = 'stale'
+# requests that waited for another worker's rebuild instead of running the query
+STAT_COALESCED = 'coalesced'
+STATS = (STAT_HITS, STAT_MISSES, STAT_EVICTIONS, STAT_STALE, STAT_COALESCED)
+
+LOCK_POLL_INTERVAL = 0.05
+
+
+def get_cache():
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def product_namespace(product_id):
+    return f'product:{product_id}'
+
+
+def shop_namespace(shop_id):
+    return f'shop:{shop_id}'
+
+
+def _version_key(namespace):
+    return f'version:{namespace}'
+
+
+def _fresh_version():
+    # versions start from the clock so a namespace whose version key was culled
+    # can never come back at a value an old entry was stored with
+    return time.time_ns() // 1000
+
+
+def get_versions(namespaces):
+    """Current version of each namespace, creating the missing ones"""
+    cache = get_cache()
+    keys = {_version_key(namespace): namespace for namespace in namespaces}
+    found = cache.get_many(keys)
+    versions = {keys[key]: version for key, version in found.items()}
+    for key, namespace in keys.items():
+        if key not in found:
+            cache.add(key, _fresh_version(), None)
+            versions[namespace] = cache.get(key)
+    return versions
+
+
+def bump_versions(*namespaces):
+    """Make every entry built from these namespaces stale"""
+    cache = get_cache()
+    for namespace in namespaces:
+        key = _version_key(namespace)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _fresh_version(), None)
+    record(STAT_EVICTIONS, len(namespaces))
+
+
+def reset_versions(namespaces):
+    """
+    Move many namespaces to fresh versions in one round trip, for bulk writes
+    where an incr per namespace would be too slow.
+    """
+    namespaces = list(namespaces)
+    version = _fresh_version()
+    get_cache().set_many({_version_key(namespace): version for namespace in namespaces}, None)
+    record(STAT_EVICTIONS, len(namespaces))
+
+
+def invalidate_many(namespaces):
+    """Bulk counterpart of invalidate()"""
+    namespaces = list(namespaces)
+    reset_versions(namespaces)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: reset_versions(namespaces))
+
+
+def invalidate(*namespaces):
+    """
+    Bump now, and again once the surrounding transaction commits: a reader that
+    rebuilds from pre-commit data in between would otherwise store it under the
+    new version.
+    """
+    bump_versions(*namespaces)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: bump_versions(*namespaces))
+
+
+def record(stat, amount=1):
+    cache = get_cache()
+    key = f'stats:{stat}'
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        if not cache.add(key, amount, None):
+            cache.incr(key, amount)
+
+
+def get_stats():
+    cache = get_cache()
+    values = cache.get_many([f'stats:{stat}' for stat in STATS])
+    return {stat: values.get(f'stats:{stat}', 0) for stat in STATS}
+
+
+def normalize_params(query_params):
+    """Stable representation of a query string: sorted keys and values, blanks dropped"""
+    return tuple(sorted((key, tuple(sorted(value for value in values if value)))
+                        for key, values in query_params.lists()
+                        if any(values)))
+
+
+def response_key(name, request):
+    # the host is part of the key because paginated responses embed absolute links
+    raw = repr((request.get_host(), request.path, normalize_params(request.query_params)))
+    return f'response:{name}:{hashlib.sha1(raw.encode()).hexdigest()}'
+
+
+def is_current(entry):
+    return get_versions(entry['versions']) == entry['versions']
+
+
+def should_refresh(entry, now=None):
+    """
+    Probabilistic early expiration (XFetch): the closer an entry is to its soft
+    expiry, and the longer it took to build, the likelier a request refreshes it
+    early, so refreshes of a hot key spread out instead of landing together.
+    """
+    now = time.time() if now is None else now
+    jitter = entry['build_seconds'] * settings.CATALOG_CACHE_EARLY_REFRESH_BETA * -math.log(1.0 - random.random())
+    return now + jitter >= entry['soft_expires_at']
+
+
+def build_entry(cache, key, namespaces, build):
+    # read versions before building so a write that lands meanwhile makes this entry stale
+    versions = get_versions(namespaces)
+    started = time.time()
+    data, dependencies = build()
+    finished = time.time()
+    versions.update(get_versions(dependencies))
+    entry = {
+        'versions': versions,
+        'data': data,
+        'build_seconds': finished - started,
+        'soft_expires_at': finished + settings.CATALOG_CACHE_SOFT_TIMEOUT,
+    }
+    cache.set(key, entry, settings.CATALOG_CACHE_TIMEOUT)
+    return entry
+
+
+def wait_for_entry(cache, key):
+    """Poll for the entry another worker is rebuilding, up to CATALOG_CACHE_LOCK_WAIT seconds"""
+    deadline = time.monotonic() + settings.CATALOG_CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        entry = cache.get(key)
+        if entry is not None and is_current(entry):
+            return entry
+    return None
+
+
+def cached_response_data(name, request, namespaces, build):
+    """
+    Return the response data for a request from the cache, or build and store it.
+    ``build`` returns (data, extra namespaces); the extra namespaces are the ones
+    only known after loading, e.g. the shop of a product.
+
+    Entries live for CATALOG_CACHE_TIMEOUT (hard TTL) but are refreshed after
+    CATALOG_CACHE_SOFT_TIMEOUT (soft TTL). Only the worker holding the rebuild
+    lock recomputes a key; the others serve the stale copy, or wait briefly for
+    the fresh one when there is nothing to serve.
+    """
+    cache = get_cache()
+    key = response_key(name, request)
+    entry = cache.get(key)
+    current = entry is not None and is_current(entry)
+    if current and not should_refresh(entry):
+        record(STAT_HITS)
+        return entry['data']
+
+    lock_key = f'lock:{key}'
+    token = uuid.uuid4().hex
+    if cache.add(lock_key, token, settings.CATALOG_CACHE_LOCK_TIMEOUT):
+        record(STAT_MISSES)
+        try:
+            return build_entry(cache, key, namespaces, build)['data']
+        finally:
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+    # someone else is rebuilding this key
+    if entry is not None:
+        record(STAT_HITS if current else STAT_STALE)
+        return entry['data']
+    record(STAT_COALESCED)
+    entry = wait_for_entry(cache, key)
+    if entry is not None:
+        return entry['data']
+    # the rebuild is taking too long; don't keep the client waiting on it
+    record(STAT_MISSES)
+    return build_entry(cache, key, namespaces, build)['data']
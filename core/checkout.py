@@ -0,0 +1,109 @@
+"""
+Checkout: turn a user's cart into Transactions.
+
+Everything happens in one database transaction. The cart lines are locked
+first, then the products they reference in ascending id order. Every checkout
+takes its locks in that same order, so two checkouts that share products queue
+up behind each other and never deadlock. The stock is checked under those
+locks and then taken with a single UPDATE; any other write to the same rows
+waits for the locks, so a product can never be oversold. Flash-sale
+products skip the product lock and take their units from inventory shards
+(see core.inventory).
+
+The shops' directory stats are updated once the transaction has committed, so
+they may briefly trail the sale; recompute_shop_stats repairs any drift.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Case, F, When
+from django.db.models.functions import Now
+
+from core.cache import CATALOG_LIST, invalidate_many, product_namespace
+from core.inventory import shard_stock, take_from_shards
+from core.models import Cart, Product, Transaction
+from core.signals import shift_shop_stats
+
+
+class EmptyCart(Exception):
+    pass
+
+
+class OutOfStock(Exception):
+    """Raised with {product_id: units available} for every line that can't be filled"""
+
+    def __init__(self, shortages):
+        super().__init__(shortages)
+        self.shortages = shortages
+
+
+def checkout(user):
+    """Buy everything in the user's cart and return the created Transactions"""
+    with transaction.atomic():
+        # locking the cart keeps two checkouts of the same cart from both going through
+        lines = list(Cart.objects.select_for_update().filter(user=user)
+                     .order_by('product_id').values_list('id', 'product_id', 'quantity'))
+        wanted = {product_id: quantity for _, product_id, quantity in lines if quantity > 0}
+        if not wanted:
+            raise EmptyCart()
+
+        # ORDER BY id makes Postgres lock the rows in that order; flash-sale
+        # products are not locked here, their units come from inventory shards
+        products = {product.id: product for product in
+                    Product.objects.select_for_update().filter(pk__in=wanted, inventory_shards=0).order_by('id')
+                    .only('id', 'price', 'quantity', 'shop_id')}
+        sharded = {product.id: product for product in
+                   Product.objects.filter(pk__in=wanted, inventory_shards__gt=0).only('id', 'price', 'shop_id')}
+        single = {product_id: quantity for product_id, quantity in wanted.items() if product_id in products}
+        shortages = {product_id: products[product_id].quantity if product_id in products else 0
+                     for product_id, quantity in wanted.items()
+                     if product_id not in sharded
+                     and (product_id not in products or products[product_id].quantity < quantity)}
+        if shortages:
+            raise OutOfStock(shortages)
+
+        for product_id in sorted(sharded):
+            if not take_from_shards(product_id, wanted[product_id]):
+                shortages[product_id] = shard_stock(product_id)
+        if shortages:
+            raise OutOfStock(shortages)
+
+        if single:
+            # one statement for every product, all locked and checked above
+            Product.objects.filter(pk__in=single).update(
+                quantity=Case(*(When(pk=product_id, then=F('quantity') - quantity)
+                                for product_id, quantity in single.items())),
+                # bulk_create below skips the signals that keep sold_count in step
+                sold_count=Case(*(When(pk=product_id, then=F('sold_count') + quantity)
+                                  for product_id, quantity in single.items())),
+                updated_at=Now(),
+            )
+
+        products.update(sharded)
+        transactions = Transaction.objects.bulk_create([
+            Transaction(user=user, created_by=user, product_id=product_id, quantity=quantity,
+                        item_price_at_purchase=products[product_id].price,
+                        total=products[product_id].price * quantity)
+            for product_id, quantity in wanted.items()
+        ])
+        # only the locked lines: a line added while this ran stays for the next checkout
+        Cart.objects.filter(pk__in=[cart_id for cart_id, _, _ in lines]).delete()
+
+        sold, sold_out = Counter(), Counter()
+        for product_id, quantity in wanted.items():
+            sold[products[product_id].shop_id] += quantity
+        for product_id, quantity in single.items():
+            if products[product_id].quantity == quantity:
+                sold_out[products[product_id].shop_id] += 1
+        # list pages only need rebuilding when a product drops out of them; the new
+        # sold_count reaches them at their soft TTL
+        invalidate_many([product_namespace(product_id) for product_id in wanted]
+                        + ([CATALOG_LIST] if sold_out else []))
+        # after commit: a hot shop's row must not stay locked for the rest of every checkout
+        transaction.on_commit(lambda: update_shop_stats(sold, sold_out))
+    return transactions
+
+
+def update_shop_stats(sold, sold_out):
+    for shop_id in sorted(sold):
+        shift_shop_stats(shop_id, sold_count=sold[shop_id], in_stock_count=-sold_out[shop_id])
@@ -0,0 +1,91 @@
+"""
+Conditional GET support (ETag / Last-Modified) for read endpoints.
+
+Validators come from one aggregate query over the rows a response is built
+from: their count, newest updated_at and highest id, plus the newest
+updated_at of related rows embedded in the payload. No serialization is
+needed to answer 304 Not Modified.
+"""
+import asyncio
+import hashlib
+import inspect
+from dataclasses import dataclass
+from datetime import datetime
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from core.cache import normalize_params
+
+
+@dataclass(frozen=True)
+class Validators:
+    etag: str
+    last_modified: datetime | None
+
+    @property
+    def timestamp(self):
+        return int(self.last_modified.timestamp()) if self.last_modified else None
+
+
+def get_validators(request, queryset, related=(), extra=()):
+    """
+    Validators for a response built from ``queryset``. ``related`` names the
+    foreign keys whose rows are embedded in the payload (e.g. a product's shop);
+    ``extra`` is any other state the payload depends on, folded into the ETag.
+    The query string is part of the ETag, so each page has its own.
+    """
+    state = queryset.order_by().aggregate(**validator_aggregates(related))
+    return build_validators(request.path, request.query_params, state, extra)
+
+
+async def aget_validators(request, queryset, related=(), extra=()):
+    """
+    get_validators for the async views, which get a plain Django request.
+    ``extra`` may be an awaitable; it is awaited together with the aggregate.
+    """
+    aggregate = queryset.order_by().aaggregate(**validator_aggregates(related))
+    if inspect.isawaitable(extra):
+        state, extra = await asyncio.gather(aggregate, extra)
+    else:
+        state = await aggregate
+    return build_validators(request.path, request.GET, state, extra)
+
+
+def validator_aggregates(related):
+    aggregates = {'rows': Count('pk'), 'max_id': Max('pk'), 'updated_at': Max('updated_at')}
+    for field in related:
+        aggregates[f'{field}_updated_at'] = Max(f'{field}__updated_at')
+    return aggregates
+
+
+def build_validators(path, query_params, state, extra):
+    timestamps = [value for key, value in state.items() if key.endswith('updated_at') and value]
+    raw = repr((path, normalize_params(query_params), sorted(state.items()), tuple(extra)))
+    return Validators(etag=hashlib.sha1(raw.encode()).hexdigest(),
+                      last_modified=max(timestamps) if timestamps else None)
+
+
+def not_modified(request, validators):
+    """A 304 response when the client already has this representation, otherwise None"""
+    response = get_conditional_response(request, etag=quote_etag(validators.etag),
+                                        last_modified=validators.timestamp)
+    if response is not None:
+        set_validators(response, validators)
+    return response
+
+
+def set_validators(response, validators):
+    response['ETag'] = quote_etag(validators.etag)
+    if validators.timestamp is not None:
+        response['Last-Modified'] = http_date(validators.timestamp)
+    return response
+
+
+def conditional_response(request, validators, build):
+    """Answer 304 when the client's copy is current, otherwise the Response from build()"""
+    response = not_modified(request, validators)
+    if response is None:
+        response = build()
+    return set_validators(response, validators)
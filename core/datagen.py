@@ -0,0 +1,319 @@
+"""
+Synthetic data generator.
+
+Rows are built in worker processes and streamed into Postgres with
+COPY ... FROM STDIN, a chunk of rows per task, so millions of rows load in
+minutes instead of the hours one ORM create() per row takes.
+
+Everything in a row derives from the seed, its table and its chunk, so a seed
+(with the same volumes and chunk size, on an empty database) always produces
+the same dataset, whatever the number of workers or the order chunks finish in.
+
+Popularity is Zipfian: a few products collect most of the sales, reviews and
+cart lines, a few shops hold most of the products and a few users buy most.
+
+Like core.seed, this bypasses the signals; seed.finish_seed() rebuilds the
+stored counters and search vectors afterwards.
+"""
+import json
+import multiprocessing
+import random
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from functools import cached_property
+from math import gcd
+
+from django.db import connection, connections
+
+from core.models import Cart, Product, Review, Shop, Transaction, User
+from core.seed import ADJECTIVES, CATEGORIES, NOUNS, SEED_EMAIL_DOMAIN, SEED_SHOP_PREFIX
+
+DEFAULT_VOLUMES = {
+    'users': 100_000,
+    'shops': 5_000,
+    'products': 1_000_000,
+    'carts': 200_000,
+    'reviews': 5_000_000,
+    'transactions': 10_000_000,
+}
+CHUNK_SIZE = 50_000
+CART_LINES = 4
+# a table is only loaded once the tables it references are
+STAGES = [('users',), ('shops',), ('products',), ('carts', 'reviews', 'transactions')]
+
+# rows are dated before a fixed instant rather than now(), so a seed always produces the same rows
+ANCHOR = datetime(2025, 1, 1, tzinfo=timezone.utc)
+YEAR = 365 * 24 * 3600
+MONTH = 30 * 24 * 3600
+
+VARIATIONS = [[], [], ['S', 'M', 'L'], ['S', 'M', 'L', 'XL'], ['red', 'blue', 'black'],
+              ['64GB', '128GB', '256GB'], ['small', 'large']]
+REVIEW_MESSAGES = ['Great value', 'Arrived quickly, works as described', 'Not what I expected',
+                   'Would buy again', 'Broke after a week', 'Good quality for the price', '']
+RATINGS, RATING_WEIGHTS = [1, 2, 3, 4, 5], [5, 7, 13, 30, 45]
+QUANTITIES, QUANTITY_WEIGHTS = [1, 2, 3], [80, 15, 5]
+
+MASK = (1 << 64) - 1
+
+
+def mix(value):
+    """splitmix64 finalizer: a cheap, well-spread hash of an integer"""
+    value = (value + 0x9E3779B97F4A7C15) & MASK
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK
+    return value ^ (value >> 31)
+
+
+@dataclass
+class Population:
+    """``count`` consecutive ids from ``first``, picked with Zipf(``exponent``) popularity (0 = uniform)"""
+    first: int
+    count: int
+    exponent: float = 1.0
+
+    def rank(self, rng):
+        # inverse CDF of the continuous approximation of a Zipf distribution over ranks 1..count
+        n, s, u = self.count + 1, self.exponent, rng.random()
+        x = n ** u if s == 1 else ((n ** (1 - s) - 1) * u + 1) ** (1 / (1 - s))
+        return min(int(x) - 1, self.count - 1)
+
+    @cached_property
+    def stride(self):
+        stride = 2654435761 % self.count or 1
+        while gcd(stride, self.count) != 1:
+            stride += 1
+        return stride
+
+    def at(self, rank):
+        """
+        The id holding a popularity rank. Ranks are scattered over the ids, so
+        the hot rows aren't simply the oldest ones.
+        """
+        return self.first + (rank * self.stride) % self.count
+
+    def pick(self, rng):
+        return self.at(self.rank(rng))
+
+
+@dataclass
+class Plan:
+    seed: int
+    first_ids: dict
+    volumes: dict
+
+    @cached_property
+    def users(self):
+        return Population(self.first_ids['users'], self.volumes['users'], exponent=0)
+
+    @cached_property
+    def buyers(self):
+        return Population(self.first_ids['users'], self.volumes['users'], exponent=0.8)
+
+    @cached_property
+    def shops(self):
+        return Population(self.first_ids['shops'], self.volumes['shops'], exponent=1.0)
+
+    @cached_property
+    def products(self):
+        return Population(self.first_ids['products'], self.volumes['products'], exponent=1.1)
+
+    @property
+    def cart_owners(self):
+        return min(self.volumes['users'], self.volumes['carts'] // CART_LINES)
+
+    def derive(self, salt, value, modulo):
+        """A value in range(modulo) fixed by the seed and ``value``, for facts several tables must agree on"""
+        return mix(mix(self.seed * 31 + salt) ^ value) % modulo
+
+    def shop_owner(self, shop_id):
+        return self.users.first + self.derive(1, shop_id, self.users.count)
+
+    def price(self, product_id):
+        return Decimal(100 + self.derive(2, product_id, 50_000)) / 100
+
+
+def dated(rng, span):
+    return ANCHOR - timedelta(seconds=rng.randrange(span))
+
+
+def user_rows(plan, rng, start, stop):
+    # unusable password hashes: generated users can't log in
+    for user_id in range(plan.first_ids['users'] + start, plan.first_ids['users'] + stop):
+        yield (user_id, '!', None, False, f'gen{user_id}@{SEED_EMAIL_DOMAIN}', f'Seed User {user_id}', False,
+               dated(rng, YEAR))
+
+
+def shop_rows(plan, rng, start, stop):
+    for shop_id in range(plan.first_ids['shops'] + start, plan.first_ids['shops'] + stop):
+        created, owner = dated(rng, YEAR), plan.shop_owner(shop_id)
+        # directory stats start at zero; finish_seed() computes them
+        yield shop_id, created, created, owner, f'{SEED_SHOP_PREFIX} {shop_id}', '', owner, 0, 0, 0, 0, 0, 0
+
+
+def product_rows(plan, rng, start, stop):
+    for product_id in range(plan.first_ids['products'] + start, plan.first_ids['products'] + stop):
+        shop_id = plan.shops.pick(rng)
+        created = dated(rng, YEAR)
+        name = f'{rng.choice(ADJECTIVES)} {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {product_id}'
+        # one product in ten is sold out
+        quantity = 0 if rng.random() < 0.1 else rng.randint(1, 200)
+        yield (product_id, created, created, plan.shop_owner(shop_id), name, quantity, plan.price(product_id),
+               shop_id, None, rng.choice(VARIATIONS), 0, rng.choice(CATEGORIES), 0,
+               0, 0, 0, 0, 0, 0, 0, None, 0, {}, '')
+
+
+def cart_rows(plan, rng, start, stop):
+    """Cart chunks run over cart owners, CART_LINES distinct products each"""
+    for owner in range(start, stop):
+        user_id = plan.users.at(owner)
+        products = set()
+        while len(products) < min(CART_LINES, plan.products.count):
+            products.add(plan.products.pick(rng))
+        for line, product_id in enumerate(sorted(products)):
+            created = dated(rng, MONTH)
+            yield (plan.first_ids['carts'] + owner * CART_LINES + line, created, created, user_id,
+                   user_id, product_id, rng.choices(QUANTITIES, QUANTITY_WEIGHTS)[0])
+
+
+def review_rows(plan, rng, start, stop):
+    for review_id in range(plan.first_ids['reviews'] + start, plan.first_ids['reviews'] + stop):
+        user_id, created = plan.buyers.pick(rng), dated(rng, YEAR)
+        yield (review_id, created, created, user_id, rng.choice(REVIEW_MESSAGES),
+               rng.choices(RATINGS, RATING_WEIGHTS)[0], plan.products.pick(rng), user_id)
+
+
+def transaction_rows(plan, rng, start, stop):
+    for transaction_id in range(plan.first_ids['transactions'] + start, plan.first_ids['transactions'] + stop):
+        user_id, product_id, created = plan.buyers.pick(rng), plan.products.pick(rng), dated(rng, YEAR)
+        quantity, price = rng.choices(QUANTITIES, QUANTITY_WEIGHTS)[0], plan.price(product_id)
+        yield transaction_id, created, created, user_id, product_id, quantity, user_id, price, price * quantity
+
+
+TABLES = {
+    'users': (User, user_rows),
+    'shops': (Shop, shop_rows),
+    'products': (Product, product_rows),
+    'carts': (Cart, cart_rows),
+    'reviews': (Review, review_rows),
+    'transactions': (Transaction, transaction_rows),
+}
+
+
+def copy_value(value):
+    if value is None:
+        return r'\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, list):
+        return '{' + ','.join(value) + '}'
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, dict):
+        value = json.dumps(value)
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+class CopyStream:
+    """File-like object encoding rows for COPY ... FROM STDIN as the driver reads them"""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = b''
+        self.count = 0
+
+    def read(self, size=-1):
+        chunks, length = [self.buffer], len(self.buffer)
+        for row in self.rows:
+            line = ('\t'.join(map(copy_value, row)) + '\n').encode()
+            chunks.append(line)
+            length += len(line)
+            self.count += 1
+            if 0 <= size <= length:
+                break
+        data = b''.join(chunks)
+        if size < 0:
+            size = len(data)
+        self.buffer = data[size:]
+        return data[:size]
+
+
+def copy_chunk(plan, table, start, stop):
+    """Generate and COPY one chunk of a table; returns (table, rows copied)"""
+    model, rows = TABLES[table]
+    # seeding with a string is stable across processes, unlike hash()
+    rng = random.Random(f'{plan.seed}:{table}:{start}')
+    columns = ', '.join(field.column for field in model._meta.concrete_fields)
+    stream = CopyStream(rows(plan, rng, start, stop))
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f'COPY {model._meta.db_table} ({columns}) FROM STDIN', stream)
+    return table, stream.count
+
+
+def init_worker():
+    # a lost benchmark dataset is regenerated, so don't wait for the WAL flush on every chunk
+    with connection.cursor() as cursor:
+        cursor.execute('SET synchronous_commit TO off')
+
+
+def reserve_ids(model, count):
+    """
+    Move the id sequence past ``count`` ids and return the first of them, so the
+    explicit ids in the COPY streams can't collide with rows inserted meanwhile.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT setval(pg_get_serial_sequence(%s, 'id'), nextval(pg_get_serial_sequence(%s, 'id')) + %s)",
+                       [model._meta.db_table, model._meta.db_table, count - 1])
+        return cursor.fetchone()[0] - count + 1
+
+
+def chunks(plan, table, chunk_size):
+    # cart chunks count owners, not rows
+    total = plan.cart_owners if table == 'carts' else plan.volumes[table]
+    size = max(1, chunk_size // CART_LINES) if table == 'carts' else chunk_size
+    return [(table, start, min(start + size, total)) for start in range(0, total, size)]
+
+
+def generate(volumes=None, seed=42, workers=None, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Generate a dataset in the given volumes (see DEFAULT_VOLUMES) with
+    ``workers`` processes (default: one per CPU; 0 copies in this process, on
+    its connection). Returns the number of rows copied per table.
+    """
+    volumes = {**DEFAULT_VOLUMES, **(volumes or {})}
+    for table, referenced in (('shops', 'users'), ('products', 'shops'), ('carts', 'products'),
+                              ('reviews', 'products'), ('transactions', 'products')):
+        if volumes[table] and not volumes[referenced]:
+            raise ValueError(f'{table} need at least one row in {referenced}')
+    if volumes['carts'] and volumes['products'] < CART_LINES:
+        raise ValueError(f'carts need at least {CART_LINES} products')
+
+    plan = Plan(seed, {}, volumes)
+    rows = {table: plan.cart_owners * CART_LINES if table == 'carts' else count for table, count in volumes.items()}
+    plan.first_ids.update({table: reserve_ids(TABLES[table][0], count) if count else None
+                           for table, count in rows.items()})
+    copied = dict.fromkeys(TABLES, 0)
+
+    def report(result):
+        table, count = result
+        copied[table] += count
+        if progress:
+            progress(table, copied[table], rows[table])
+
+    if workers == 0:
+        for stage in STAGES:
+            for table in stage:
+                for task in chunks(plan, table, chunk_size):
+                    report(copy_chunk(plan, *task))
+        return copied
+
+    # forked workers must not share the parent's connection; each opens its own
+    connections.close_all()
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=init_worker) as pool:
+        for stage in STAGES:
+            futures = [pool.submit(copy_chunk, plan, *task) for table in stage for task in chunks(plan, table, chunk_size)]
+            for future in as_completed(futures):
+                report(future.result())
+    return copied
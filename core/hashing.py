@@ -0,0 +1,186 @@
+"""
+Password hashing off the request workers.
+
+PBKDF2 keeps a CPU busy for tens of milliseconds per hash, so a burst of logins
+or sign-ups would starve the catalog requests served by the same workers. Hashes
+are computed on a dedicated process pool of PASSWORD_HASHING_WORKERS processes
+instead (0 hashes inline, e.g. for tests).
+
+At most PASSWORD_HASHING_MAX_PENDING hashes per process are queued or running.
+Callers beyond that wait up to PASSWORD_HASHING_QUEUE_TIMEOUT seconds for a
+slot and are then turned away with a 503, rather than queueing without bound.
+"""
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import check_password, make_password
+from rest_framework import exceptions, status
+
+from core.benchmark import summarize
+
+
+class PasswordHashingBusy(exceptions.APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many logins in progress, try again shortly.'
+    default_code = 'password_hashing_busy'
+    # DRF turns this into a Retry-After header
+    wait = 1
+
+
+class HashingStats:
+    """Per-process counters; ``pending`` doubles as the back-pressure gate"""
+
+    def __init__(self, samples=1000):
+        self.condition = threading.Condition()
+        self.pending = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        # seconds spent hashing, and from the request for a slot to the result
+        self.hash_times = deque(maxlen=samples)
+        self.latencies = deque(maxlen=samples)
+
+    def acquire(self):
+        deadline = time.monotonic() + settings.PASSWORD_HASHING_QUEUE_TIMEOUT
+        with self.condition:
+            self.waiting += 1
+            try:
+                while self.pending >= settings.PASSWORD_HASHING_MAX_PENDING:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected += 1
+                        raise PasswordHashingBusy()
+                    self.condition.wait(remaining)
+                self.pending += 1
+            finally:
+                self.waiting -= 1
+
+    def release(self, hash_time, latency):
+        with self.condition:
+            self.pending -= 1
+            if hash_time is not None:
+                self.completed += 1
+                self.hash_times.append(hash_time)
+                self.latencies.append(latency)
+            self.condition.notify()
+
+
+stats = HashingStats()
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawned, not forked: forking a threaded server process can copy held locks.
+            # The initializer is django.setup itself; this module can only be imported once it has run.
+            _pool = ProcessPoolExecutor(settings.PASSWORD_HASHING_WORKERS,
+                                        mp_context=multiprocessing.get_context('spawn'), initializer=django.setup)
+        return _pool
+
+
+def reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    return function(*args), time.perf_counter() - started
+
+
+def run(function, *args):
+    started = time.perf_counter()
+    stats.acquire()
+    hash_time = None
+    try:
+        if not settings.PASSWORD_HASHING_WORKERS:
+            result, hash_time = timed(function, *args)
+            return result
+        try:
+            result, hash_time = get_pool().submit(timed, function, *args).result()
+        except BrokenProcessPool:
+            # a worker died; start over with a fresh pool on the next call
+            reset_pool()
+            raise
+        return result
+    finally:
+        stats.release(hash_time, time.perf_counter() - started)
+
+
+def verify(password, encoded):
+    """(valid, new hash or None): the new hash is set when ``encoded`` uses outdated hasher settings"""
+    upgraded = []
+    valid = check_password(password, encoded, setter=lambda raw: upgraded.append(make_password(raw)))
+    return valid, upgraded[0] if upgraded else None
+
+
+def hash_password(password):
+    return run(make_password, password)
+
+
+def set_password(user, password):
+    """User.set_password() with the hash computed on the pool"""
+    user.password = hash_password(password)
+    user._password = password
+
+
+def check_user_password(user, password):
+    """
+    User.check_password() with the hash computed on the pool. A hash made with
+    an outdated hasher or iteration count is replaced by a current one.
+    """
+    valid, upgraded = run(verify, password, user.password)
+    if upgraded:
+        user.password = upgraded
+        user.save(update_fields=['password'])
+    return valid
+
+
+class PooledModelBackend(ModelBackend):
+    """ModelBackend hashing on the pool, so authenticate() callers need no change"""
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        UserModel = get_user_model()
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # hash anyway, so response times don't reveal which emails have accounts
+            hash_password(password)
+            return None
+        if check_user_password(user, password) and self.user_can_authenticate(user):
+            return user
+        return None
+
+
+def get_stats():
+    return {
+        'workers': settings.PASSWORD_HASHING_WORKERS,
+        'max_pending': settings.PASSWORD_HASHING_MAX_PENDING,
+        'pending': stats.pending,
+        # hashes waiting for a free worker
+        'queued': max(0, stats.pending - max(settings.PASSWORD_HASHING_WORKERS, 1)),
+        # callers waiting for a slot under back-pressure
+        'waiting': stats.waiting,
+        'completed': stats.completed,
+        'rejected': stats.rejected,
+        'hash_time': summarize(list(stats.hash_times)),
+        'latency': summarize(list(stats.latencies)),
+    }
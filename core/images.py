@@ -0,0 +1,168 @@
+"""
+Resized copies of product images, built off the request path.
+
+Every Product.image gets one variant per VARIANTS bounding box (never
+upscaled) in each of FORMATS, stored under variants/<image name>/. Saving a
+product with a new image schedules the build once the transaction commits. It
+runs on a pool of IMAGE_VARIANT_WORKERS processes (0 builds inline, e.g. for
+tests), and the worker records the stored names on the product together with
+the image they were made from. Variants of a replaced image are therefore
+never served; see variant_urls. The cached catalog responses are invalidated
+back in the process that scheduled the build: a worker's cache may be a
+private copy (e.g. locmem).
+"""
+import io
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models.functions import Now
+from PIL import Image, ImageOps
+
+from core.cache import CATALOG_LIST, invalidate, product_namespace
+from core.models import Product
+
+logger = logging.getLogger(__name__)
+
+# name: bounding box in pixels, largest first (each variant is resized from the one before)
+VARIANTS = {
+    'full': (1600, 1600),
+    'card': (480, 480),
+    'thumbnail': (160, 160),
+}
+# name: (file extension, Pillow save options)
+FORMATS = {
+    'jpeg': ('jpg', {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True}),
+    'webp': ('webp', {'format': 'WEBP', 'quality': 80, 'method': 4}),
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawned for the same reason as the password hashing pool (see core.hashing)
+            _pool = ProcessPoolExecutor(settings.IMAGE_VARIANT_WORKERS,
+                                        mp_context=multiprocessing.get_context('spawn'), initializer=django.setup)
+        return _pool
+
+
+def reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def flatten(image):
+    """JPEG has no alpha channel: put transparent images on white"""
+    if image.mode != 'RGBA':
+        return image
+    background = Image.new('RGB', image.size, 'white')
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def render(source):
+    """Encode every variant of the image file ``source``: {(variant, format): bytes}"""
+    with Image.open(source) as image:
+        # lets the JPEG decoder skip detail no variant needs
+        image.draft('RGB', VARIANTS['full'])
+        image = ImageOps.exif_transpose(image)
+        transparent = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+        image = image.convert('RGBA' if transparent else 'RGB')
+
+    rendered = {}
+    for variant, box in VARIANTS.items():
+        image = image.copy()
+        image.thumbnail(box, Image.Resampling.LANCZOS)
+        for name, (_, options) in FORMATS.items():
+            output = io.BytesIO()
+            (flatten(image) if options['format'] == 'JPEG' else image).save(output, **options)
+            rendered[variant, name] = output.getvalue()
+    return rendered
+
+
+def build(product_ids, name):
+    """
+    Build and store the variants of the image ``name``, then record them on
+    those of ``product_ids`` that still have that image. Runs in a pool worker;
+    returns the ids to pass to invalidate_built, or None for an unreadable image.
+    """
+    try:
+        with default_storage.open(name) as source:
+            rendered = render(source)
+    except (OSError, ValueError, Image.DecompressionBombError):
+        logger.warning('Could not build image variants of %s', name, exc_info=True)
+        return None
+
+    variants = {}
+    for (variant, format_name), content in rendered.items():
+        path = f'variants/{name}/{variant}.{FORMATS[format_name][0]}'
+        # a rebuild replaces the files instead of letting the storage pick new names
+        default_storage.delete(path)
+        variants.setdefault(variant, {})[format_name] = default_storage.save(path, ContentFile(content))
+
+    # a queryset update skips the signals, so this doesn't schedule another build
+    updated = Product.objects.filter(pk__in=product_ids, image=name).update(
+        image_variants=variants, image_variants_source=name, updated_at=Now())
+    return product_ids if updated else []
+
+
+def invalidate_built(product_ids):
+    """Drop the cached responses of the products build() recorded variants on"""
+    if product_ids:
+        invalidate(*(product_namespace(product_id) for product_id in product_ids), CATALOG_LIST)
+
+
+def report(future):
+    if future.cancelled():
+        return
+    error = future.exception()
+    if isinstance(error, BrokenProcessPool):
+        # a worker died; start over with a fresh pool on the next call
+        reset_pool()
+    if error is not None:
+        logger.error('Building image variants failed', exc_info=error)
+    else:
+        invalidate_built(future.result())
+
+
+def schedule(product_ids, name):
+    """Build the variants of ``name`` on the pool, or right away without workers"""
+    if not settings.IMAGE_VARIANT_WORKERS:
+        product_ids = build(product_ids, name)
+        invalidate_built(product_ids)
+        return product_ids
+    future = get_pool().submit(build, product_ids, name)
+    future.add_done_callback(report)
+    return future
+
+
+def delete_variants(name):
+    directory = f'variants/{name}'
+    try:
+        _, files = default_storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for file in files:
+        default_storage.delete(f'{directory}/{file}')
+
+
+def variant_urls(product, request=None):
+    """{variant: {format: url}} for the product's current image, None until they are built"""
+    if not product.image or product.image_variants_source != product.image.name:
+        return None
+    absolute = request.build_absolute_uri if request is not None else str
+    return {variant: {format_name: absolute(default_storage.url(path)) for format_name, path in formats.items()}
+            for variant, formats in product.image_variants.items()}
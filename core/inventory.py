@@ -0,0 +1,111 @@
+"""
+Flash-sale inventory.
+
+A hot product sells from one row, so every purchase queues on the same row lock
+and throughput drops to about one sale per lock hold time. In flash-sale mode
+its stock is split over ``Product.inventory_shards`` InventoryShard rows instead:
+a buyer takes units from a random shard and skips shards other buyers are
+holding, so purchases only contend when every shard is busy.
+
+While sharded, Product.quantity holds no stock and shard sales are not added to
+Product.sold_count; reads add the shard sums back (see ProductQuerySet.with_stock).
+"""
+from django.db import connections, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Now
+
+from core.cache import CATALOG_LIST, invalidate, product_namespace
+from core.models import InventoryShard, Product
+from core.signals import in_stock, shift_shop_stats
+
+
+def split(total, shards):
+    """Spread ``total`` units as evenly as possible over ``shards`` counters"""
+    base, extra = divmod(total, shards)
+    return [base + (index < extra) for index in range(shards)]
+
+
+def reshard(product_id, shards, quantity=None):
+    """
+    Put a product's stock into ``shards`` shards, or back on the product row with
+    shards=0. Stock and shard sales are folded back into the product first;
+    ``quantity`` replaces the stock when given (a restock).
+    """
+    with transaction.atomic():
+        product = Product.objects.select_for_update().get(pk=product_id)
+        current = list(InventoryShard.objects.select_for_update().filter(product_id=product_id).order_by('index'))
+        stock = product.quantity + sum(shard.quantity for shard in current) if quantity is None else quantity
+        sold = sum(shard.sold for shard in current)
+
+        InventoryShard.objects.filter(product_id=product_id).delete()
+        if shards:
+            InventoryShard.objects.bulk_create([
+                InventoryShard(product_id=product_id, index=index, quantity=units)
+                for index, units in enumerate(split(stock, shards))
+            ])
+        Product.objects.filter(pk=product_id).update(
+            quantity=0 if shards else stock, sold_count=F('sold_count') + sold,
+            inventory_shards=shards, updated_at=Now())
+        # a sharded product is listed even with empty shards (IN_STOCK)
+        listed = in_stock(stock, shards) - in_stock(product.quantity, product.inventory_shards)
+        shift_shop_stats(product.shop_id, in_stock_count=listed)
+        invalidate(product_namespace(product_id), CATALOG_LIST)
+
+
+def take_from_shards(product_id, quantity):
+    """
+    Take ``quantity`` units of a sharded product. Must run inside a transaction;
+    the shard rows stay locked until it ends. Returns False when the shards
+    don't hold enough stock.
+    """
+    table = InventoryShard._meta.db_table
+    with connections[InventoryShard.objects.db].cursor() as cursor:
+        # fast path: one random shard that can fill the line alone, ignoring shards other buyers hold
+        cursor.execute(
+            f'UPDATE {table} SET quantity = quantity - %s, sold = sold + %s '
+            f'WHERE id = (SELECT id FROM {table} WHERE product_id = %s AND quantity >= %s '
+            f'ORDER BY random() LIMIT 1 FOR UPDATE SKIP LOCKED) '
+            f'RETURNING id',
+            [quantity, quantity, product_id, quantity],
+        )
+        if cursor.fetchone():
+            return True
+
+    # slow path: every shard is busy, or the line needs units from several shards;
+    # locks are taken in index order so concurrent slow paths can't deadlock
+    shards = list(InventoryShard.objects.select_for_update()
+                  .filter(product_id=product_id, quantity__gt=0).order_by('index'))
+    if sum(shard.quantity for shard in shards) < quantity:
+        return False
+    remaining = quantity
+    for shard in shards:
+        taken = min(shard.quantity, remaining)
+        InventoryShard.objects.filter(pk=shard.pk).update(quantity=F('quantity') - taken, sold=F('sold') + taken)
+        remaining -= taken
+        if not remaining:
+            break
+    return True
+
+
+def take_from_product(product_id, quantity):
+    """Single-row counterpart of take_from_shards: a conditional UPDATE of the product row"""
+    return bool(Product.objects.filter(pk=product_id, quantity__gte=quantity).update(
+        quantity=F('quantity') - quantity, sold_count=F('sold_count') + quantity, updated_at=Now()))
+
+
+def shard_stock(product_id):
+    return sum(InventoryShard.objects.filter(product_id=product_id).values_list('quantity', flat=True))
+
+
+def shard_state(products):
+    """
+    Stock and sales held in the shards of ``products``. Shard sales don't touch
+    Product.updated_at, so conditional GETs fold this into their ETag.
+    """
+    state = InventoryShard.objects.filter(product__in=products).aggregate(quantity=Sum('quantity'), sold=Sum('sold'))
+    return tuple(sorted(state.items()))
+
+
+async def ashard_state(products):
+    state = await InventoryShard.objects.filter(product__in=products).aaggregate(quantity=Sum('quantity'), sold=Sum('sold'))
+    return tuple(sorted(state.items()))
@@ -0,0 +1,161 @@
+import asyncio
+import io
+import random
+import sys
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.test.utils import override_settings
+
+from core.benchmark import format_summary, summarize, timer, unique_shop_name
+from core.models import Product, Review, Shop
+
+HOST = 'benchmark.local'
+
+
+class Command(BaseCommand):
+    help = ('Compare catalog read throughput of the sync views behind the WSGI handler '
+            'with the async views behind the ASGI handler')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--requests', type=int, default=2000, help='requests per endpoint and handler')
+        parser.add_argument('--concurrency', type=int, default=64,
+                            help='WSGI worker threads / concurrent ASGI requests; each may hold a database connection')
+        parser.add_argument('--cache', action='store_true',
+                            help='keep the catalog response cache on (the async views do not use it)')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        shop, product_ids = self.seed(rng, options['products'])
+        endpoints = [
+            ('product list', '/api/product', '/api/product/async', 'page_size=20'),
+            ('product search', '/api/product', '/api/product/async', 'search=product+1'),
+            ('product detail', '/api/product/{id}', '/api/product/async/{id}', ''),
+            ('product reviews', '/api/review/product/{id}', '/api/review/async/product/{id}', ''),
+            ('shop list', '/api/shop', '/api/shop/async', 'name=benchmark'),
+        ]
+        overrides = {'ALLOWED_HOSTS': [HOST]}
+        if not options['cache']:
+            overrides['CATALOG_CACHE_TIMEOUT'] = 0
+        try:
+            with override_settings(**overrides):
+                handlers = (('wsgi', get_wsgi_application(), self.run_wsgi),
+                            ('asgi', get_asgi_application(), self.run_asgi))
+                for label, sync_path, async_path, query in endpoints:
+                    # both handlers get the same product ids in the same order
+                    picks = [rng.choice(product_ids) for _ in range(options['requests'])]
+                    for (name, app, run), path in zip(handlers, (sync_path, async_path)):
+                        requests = [(path.format(id=product_id), query) for product_id in picks]
+                        samples, errors, elapsed = run(app, requests, options['concurrency'])
+                        self.stdout.write(format_summary(f'{label} ({name})', summarize(samples))
+                                          + f' throughput={len(samples) / elapsed:.0f}/s errors={errors}')
+        finally:
+            shop.delete()
+
+    def seed(self, rng, products):
+        user, _ = get_user_model().objects.get_or_create(
+            email='benchmark-asgi@example.com', defaults=dict(name='Benchmark'))
+        shop = Shop.objects.create(name=unique_shop_name('Benchmark ASGI Shop'), user=user, created_by=user)
+        created = Product.objects.bulk_create([
+            Product(name=f'Product {index}', quantity=rng.randint(1, 50), price=rng.randint(100, 50000) / 100,
+                    shop=shop, created_by=user)
+            for index in range(products)
+        ])
+        product_ids = [product.id for product in created]
+        for product_id in rng.sample(product_ids, min(50, len(product_ids))):
+            for _ in range(10):
+                Review.objects.create(product_id=product_id, user=user, created_by=user,
+                                      rating=rng.randint(1, 5), message='benchmark')
+        return shop, product_ids
+
+    def run_wsgi(self, app, requests, concurrency):
+        """A thread per worker, like a threaded WSGI server; returns (latencies, errors, wall time)"""
+        samples, errors = [], []
+        pending = iter(requests)
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                with lock:
+                    request = next(pending, None)
+                if request is None:
+                    return
+                with timer(samples):
+                    status = wsgi_get(app, *request)
+                if not status.startswith('200'):
+                    errors.append(status)
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return samples, len(errors), time.perf_counter() - started
+
+    def run_asgi(self, app, requests, concurrency):
+        """``concurrency`` requests in flight on one event loop, like an ASGI server"""
+        samples, errors = [], []
+
+        async def main():
+            pending = iter(requests)
+
+            async def worker():
+                for request in pending:
+                    with timer(samples):
+                        status = await asgi_get(app, *request)
+                    if status != 200:
+                        errors.append(status)
+
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+        started = time.perf_counter()
+        asyncio.run(main())
+        return samples, len(errors), time.perf_counter() - started
+
+
+def wsgi_get(app, path, query):
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': '',
+        'SERVER_NAME': HOST, 'SERVER_PORT': '80', 'HTTP_HOST': HOST, 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(b''),
+        'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+    status = []
+    response = app(environ, lambda line, headers, exc_info=None: status.append(line))
+    try:
+        for _ in response:
+            pass
+    finally:
+        # closing the response fires request_finished, which releases the connection
+        response.close()
+    return status[0]
+
+
+async def asgi_get(app, path, query):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+        'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'root_path': '',
+        'query_string': query.encode(), 'headers': [(b'host', HOST.encode())],
+        'server': (HOST, 80), 'client': ('127.0.0.1', 0),
+    }
+    messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        # the client never disconnects; the handler cancels this wait when it is done
+        await asyncio.Event().wait()
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    return sent[0]['status']
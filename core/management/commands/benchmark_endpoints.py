@@ -0,0 +1,251 @@
+import json
+import subprocess
+import tempfile
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import NoReverseMatch, reverse
+from rest_framework.test import APIClient
+
+from core import seed
+from core.benchmark import (find_regressions, format_summary, summarize, timer, unique_shop_name,
+                            unmeasured_routes)
+from core.models import Cart, ImageUpload, Product, Review, Shop, Transaction
+from core.pagination import planner_estimate
+
+BENCHMARK_EMAIL = 'benchmark-endpoints@example.com'
+BENCHMARK_PASSWORD = 'benchmark-password'
+# body of the local uploads; a chunked session is twice as long, so its one PUT never completes it
+UPLOAD_BODY = bytes(range(256)) * 256
+
+
+@dataclass
+class Endpoint:
+    name: str
+    method: str
+    # url and data may be callables taking the run number, for values that must differ per run
+    url: Any
+    data: Any = None
+    # writes run in a transaction that is rolled back, so every run sees the same dataset
+    writes: bool = False
+    authenticated: bool = True
+    format: str = 'json'
+    # a raw body of this type instead of one encoded in ``format``, e.g. upload chunks
+    content_type: str = None
+    headers: dict = field(default_factory=dict)
+    samples: list = field(default_factory=list)
+    queries: list = field(default_factory=list)
+    errors: int = 0
+
+    def resolve(self, value, run):
+        return value(run) if callable(value) else value
+
+
+class Command(BaseCommand):
+    help = ('Measure p50/p95/p99 latency and queries per request of every API endpoint on a large '
+            'seeded dataset, store the results as JSON and fail on regressions against a baseline')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=50, help='requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=3, help='unmeasured requests per endpoint')
+        parser.add_argument('--scale', type=float, default=1.0,
+                            help='multiplier for the seeded volumes (1.0 = 1M products, 10M transactions, '
+                                 '5M reviews, 100k users)')
+        parser.add_argument('--skip-seed', action='store_true',
+                            help='reuse an already seeded database, e.g. one filled by generate_data')
+        parser.add_argument('--cold-cache', action='store_true', help='disable the catalog response cache')
+        parser.add_argument('--output', default='benchmark-endpoints.json')
+        parser.add_argument('--baseline', help='results of an earlier run to compare against')
+        parser.add_argument('--threshold', type=float, default=0.25,
+                            help='allowed relative p95 growth over the baseline (0.25 = 25%%)')
+        parser.add_argument('--query-slack', type=int, default=0,
+                            help='allowed extra queries per request over the baseline')
+
+    def handle(self, *args, **options):
+        baseline = self.load_baseline(options['baseline'])
+        if not options['skip_seed'] and not seed.is_seeded():
+            volumes = {table: max(1, int(count * options['scale'])) for table, count in seed.DEFAULT_VOLUMES.items()}
+            self.stdout.write(f'Seeding {volumes}...')
+            seed.seed(volumes, progress=lambda table, done, total: self.stdout.write(f'  {table}: {done}/{total}'))
+            seed.finish_seed(stdout=self.stdout)
+
+        user = self.benchmark_user()
+        overrides = {'ALLOWED_HOSTS': ['testserver']}
+        if options['cold_cache']:
+            overrides['CATALOG_CACHE_TIMEOUT'] = 0
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root, **overrides):
+            try:
+                endpoints = self.endpoints(user)
+                missing = unmeasured_routes(endpoint.resolve(endpoint.url, 0) for endpoint in endpoints)
+                if missing:
+                    raise CommandError(f"No benchmark for {', '.join(missing)}; add them to endpoints()")
+                for endpoint in endpoints:
+                    self.measure(endpoint, user, options['runs'], options['warmup'])
+            finally:
+                ImageUpload.objects.filter(created_by=user).delete()
+
+        results = {
+            'commit': self.current_commit(),
+            'recorded_at': datetime.now(timezone.utc).isoformat(),
+            # planner estimates: exact counts of the big tables would take longer than the benchmark
+            'dataset': {model.__name__.lower(): planner_estimate(model.objects.all())
+                        for model in (get_user_model(), Shop, Product, Transaction, Review)},
+            'endpoints': {},
+        }
+        for endpoint in endpoints:
+            summary = summarize(endpoint.samples)
+            summary['queries'] = max(endpoint.queries, default=0)
+            summary['errors'] = endpoint.errors
+            results['endpoints'][endpoint.name] = summary
+            self.stdout.write(format_summary(endpoint.name, summary)
+                              + f" queries={summary['queries']} errors={endpoint.errors}")
+        with open(options['output'], 'w') as output:
+            json.dump(results, output, indent=2)
+        self.stdout.write(f"Results written to {options['output']}")
+
+        if baseline is not None:
+            regressions = find_regressions(baseline, results, options['threshold'], options['query_slack'])
+            if regressions:
+                raise CommandError('Performance regressions:\n  ' + '\n  '.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
+
+    def load_baseline(self, path):
+        if not path:
+            return None
+        try:
+            with open(path) as baseline:
+                return json.load(baseline)
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Could not read the baseline {path}: {error}')
+
+    def benchmark_user(self):
+        """A staff user with a password (for the token endpoint), a shop and a full cart"""
+        user = get_user_model().objects.filter(email=BENCHMARK_EMAIL).first()
+        if user is None:
+            user = get_user_model().objects.create_user(email=BENCHMARK_EMAIL, password=BENCHMARK_PASSWORD,
+                                                        name='Benchmark', is_staff=True)
+            Shop.objects.create(name=unique_shop_name('Benchmark Endpoints Shop'), user=user, created_by=user)
+        if not Cart.objects.filter(user=user).exists():
+            product_ids = Product.objects.filter(quantity__gt=10).order_by('id').values_list('id', flat=True)[:20]
+            Cart.objects.upsert(user, [(product_id, 1) for product_id in product_ids])
+        return user
+
+    def endpoints(self, user):
+        # the lowest ids collect most of the seeded sales and reviews, so they are the hot products
+        product = Product.objects.filter(quantity__gt=10).order_by('id').first()
+        if product is None:
+            raise CommandError('No products to benchmark against; seed the database first')
+        shop = Shop.objects.filter(user=user).first()
+        cart = Cart.objects.filter(user=user).order_by('id').first()
+        detail = reverse('product:product-detail', args=[product.id])
+        products = reverse('product:product-list-create')
+        return [
+            Endpoint('user create', 'post', reverse('user:create'), writes=True, authenticated=False,
+                     data=lambda run: {'email': f'benchmark-new-{run}@example.com', 'password': 'secret123',
+                                       'name': 'New'}),
+            Endpoint('user token', 'post', reverse('user:token'), authenticated=False,
+                     data={'email': BENCHMARK_EMAIL, 'password': BENCHMARK_PASSWORD}),
+            Endpoint('user me', 'get', reverse('user:me')),
+            Endpoint('shop list', 'get', reverse('shop:shop-list') + '?name=Shop+12'),
+            Endpoint('shop list async', 'get', reverse('shop:shop-list-async') + '?name=Shop+12'),
+            Endpoint('shop create', 'post', reverse('shop:create'), writes=True,
+                     data=lambda run: {'name': f'Benchmark Shop {run}'}),
+            Endpoint('product list', 'get', products),
+            Endpoint('product list page 500', 'get', products + '?page=500'),
+            Endpoint('product list by shop', 'get', f'{products}?shop={product.shop_id}'),
+            Endpoint('product list by category', 'get', f'{products}?category=Kitchen'),
+            Endpoint('product search', 'get', f'{products}?search=wireless+headphnes'),
+            Endpoint('product cursor', 'get', f'{products}?pagination=cursor&ordering=price'),
+            Endpoint('product list async', 'get', reverse('product:product-list-async')),
+            Endpoint('product create', 'post', products, writes=True,
+                     data={'name': 'Benchmark product', 'price': '9.99', 'quantity': 5, 'shop': shop.id}),
+            Endpoint('product bulk', 'post', reverse('product:product-bulk'), writes=True,
+                     data=[{'name': f'Bulk {i}', 'price': '1.50', 'quantity': 3, 'shop': shop.id} for i in range(100)]),
+            Endpoint('product detail', 'get', detail),
+            Endpoint('product detail async', 'get', reverse('product:product-detail-async', args=[product.id])),
+            Endpoint('product update', 'patch', detail, writes=True, data={'price': '10.50'}),
+            Endpoint('product delete', 'delete', reverse('product:product-detail', args=[product.id + 1]),
+                     writes=True),
+            Endpoint('cart list', 'get', reverse('cart:cart')),
+            Endpoint('cart add', 'post', reverse('cart:cart'), writes=True, data={'product': product.id, 'quantity': 1}),
+            Endpoint('cart batch', 'post', reverse('cart:cart-batch'), writes=True,
+                     data={'add': [{'product': product.id, 'quantity': 1}], 'remove': [product.id + 2]}),
+            Endpoint('cart detail', 'get', reverse('cart:cart-detail', args=[cart.id])),
+            Endpoint('cart update', 'patch', reverse('cart:cart-detail', args=[cart.id]), writes=True,
+                     data={'quantity': 2}),
+            Endpoint('cart clear', 'delete', reverse('cart:cart'), writes=True),
+            Endpoint('checkout', 'post', reverse('cart:checkout'), writes=True),
+            Endpoint('review list', 'get', reverse('review:review-list-create')),
+            Endpoint('product reviews', 'get', reverse('review:product-reviews', args=[product.id])),
+            Endpoint('product reviews async', 'get', reverse('review:product-reviews-async', args=[product.id])),
+            Endpoint('review create', 'post', reverse('review:review-list-create'), writes=True,
+                     data={'product': product.id, 'rating': '4.5', 'message': 'benchmark'}),
+            Endpoint('metrics', 'get', reverse('metrics')),
+            Endpoint('upload info', 'post', reverse('upload-info'),
+                     data={'filename': 'photo.jpg', 'content_type': 'image/jpeg'}),
+            Endpoint('upload info batch', 'post', reverse('upload-info-batch'),
+                     data={'files': [{'filename': f'photo-{i}.jpg', 'content_type': 'image/jpeg'} for i in range(20)]}),
+        ] + self.local_upload_endpoints(user)
+
+    def local_upload_endpoints(self, user):
+        """The local upload routes, which only exist with DEBUG (see emporium/urls.py)"""
+        try:
+            reverse('upload-local')
+        except NoReverseMatch:
+            return []
+        client = APIClient()
+        client.force_authenticate(user=user)
+        size = 2 * len(UPLOAD_BODY)
+        session = client.post(reverse('upload-chunked'), {'filename': 'benchmark.bin', 'size': size}, format='json')
+        if session.status_code != 201:
+            raise CommandError(f'Opening a chunked upload failed: {session.status_code} {session.data}')
+        chunk_url = reverse('upload-chunked-detail', args=[session.data['id']])
+        return [
+            # other bytes every run, so no run is answered as a duplicate
+            Endpoint('upload local', 'post', reverse('upload-local'), writes=True, format='multipart',
+                     data=lambda run: {'filename': 'benchmark.bin',
+                                       'file': SimpleUploadedFile('benchmark.bin', UPLOAD_BODY + str(run).encode())}),
+            Endpoint('upload chunked open', 'post', reverse('upload-chunked'), writes=True,
+                     data={'filename': 'benchmark.bin', 'size': size}),
+            Endpoint('upload chunked status', 'get', chunk_url),
+            Endpoint('upload chunked put', 'put', chunk_url, writes=True, data=UPLOAD_BODY,
+                     content_type='application/octet-stream',
+                     headers={'HTTP_CONTENT_RANGE': f'bytes 0-{len(UPLOAD_BODY) - 1}/{size}'}),
+        ]
+
+    def measure(self, endpoint, user, runs, warmup):
+        client = APIClient()
+        if endpoint.authenticated:
+            client.force_authenticate(user=user)
+        request = getattr(client, endpoint.method)
+        kwargs = {} if endpoint.method == 'get' else {'format': endpoint.format}
+        if endpoint.content_type:
+            kwargs = {'content_type': endpoint.content_type}
+        kwargs.update(endpoint.headers)
+        for run in range(warmup + runs):
+            url = endpoint.resolve(endpoint.url, run)
+            data = endpoint.resolve(endpoint.data, run)
+            samples = endpoint.samples if run >= warmup else []
+            with CaptureQueriesContext(connection) as queries, timer(samples):
+                if endpoint.writes:
+                    with transaction.atomic():
+                        response = request(url, data, **kwargs)
+                        transaction.set_rollback(True)
+                else:
+                    response = request(url, data, **kwargs)
+            if run >= warmup:
+                endpoint.queries.append(len(queries))
+                endpoint.errors += response.status_code >= 400
+
+    def current_commit(self):
+        try:
+            return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
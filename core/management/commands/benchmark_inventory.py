@@ -0,0 +1,70 @@
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core.benchmark import format_summary, summarize, timer, unique_shop_name
+from core.inventory import reshard, take_from_product, take_from_shards
+from core.models import Product, Shop
+
+
+class Command(BaseCommand):
+    help = 'Compare purchase throughput of a hot product sold from one row and from inventory shards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=64, help='concurrent buyer threads')
+        parser.add_argument('--purchases', type=int, default=20, help='purchases per buyer')
+        parser.add_argument('--shards', type=int, default=32)
+        parser.add_argument('--work-ms', type=float, default=2.0,
+                            help='time spent inside each purchase transaction after taking stock, '
+                                 'standing in for the rest of a checkout')
+
+    def handle(self, *args, **options):
+        user, _ = get_user_model().objects.get_or_create(
+            email='benchmark-inventory@example.com', defaults=dict(name='Benchmark'))
+        shop = Shop.objects.create(name=unique_shop_name('Benchmark Inventory Shop'), user=user, created_by=user)
+        stock = options['buyers'] * options['purchases']
+        product = Product.objects.create(name='Flash sale item', quantity=stock, price=1, shop=shop, created_by=user)
+        try:
+            results = {}
+            results['single row'] = self.run(product, take_from_product, options)
+            reshard(product.id, options['shards'], quantity=stock)
+            results[f"{options['shards']} shards"] = self.run(product, take_from_shards, options)
+            for label, (samples, sold, elapsed) in results.items():
+                self.stdout.write(format_summary(label, summarize(samples))
+                                  + f' sold={sold}/{stock} throughput={sold / elapsed:.0f}/s')
+            (_, single_sold, single_elapsed), (_, sharded_sold, sharded_elapsed) = results.values()
+            speedup = (sharded_sold / sharded_elapsed) / (single_sold / single_elapsed)
+            self.stdout.write(self.style.SUCCESS(f'sharded/single throughput: {speedup:.1f}x'))
+        finally:
+            shop.delete()
+
+    def run(self, product, take, options):
+        """Every buyer makes its purchases as fast as it can; returns (latencies, units sold, wall time)"""
+        samples, sold = [], []
+        work = options['work_ms'] / 1000
+        barrier = threading.Barrier(options['buyers'] + 1)
+
+        def buyer():
+            try:
+                barrier.wait()
+                for _ in range(options['purchases']):
+                    with timer(samples):
+                        with transaction.atomic():
+                            taken = take(product.id, 1)
+                            time.sleep(work)
+                    if taken:
+                        sold.append(1)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buyer) for _ in range(options['buyers'])]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        return samples, len(sold), time.perf_counter() - started
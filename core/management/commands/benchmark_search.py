@@ -0,0 +1,85 @@
+import random
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core.benchmark import format_summary, summarize, timer, unique_shop_name
+from core.models import Product, Shop
+from core.search import refresh_search_vector, search_products
+
+ADJECTIVES = ['red', 'blue', 'vintage', 'wireless', 'organic', 'leather', 'compact', 'smart',
+              'classic', 'portable', 'premium', 'ceramic', 'wooden', 'waterproof', 'silver']
+NOUNS = ['headphones', 'keyboard', 'backpack', 'kettle', 'sneakers', 'lamp', 'watch', 'jacket',
+         'speaker', 'notebook', 'bottle', 'charger', 'blender', 'camera', 'wallet']
+CATEGORIES = ['electronics', 'fashion', 'home', 'kitchen', 'outdoors', 'office', 'sports']
+# exact words, partial words and typos, so both the full-text and trigram paths are exercised
+SEARCH_TERMS = ['wireless headphones', 'leather', 'kettle', 'headphnes', 'waterprof jacket',
+                'smart watch', 'eramic', 'portable speaker', 'vintage camera', 'blendr']
+
+
+class Command(BaseCommand):
+    help = 'Compare the ranked product search with the old name ILIKE filter on a seeded catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--runs', type=int, default=20, help='runs per search term')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--keep', action='store_true', help='keep the seeded catalog afterwards')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        shop = self.seed(rng, options['rows'], options['batch_size'])
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE core_product')
+            self.compare(options['runs'])
+        finally:
+            if not options['keep']:
+                self.cleanup(shop)
+
+    def seed(self, rng, rows, batch_size):
+        user, _ = get_user_model().objects.get_or_create(
+            email='benchmark-search@example.com', defaults=dict(name='Benchmark'))
+        shop = Shop.objects.create(name=unique_shop_name('Benchmark Search Shop'), user=user, created_by=user)
+        self.stdout.write(f'Seeding {rows} products...')
+        for start in range(0, rows, batch_size):
+            batch = [
+                Product(name=f'{rng.choice(ADJECTIVES)} {rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}',
+                        category=rng.choice(CATEGORIES),
+                        quantity=rng.randint(0, 50),
+                        price=rng.randint(100, 50000) / 100,
+                        rating=rng.randint(0, 50) / 10,
+                        sold_count=int(rng.paretovariate(1.2)),
+                        shop=shop, created_by=user)
+                for _ in range(min(batch_size, rows - start))
+            ]
+            with transaction.atomic():
+                Product.objects.bulk_create(batch, batch_size=batch_size)
+        # bulk_create skips signals, so fill the search vectors in one pass
+        refresh_search_vector(Product.objects.filter(shop=shop), shop.name)
+        return shop
+
+    def compare(self, runs):
+        base = Product.objects.filter(quantity__gt=0)
+        paths = {
+            'ilike (name__icontains)': lambda term: base.filter(name__icontains=term).order_by('-id'),
+            'ranked search': lambda term: search_products(base, term),
+        }
+        for label, build in paths.items():
+            samples = []
+            hits = 0
+            for term in SEARCH_TERMS:
+                for _ in range(runs):
+                    with timer(samples):
+                        page = list(build(term)[:10])
+                hits += bool(page)
+            self.stdout.write(format_summary(label, summarize(samples))
+                              + f' terms_with_results={hits}/{len(SEARCH_TERMS)}')
+
+    def cleanup(self, shop):
+        # a raw delete avoids loading every seeded row through the deletion collector
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM core_product WHERE shop_id = %s', [shop.id])
+        shop.delete()
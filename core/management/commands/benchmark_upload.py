@@ -0,0 +1,149 @@
+import io
+import json
+import tempfile
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from rest_framework.test import force_authenticate
+
+from core.benchmark import PeakRss
+from core.models import ImageUpload
+from core.views import ChunkedLocalUploadAPIView, ChunkedLocalUploadDetailAPIView, FileLocalUploadAPIView
+
+BENCHMARK_EMAIL = 'benchmark-upload@example.com'
+BOUNDARY = 'benchmarkuploadboundary'
+MB = 1024 * 1024
+FILLER = bytes(range(256)) * 256
+
+
+class SyntheticBody(io.RawIOBase):
+    """A request body of ``size`` generated bytes between ``prefix`` and ``suffix``, made as it is read"""
+
+    def __init__(self, size, prefix=b'', suffix=b'', filler=FILLER):
+        super().__init__()
+        self.filler = filler
+        self.prefix = prefix
+        self.suffix = suffix
+        self.size = size
+        self.length = len(prefix) + size + len(suffix)
+        self.position = 0
+
+    def read(self, size=-1):
+        end = self.length if size is None or size < 0 else min(self.length, self.position + size)
+        pieces = []
+        while self.position < end:
+            body_start = len(self.prefix)
+            body_end = body_start + self.size
+            if self.position < body_start:
+                piece = self.prefix[self.position:end]
+            elif self.position < body_end:
+                piece = self.filler[:min(end, body_end) - self.position]
+            else:
+                piece = self.suffix[self.position - body_end:end - body_end]
+            pieces.append(piece)
+            self.position += len(piece)
+        return b''.join(pieces)
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def readable(self):
+        return True
+
+
+def wsgi_request(method, body, content_type, user, **headers):
+    """A request streaming ``body``; the test client would build the whole body in memory first"""
+    request = WSGIRequest({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': '/api/media/upload/local',
+        'SCRIPT_NAME': '',
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': body,
+        'CONTENT_TYPE': content_type,
+        'CONTENT_LENGTH': str(body.length),
+        **headers,
+    })
+    force_authenticate(request, user)
+    return request
+
+
+class Command(BaseCommand):
+    help = ('Upload large generated files through the local upload endpoints and report the peak RSS growth, '
+            'which stays flat when bodies are streamed to storage')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=100, help='upload size in MB')
+        parser.add_argument('--chunk-size', type=int, default=8, help='chunk size in MB for chunked uploads')
+        parser.add_argument('--max-growth', type=int, default=32,
+                            help='fail when an upload grows the RSS by more than this many MB')
+
+    def handle(self, *args, **options):
+        size = options['size'] * MB
+        chunk_size = options['chunk_size'] * MB
+        if size < 1 or chunk_size < 1:
+            raise CommandError('--size and --chunk-size must be at least 1')
+        user = get_user_model().objects.filter(email=BENCHMARK_EMAIL).first()
+        if user is None:
+            user = get_user_model().objects.create_user(email=BENCHMARK_EMAIL, name='Benchmark')
+
+        failures = []
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+                MEDIA_ROOT=media_root, MEDIA_UPLOAD_MAX_SIZE=size, ALLOWED_HOSTS=['testserver']):
+            try:
+                for mode, upload in (('multipart', self.multipart), ('chunked', self.chunked)):
+                    started = time.perf_counter()
+                    with PeakRss() as rss:
+                        stored = upload(user, size, chunk_size)
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(
+                        f'{mode:<10} {stored / MB:.0f}MB in {elapsed:.2f}s ({stored / MB / max(elapsed, 1e-9):.0f}MB/s) '
+                        f'rss {rss.baseline / MB:.1f}MB -> peak {rss.peak / MB:.1f}MB (+{rss.growth / MB:.1f}MB)')
+                    if stored != size:
+                        failures.append(f'{mode}: stored {stored} of {size} bytes')
+                    if rss.growth > options['max_growth'] * MB:
+                        failures.append(f"{mode}: RSS grew by {rss.growth / MB:.1f}MB")
+            finally:
+                ImageUpload.objects.filter(created_by=user).delete()
+
+        if failures:
+            raise CommandError('Upload memory benchmark failed:\n  ' + '\n  '.join(failures))
+        self.stdout.write(self.style.SUCCESS('RSS stayed flat'))
+
+    def multipart(self, user, size, chunk_size):
+        prefix = (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="filename"\r\n\r\nbenchmark.bin\r\n'
+                  f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="benchmark.bin"\r\n'
+                  f'Content-Type: application/octet-stream\r\n\r\n').encode()
+        body = SyntheticBody(size, prefix, f'\r\n--{BOUNDARY}--\r\n'.encode())
+        response = FileLocalUploadAPIView.as_view()(
+            wsgi_request('POST', body, f'multipart/form-data; boundary={BOUNDARY}', user))
+        if response.status_code != 200:
+            raise CommandError(f'multipart upload failed: {response.status_code} {response.data}')
+        return ImageUpload.objects.get(pk=response.data['id']).size
+
+    def chunked(self, user, size, chunk_size):
+        session = json.dumps({'filename': 'benchmark-chunked.bin', 'size': size}).encode()
+        response = ChunkedLocalUploadAPIView.as_view()(
+            wsgi_request('POST', SyntheticBody(0, session), 'application/json', user))
+        if response.status_code != 201:
+            raise CommandError(f'opening the chunked upload failed: {response.status_code} {response.data}')
+        upload_id = response.data['id']
+        view = ChunkedLocalUploadDetailAPIView.as_view()
+        # other bytes than the multipart upload, which would otherwise be found as a duplicate
+        filler = FILLER[::-1]
+        for start in range(0, size, chunk_size):
+            end = min(start + chunk_size, size) - 1
+            response = view(wsgi_request('PUT', SyntheticBody(end - start + 1, filler=filler),
+                                         'application/octet-stream', user,
+                                         HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{size}'), pk=upload_id)
+            if response.status_code != 200:
+                raise CommandError(f'chunk {start}-{end} failed: {response.status_code} {response.data}')
+        return ImageUpload.objects.get(pk=response.data['id']).size
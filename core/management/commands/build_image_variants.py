@@ -0,0 +1,82 @@
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import groupby
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F
+
+from core import images
+from core.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Build the resized variants of existing product images on parallel worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='worker processes; 0 builds everything in this process')
+        parser.add_argument('--rebuild', action='store_true',
+                            help='rebuild every image, not only those without current variants')
+        parser.add_argument('--max-pending', type=int, default=64,
+                            help='images queued on the workers at a time')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 0 or options['max_pending'] < 1:
+            raise CommandError('--workers must be at least 0 and --max-pending at least 1')
+        products = Product.objects.exclude(image__isnull=True).exclude(image='')
+        if not options['rebuild']:
+            products = products.exclude(image_variants_source=F('image'))
+        # products sharing an image get its variants from a single build
+        rows = products.order_by('image', 'id').values_list('image', 'id').iterator(chunk_size=10_000)
+        groups = ((name, [product_id for _, product_id in group]) for name, group in groupby(rows, lambda row: row[0]))
+
+        if options['workers']:
+            built, failed = self.build_parallel(groups, options['workers'], options['max_pending'])
+        else:
+            built = failed = 0
+            for name, product_ids in groups:
+                product_ids = images.build(product_ids, name)
+                if product_ids is None:
+                    failed += 1
+                else:
+                    images.invalidate_built(product_ids)
+                    built += 1
+                self.report(built, failed)
+
+        message = f'Built variants of {built} image(s)'
+        if failed:
+            self.stdout.write(self.style.WARNING(f'{message}; {failed} could not be read'))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
+
+    def build_parallel(self, groups, workers, max_pending):
+        built = failed = 0
+        pending = set()
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=django.setup) as pool:
+            for name, product_ids in groups:
+                # bounded, so the whole catalog is never queued at once
+                if len(pending) >= max_pending:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    built, failed = self.collect(done, built, failed)
+                pending.add(pool.submit(images.build, product_ids, name))
+            built, failed = self.collect(wait(pending).done, built, failed)
+        return built, failed
+
+    def collect(self, done, built, failed):
+        for future in done:
+            # the workers can't reach this process's cache, so their builds are invalidated here
+            product_ids = future.result()
+            if product_ids is None:
+                failed += 1
+            else:
+                images.invalidate_built(product_ids)
+                built += 1
+            self.report(built, failed)
+        return built, failed
+
+    def report(self, built, failed):
+        if (built + failed) % 1000 == 0:
+            self.stdout.write(f'  {built + failed} image(s) processed')
@@ -0,0 +1,50 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from core.models import ImageUpload, Product
+from core.uploads import delete_stored
+
+
+class Command(BaseCommand):
+    help = ('Delete uploaded images no product uses, and abandoned chunked uploads, together with their files '
+            'and variants, in batches')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=float, default=24,
+                            help='keep unused uploads touched more recently, e.g. still being attached to a product')
+        parser.add_argument('--batch-size', type=int, default=500, help='uploads deleted per transaction')
+        parser.add_argument('--dry-run', action='store_true', help='only report how many uploads would be deleted')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['grace_hours'] < 0:
+            raise CommandError('--batch-size must be at least 1 and --grace-hours at least 0')
+        cutoff = timezone.now() - timedelta(hours=options['grace_hours'])
+        unused = (ImageUpload.objects.filter(ref_count=0, updated_at__lt=cutoff)
+                  # uploads recorded before they had paths have no file to delete
+                  .exclude(path='')
+                  # ref_count is maintained by signals; don't trust it with a file that is still in use
+                  .exclude(Exists(Product.objects.filter(image=OuterRef('path')))))
+
+        if options['dry_run']:
+            self.stdout.write(f'{unused.count()} unused upload(s) to delete')
+            return
+
+        deleted = 0
+        while True:
+            with transaction.atomic():
+                # skip_locked: rows being referenced right now are left for the next run
+                batch = list(unused.select_for_update(skip_locked=True).values_list('pk', 'path')[:options['batch_size']])
+                if not batch:
+                    break
+                ImageUpload.objects.filter(pk__in=[pk for pk, _ in batch]).delete()
+                # files go only once the rows are gone for good; a failure here leaks files, never loses them
+                paths = [path for _, path in batch]
+                transaction.on_commit(lambda paths=paths: delete_stored(paths))
+            deleted += len(batch)
+            self.stdout.write(f'  {deleted} upload(s) deleted')
+
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} unused upload(s)'))
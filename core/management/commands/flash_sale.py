@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.inventory import reshard
+from core.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Split the stock of a hot product over inventory shards (flash-sale mode), or merge it back with --shards 0'
+
+    def add_arguments(self, parser):
+        parser.add_argument('product_id', type=int)
+        parser.add_argument('--shards', type=int, default=16,
+                            help='number of shard rows; 0 puts the stock back on the product row')
+
+    def handle(self, *args, **options):
+        shards = options['shards']
+        if not 0 <= shards <= 1024:
+            raise CommandError('--shards must be between 0 and 1024')
+        try:
+            reshard(options['product_id'], shards)
+        except Product.DoesNotExist:
+            raise CommandError(f"Product {options['product_id']} does not exist")
+        product = Product.objects.with_stock().get(pk=options['product_id'])
+        mode = f'{shards} shard(s)' if shards else 'the product row'
+        self.stdout.write(self.style.SUCCESS(
+            f'Product {product.id}: {product.quantity + product.shard_quantity} unit(s) now held in {mode}'))
@@ -0,0 +1,48 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import datagen, seed
+
+
+class Command(BaseCommand):
+    help = ('Generate users, shops, products, carts, reviews and transactions with Zipfian popularity and '
+            'stream them into Postgres with COPY from parallel worker processes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0,
+                            help='multiplier for the default volumes (1.0 = 100k users, 5k shops, 1M products, '
+                                 '200k cart lines, 5M reviews, 10M transactions)')
+        for table in datagen.DEFAULT_VOLUMES:
+            parser.add_argument(f'--{table}', type=int, help=f'number of {table}, overriding --scale')
+        parser.add_argument('--seed', type=int, default=42, help='the same seed generates the same dataset')
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='worker processes; 0 copies everything in this process')
+        parser.add_argument('--chunk-size', type=int, default=datagen.CHUNK_SIZE, help='rows per COPY')
+        parser.add_argument('--skip-finish', action='store_true',
+                            help="don't rebuild sold counts, review and shop stats and search vectors afterwards")
+
+    def handle(self, *args, **options):
+        volumes = {table: options[table] if options[table] is not None else int(count * options['scale'])
+                   for table, count in datagen.DEFAULT_VOLUMES.items()}
+        if options['workers'] < 0 or options['chunk_size'] < 1:
+            raise CommandError('--workers must be at least 0 and --chunk-size at least 1')
+        self.stdout.write(f"Generating {volumes} with seed {options['seed']} on {options['workers']} worker(s)...")
+
+        started = time.perf_counter()
+        try:
+            copied = datagen.generate(volumes, seed=options['seed'], workers=options['workers'],
+                                      chunk_size=options['chunk_size'], progress=self.report)
+        except ValueError as error:
+            raise CommandError(str(error))
+        elapsed = time.perf_counter() - started
+        total = sum(copied.values())
+        self.stdout.write(f'Copied {total} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f} rows/s)')
+
+        if not options['skip_finish']:
+            seed.finish_seed(stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS('Done; run benchmark_endpoints --skip-seed against this dataset'))
+
+    def report(self, table, done, total):
+        self.stdout.write(f'  {table}: {done}/{total}')
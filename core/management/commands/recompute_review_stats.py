@@ -0,0 +1,63 @@
+from decimal import Decimal
+from functools import reduce
+from operator import or_
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Least, Round
+
+from core.models import Product, Review
+from core.signals import derived_rating
+
+STARS = range(1, 6)
+
+
+def product_reviews():
+    return Review.objects.filter(product=OuterRef('pk')).order_by()
+
+
+def aggregate(reviews, expression, default):
+    """Correlated subquery returning one aggregate over a product's reviews"""
+    return Coalesce(Subquery(reviews.values('product').annotate(total=expression).values('total')),
+                    Value(default))
+
+
+def star_count(star):
+    """Number of a product's reviews that fall in one histogram bucket"""
+    reviews = (product_reviews()
+               # rounded half up like rating_star, then clamped to 1..5
+               .annotate(star=Least(Greatest(Round('rating', output_field=IntegerField()), Value(1),
+                                             output_field=IntegerField()),
+                                    Value(5), output_field=IntegerField()))
+               .filter(star=star))
+    return aggregate(reviews, Count('id'), 0)
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored review stats and rating of every product from its Review rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='only report how many products have drifted')
+
+    def handle(self, *args, **options):
+        rating_sum = aggregate(product_reviews(), Sum('rating'), Decimal('0'))
+        rating_count = aggregate(product_reviews(), Count('id'), 0)
+        actual = {f'rating_{star}_count': star_count(star) for star in STARS}
+        actual.update({
+            'rating_sum': rating_sum,
+            'rating_count': rating_count,
+            'rating': derived_rating(rating_sum, rating_count),
+        })
+        drifted = (Product.objects
+                   .annotate(**{f'actual_{field}': value for field, value in actual.items()})
+                   .filter(reduce(or_, (~Q(**{field: F(f'actual_{field}')}) for field in actual))))
+
+        if options['dry_run']:
+            self.stdout.write(f'{drifted.count()} product(s) have drifted review stats')
+            return
+
+        with transaction.atomic():
+            updated = drifted.update(**actual)
+        self.stdout.write(self.style.SUCCESS(f'Recomputed review stats on {updated} product(s)'))
@@ -0,0 +1,32 @@
+from functools import reduce
+from operator import or_
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Q
+from django.db.models.functions import Now
+
+from core.models import Shop
+from core.signals import shop_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the stored directory stats of every shop from its products and fix any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='only report how many shops have drifted')
+
+    def handle(self, *args, **options):
+        actual = shop_stats()
+        drifted = (Shop.objects
+                   .annotate(**{f'actual_{field}': value for field, value in actual.items()})
+                   .filter(reduce(or_, (~Q(**{field: F(f'actual_{field}')}) for field in actual))))
+
+        if options['dry_run']:
+            self.stdout.write(f'{drifted.count()} shop(s) have drifted stats')
+            return
+
+        with transaction.atomic():
+            updated = drifted.update(**actual, updated_at=Now())
+        self.stdout.write(self.style.SUCCESS(f'Recomputed stats on {updated} shop(s)'))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from core.models import Product, Transaction, shard_total
+
+
+class Command(BaseCommand):
+    help = 'Recompute Product.sold_count from Transaction rows and fix any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='only report how many products have drifted')
+
+    def handle(self, *args, **options):
+        sold = (Transaction.objects.filter(product=OuterRef('pk'))
+                .order_by()
+                .values('product')
+                .annotate(total=Sum('quantity'))
+                .values('total'))
+        # units sold from flash-sale shards are counted there, not in sold_count
+        actual = Coalesce(Subquery(sold), Value(0)) - shard_total('sold')
+        drifted = Product.objects.annotate(actual=actual).exclude(sold_count=F('actual'))
+
+        if options['dry_run']:
+            self.stdout.write(f'{drifted.count()} product(s) have a drifted sold_count')
+            return
+
+        with transaction.atomic():
+            updated = drifted.update(sold_count=actual)
+        self.stdout.write(self.style.SUCCESS(f'Reconciled sold_count on {updated} product(s)'))
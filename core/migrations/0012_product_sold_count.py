@@ -0,0 +1,31 @@
+# Generated by Django 5.1.7 on 2026-10-18 18:41
+
+from django.db import migrations, models
+
+
+BACKFILL_SOLD_COUNT = """
+UPDATE core_product
+SET sold_count = sold.total
+FROM (
+    SELECT product_id, SUM(quantity) AS total
+    FROM core_transaction
+    GROUP BY product_id
+) AS sold
+WHERE sold.product_id = core_product.id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_imageupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='sold_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunSQL(BACKFILL_SOLD_COUNT, reverse_sql=migrations.RunSQL.noop),
+    ]
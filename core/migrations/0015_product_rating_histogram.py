@@ -0,0 +1,67 @@
+# Generated by Django 5.1.7 on 2026-10-18 18:46
+
+from django.db import migrations, models
+
+
+BACKFILL_RATING_HISTOGRAM = """
+UPDATE core_product
+SET rating_1_count = stats.star_1,
+    rating_2_count = stats.star_2,
+    rating_3_count = stats.star_3,
+    rating_4_count = stats.star_4,
+    rating_5_count = stats.star_5
+FROM (
+    SELECT product_id,
+           COUNT(*) FILTER (WHERE star = 1) AS star_1,
+           COUNT(*) FILTER (WHERE star = 2) AS star_2,
+           COUNT(*) FILTER (WHERE star = 3) AS star_3,
+           COUNT(*) FILTER (WHERE star = 4) AS star_4,
+           COUNT(*) FILTER (WHERE star = 5) AS star_5
+    FROM (
+        SELECT product_id, LEAST(GREATEST(ROUND(rating), 1), 5) AS star
+        FROM core_review
+    ) AS stars
+    GROUP BY product_id
+) AS stats
+WHERE stats.product_id = core_product.id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', 'created_at', 'id'], name='review_product_created_id_idx'),
+        ),
+        migrations.RunSQL(BACKFILL_RATING_HISTOGRAM, reverse_sql=migrations.RunSQL.noop),
+    ]
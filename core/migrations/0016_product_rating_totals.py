@@ -0,0 +1,38 @@
+# Generated by Django 5.1.7 on 2026-10-18 18:47
+
+from django.db import migrations, models
+
+
+BACKFILL_RATING_TOTALS = """
+UPDATE core_product
+SET rating_sum = stats.total,
+    rating_count = stats.reviews,
+    rating = ROUND(stats.total / stats.reviews, 1)
+FROM (
+    SELECT product_id, SUM(rating) AS total, COUNT(*) AS reviews
+    FROM core_review
+    GROUP BY product_id
+) AS stats
+WHERE stats.product_id = core_product.id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_product_rating_histogram'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.DecimalField(decimal_places=1, default=0, max_digits=14),
+        ),
+        migrations.RunSQL(BACKFILL_RATING_TOTALS, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.1.7 on 2026-10-18 18:53
+
+from django.db import migrations, models
+
+
+# fold duplicate lines into the oldest one before the constraint goes on
+MERGE_DUPLICATE_CART_LINES = [
+    """
+    UPDATE core_cart
+    SET quantity = merged.total
+    FROM (
+        SELECT MIN(id) AS keep_id, SUM(quantity) AS total
+        FROM core_cart
+        GROUP BY user_id, product_id
+        HAVING COUNT(*) > 1
+    ) AS merged
+    WHERE core_cart.id = merged.keep_id
+    """,
+    """
+    DELETE FROM core_cart AS duplicate
+    USING core_cart AS kept
+    WHERE duplicate.user_id = kept.user_id
+      AND duplicate.product_id = kept.product_id
+      AND duplicate.id > kept.id
+    """,
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_product_rating_totals'),
+    ]
+
+    operations = [
+        migrations.RunSQL(MERGE_DUPLICATE_CART_LINES, reverse_sql=migrations.RunSQL.noop),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='cart_unique_user_product'),
+        ),
+    ]
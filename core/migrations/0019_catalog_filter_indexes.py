@@ -0,0 +1,26 @@
+# Generated by Django 5.1.7 on 2026-10-18 19:02
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_inventory_shards'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('quantity__gt', 0), ('inventory_shards__gt', 0), _connector='OR'), fields=['created_at', 'id'], name='product_in_stock_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('quantity__gt', 0), ('inventory_shards__gt', 0), _connector='OR'), fields=['shop', 'created_at', 'id'], name='product_shop_in_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(django.db.models.functions.text.Upper('category'), models.F('created_at'), models.F('id'), condition=models.Q(('quantity__gt', 0), ('inventory_shards__gt', 0), _connector='OR'), name='product_category_in_stock_idx'),
+        ),
+    ]
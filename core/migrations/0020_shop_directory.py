@@ -0,0 +1,102 @@
+# Generated by Django 5.1.7 on 2026-10-18 19:14
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations, models
+
+
+# Shop names become unique case-insensitively. Existing duplicates are renamed
+# rather than rejected: every one but the oldest gets " #<id>" appended (the
+# name is cut short to fit 100 characters). The new names are user-visible.
+RENAME_DUPLICATE_SHOPS = """
+    UPDATE core_shop AS duplicate
+    SET name = LEFT(duplicate.name, 100 - LENGTH(' #' || duplicate.id)) || ' #' || duplicate.id
+    WHERE EXISTS (
+        SELECT 1 FROM core_shop AS kept
+        WHERE UPPER(kept.name) = UPPER(duplicate.name) AND kept.id < duplicate.id
+    )
+"""
+
+BACKFILL_SHOP_STATS = """
+    UPDATE core_shop
+    SET product_count = stats.products,
+        in_stock_count = stats.in_stock,
+        sold_count = stats.sold,
+        rating_sum = stats.rating_sum,
+        rating_count = stats.rating_count,
+        rating = CASE WHEN stats.rating_count > 0 THEN ROUND(stats.rating_sum / stats.rating_count, 1) ELSE 0 END
+    FROM (
+        SELECT product.shop_id,
+               COUNT(*) AS products,
+               COUNT(*) FILTER (WHERE product.quantity > 0 OR product.inventory_shards > 0) AS in_stock,
+               SUM(product.sold_count + COALESCE(
+                   (SELECT SUM(shard.sold) FROM core_inventoryshard AS shard WHERE shard.product_id = product.id), 0)
+               ) AS sold,
+               SUM(product.rating_sum) AS rating_sum,
+               SUM(product.rating_count) AS rating_count
+        FROM core_product AS product
+        GROUP BY product.shop_id
+    ) AS stats
+    WHERE core_shop.id = stats.shop_id
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_catalog_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shop',
+            name='in_stock_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='product_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='rating',
+            field=models.DecimalField(decimal_places=1, default=0, max_digits=2),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='rating_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='rating_sum',
+            field=models.DecimalField(decimal_places=1, default=0, max_digits=14),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='sold_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunSQL(BACKFILL_SHOP_STATS, reverse_sql=migrations.RunSQL.noop),
+        migrations.RunSQL(RENAME_DUPLICATE_SHOPS, reverse_sql=migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='shop',
+            index=django.contrib.postgres.indexes.GinIndex(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper('name'), name='gin_trgm_ops'), name='shop_name_trgm_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shop',
+            index=models.Index(fields=['name', 'id'], name='shop_name_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shop',
+            index=models.Index(fields=['created_at', 'id'], name='shop_created_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shop',
+            index=models.Index(fields=['sold_count', 'id'], name='shop_sold_id_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='shop',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Upper('name'), name='shop_unique_upper_name'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.7 on 2026-10-18 19:18
+
+from django.db import migrations, models
+
+# uploads recorded before chunked uploads existed were all single requests, finished when saved
+COMPLETE_EXISTING_UPLOADS = "UPDATE core_imageupload SET completed_at = updated_at WHERE completed_at IS NULL"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_shop_directory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageupload',
+            name='completed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='expected_size',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='path',
+            field=models.CharField(blank=True, default=''),
+        ),
+        migrations.AlterField(
+            model_name='imageupload',
+            name='size',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.RunSQL(COMPLETE_EXISTING_UPLOADS, reverse_sql=migrations.RunSQL.noop),
+    ]
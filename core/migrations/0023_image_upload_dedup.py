@@ -0,0 +1,43 @@
+# Generated by Django 5.1.7 on 2026-10-18 19:25
+
+from django.db import migrations, models
+
+# uploads already used as product images
+COUNT_REFERENCES = """
+UPDATE core_imageupload u
+SET ref_count = (SELECT count(*) FROM core_product p WHERE p.image = u.path)
+WHERE u.path <> ''
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_product_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageupload',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='imageupload',
+            name='ref_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='imageupload',
+            index=models.Index(fields=['path'], name='image_upload_path_idx'),
+        ),
+        migrations.RunSQL(COUNT_REFERENCES, reverse_sql=migrations.RunSQL.noop),
+        migrations.AddIndex(
+            model_name='imageupload',
+            index=models.Index(condition=models.Q(('ref_count', 0)), fields=['updated_at'], name='image_upload_unused_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='imageupload',
+            constraint=models.UniqueConstraint(condition=models.Q(('completed_at__isnull', False), models.Q(('content_hash', ''), _negated=True)), fields=('content_hash',), name='image_upload_unique_content_hash'),
+        ),
+    ]
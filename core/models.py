@@ -1,12 +1,15 @@
-from django.db import models
+from django.db import connections, models, transaction
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
     PermissionsMixin
 )
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Upper
 from django.conf import settings
-from decimal import Decimal
 
 
 class UserManager(BaseUserManager):
@@ -33,6 +36,8 @@ class User(AbstractBaseUser, PermissionsMixin):
     email = models.EmailField(max_length=255, unique=True)
     name = models.CharField(max_length=255)
     is_staff = models.BooleanField(default=False)
+    # lets responses embedding a user (e.g. a review's author) notice a rename, see core.conditional
+    updated_at = models.DateTimeField(auto_now=True)
 
     objects = UserManager()
 
@@ -48,10 +53,58 @@ class Entity(models.Model):
         abstract = True
 
 
+SHOP_NAME_CONSTRAINT = 'shop_unique_upper_name'
+
+
 class Shop(Entity):
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    # directory stats over the shop's products, maintained by core.signals
+    product_count = models.IntegerField(default=0)
+    in_stock_count = models.IntegerField(default=0)
+    # units sold, including flash-sale shard sales
+    sold_count = models.IntegerField(default=0)
+    rating_sum = models.DecimalField(max_digits=14, decimal_places=1, default=0)
+    rating_count = models.IntegerField(default=0)
+    # average over every review of the shop's products
+    rating = models.DecimalField(max_digits=2, decimal_places=1, default=0)
+
+    class Meta:
+        constraints = [
+            # case-insensitive; name__iexact compiles to UPPER() and can use it too
+            models.UniqueConstraint(Upper('name'), name=SHOP_NAME_CONSTRAINT),
+        ]
+        indexes = [
+            # name__icontains compiles to UPPER(name) LIKE, which this index serves
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='shop_name_trgm_idx'),
+            # directory sort keys (see shop.views.ListShopView)
+            models.Index(fields=['name', 'id'], name='shop_name_id_idx'),
+            models.Index(fields=['created_at', 'id'], name='shop_created_id_idx'),
+            models.Index(fields=['sold_count', 'id'], name='shop_sold_id_idx'),
+        ]
+
+
+def shard_total(field):
+    """Sum of an InventoryShard column for the outer product, 0 when it has no shards"""
+    shards = InventoryShard.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    return Coalesce(Subquery(shards.annotate(total=Sum(field)).values('total')), Value(0))
+
+
+# products the catalog lists: stock on the row, or in flash-sale shards. Partial
+# indexes below use this exact predicate so the planner can match it.
+IN_STOCK = models.Q(quantity__gt=0) | models.Q(inventory_shards__gt=0)
+
+
+class ProductQuerySet(models.QuerySet):
+
+    def with_stock(self):
+        """
+        Annotate the units held in inventory shards. A product's stock is
+        quantity + shard_quantity and its sales sold_count + shard_sold; both
+        shard sums are 0 for products that aren't in flash-sale mode.
+        """
+        return self.annotate(shard_quantity=shard_total('quantity'), shard_sold=shard_total('sold'))
 
 
 class Product(Entity):
@@ -63,6 +116,91 @@ class Product(Entity):
     variations = ArrayField(models.CharField(max_length=50), blank=True, default=list)
     rating = models.DecimalField(max_digits=2, decimal_places=1, default=0)
     category = models.CharField(max_length=50, blank=True)
+    # denormalized sum of Transaction.quantity, kept in step by core.signals
+    sold_count = models.IntegerField(default=0)
+    # running review totals, maintained by core.signals; rating is derived from them
+    rating_sum = models.DecimalField(max_digits=14, decimal_places=1, default=0)
+    rating_count = models.IntegerField(default=0)
+    # review counts per star (rating rounded half up), maintained by core.signals
+    rating_1_count = models.IntegerField(default=0)
+    rating_2_count = models.IntegerField(default=0)
+    rating_3_count = models.IntegerField(default=0)
+    rating_4_count = models.IntegerField(default=0)
+    rating_5_count = models.IntegerField(default=0)
+    # name, category and shop name, maintained by core.signals (see core.search)
+    search_vector = SearchVectorField(null=True, editable=False)
+    # flash-sale mode: stock is split across this many InventoryShard rows (see core.inventory)
+    inventory_shards = models.PositiveSmallIntegerField(default=0)
+    # resized copies of image, {variant: {format: storage name}}, and the image they were built from (see core.images)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    image_variants_source = models.CharField(blank=True, default='', editable=False)
+
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='product_search_vector_idx'),
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'), name='product_name_trgm_idx'),
+            # keyset pagination sort keys (see core.pagination.KeysetPagination)
+            models.Index(fields=['created_at', 'id'], name='product_created_id_idx'),
+            models.Index(fields=['price', 'id'], name='product_price_id_idx'),
+            # catalog listing filters (see product.views.catalog_products); category__iexact compiles to UPPER()
+            models.Index(fields=['created_at', 'id'], condition=IN_STOCK, name='product_in_stock_created_idx'),
+            models.Index(fields=['shop', 'created_at', 'id'], condition=IN_STOCK, name='product_shop_in_stock_idx'),
+            models.Index(Upper('category'), F('created_at'), F('id'), condition=IN_STOCK,
+                         name='product_category_in_stock_idx'),
+        ]
+
+
+class InventoryShard(models.Model):
+    """
+    One slice of a flash-sale product's stock. Buyers take units from a random
+    shard, so concurrent purchases lock different rows instead of queueing on
+    the product row.
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='inventory')
+    index = models.PositiveSmallIntegerField()
+    quantity = models.IntegerField(default=0)
+    # units sold from this shard, not yet folded into Product.sold_count
+    sold = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'index'], name='inventory_shard_unique_index'),
+            models.CheckConstraint(condition=models.Q(quantity__gte=0), name='inventory_shard_quantity_gte_0'),
+        ]
+
+
+class CartManager(models.Manager):
+
+    def upsert(self, user, lines, increment=True):
+        """
+        Write many (product_id, quantity) lines of a user's cart in one
+        INSERT ... ON CONFLICT statement. Existing lines get the quantity added
+        (increment=True) or replaced. Returns the ids of the written rows.
+        """
+        # a statement may touch each row once, so repeated products are merged first
+        merged = {}
+        for product_id, quantity in lines:
+            merged[product_id] = merged.get(product_id, 0) + quantity if increment else quantity
+        if not merged:
+            return []
+        table = self.model._meta.db_table
+        conflict_quantity = f'{table}.quantity + EXCLUDED.quantity' if increment else 'EXCLUDED.quantity'
+        placeholders = ', '.join(['(%s, %s, %s, %s, now(), now())'] * len(merged))
+        params = []
+        for product_id, quantity in merged.items():
+            params.extend([user.pk, product_id, quantity, user.pk])
+        sql = (
+            f'INSERT INTO {table} (user_id, product_id, quantity, created_by_id, created_at, updated_at) '
+            f'VALUES {placeholders} '
+            f'ON CONFLICT (user_id, product_id) DO UPDATE '
+            f'SET quantity = {conflict_quantity}, updated_at = EXCLUDED.updated_at '
+            f'RETURNING id'
+        )
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
 
 
 class Cart(Entity):
@@ -70,6 +208,17 @@ class Cart(Entity):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.IntegerField(default=0)
 
+    objects = CartManager()
+
+    class Meta:
+        constraints = [
+            # one line per product; adding again increments it (see CartManager.upsert)
+            models.UniqueConstraint(fields=['user', 'product'], name='cart_unique_user_product'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'created_at', 'id'], name='cart_user_created_id_idx'),
+        ]
+
 
 class Review(Entity):
     message = models.TextField(blank=True)
@@ -77,6 +226,17 @@ class Review(Entity):
     product = models.ForeignKey(Product, related_name="reviews", on_delete=models.CASCADE)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='review_created_id_idx'),
+            models.Index(fields=['product', 'created_at', 'id'], name='review_product_created_id_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        # the row write and the product's review stats must commit together
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 
 class Transaction(Entity):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -85,8 +245,37 @@ class Transaction(Entity):
     item_price_at_purchase = models.DecimalField(max_digits=12, decimal_places=2)
     total = models.DecimalField(max_digits=12, decimal_places=2)
 
+    def save(self, *args, **kwargs):
+        # the row write and the Product.sold_count update must commit together
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+IMAGE_UPLOAD_HASH_CONSTRAINT = 'image_upload_unique_content_hash'
+
 
 class ImageUpload(Entity):
     name = models.CharField()
     image_url = models.URLField()
-    size = models.DecimalField(max_digits=12, default=Decimal("0.00"), decimal_places=2)
+    # bytes received so far, i.e. the resume offset of a chunked upload; the final size once completed
+    size = models.PositiveBigIntegerField(default=0)
+    # the file's name in default_storage
+    path = models.CharField(blank=True, default='')
+    # total announced by the client, if any
+    expected_size = models.PositiveBigIntegerField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    # hex SHA-256 of the bytes, set on completion; the same bytes are stored only once (see core.uploads)
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+    # products whose image this is, maintained by core.signals; unused uploads are collected in batches
+    ref_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['content_hash'], name=IMAGE_UPLOAD_HASH_CONSTRAINT,
+                                    condition=models.Q(completed_at__isnull=False) & ~models.Q(content_hash='')),
+        ]
+        indexes = [
+            models.Index(fields=['path'], name='image_upload_path_idx'),
+            # candidates for collect_image_uploads
+            models.Index(fields=['updated_at'], condition=models.Q(ref_count=0), name='image_upload_unused_idx'),
+        ]
@@ -1,6 +1,364 @@
-from rest_framework.pagination import PageNumberPagination
+import asyncio
+import hashlib
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from functools import partial, reduce
+from operator import or_
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+COUNT_EXACT = 'exact'
+COUNT_CAPPED = 'capped'
+COUNT_ESTIMATE = 'estimate'
+COUNT_CACHED = 'cached'
+
+
+class ApproximatePage(Page):
+    """Page whose total may be approximate, so "is there more" comes from the rows themselves"""
+
+    def has_next(self):
+        if self.paginator.count_is_exact:
+            return super().has_next()
+        return len(self.object_list) == self.paginator.per_page
+
+
+class CountingPaginator(Paginator):
+    """Django paginator that takes its total from a pluggable count strategy"""
+
+    def __init__(self, object_list, per_page, counter=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.counter = counter
+        self.count_strategy = COUNT_EXACT
+        self.count_is_exact = True
+
+    @property
+    def count(self):
+        if not hasattr(self, '_count'):
+            if self.counter is None:
+                self._count = super().count
+            else:
+                self._count, self.count_strategy, self.count_is_exact = self.counter(self.object_list)
+        return self._count
+
+    def validate_number(self, number):
+        self.count  # resolve the strategy before deciding how strict to be
+        if self.count_is_exact:
+            return super().validate_number(number)
+        # an estimated or capped total must not hide pages that do exist
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(self.error_messages['invalid_page'])
+        if number < 1:
+            raise EmptyPage(self.error_messages['min_page'])
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        if self.count_is_exact:
+            return super().page(number)
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
+
+    def _get_page(self, *args, **kwargs):
+        return ApproximatePage(*args, **kwargs)
+
 
 class CustomPagination(PageNumberPagination):
+    """
+    Page-number pagination with a configurable way of producing the total.
+
+    exact     plain COUNT(*)
+    capped    COUNT(*) over at most ``count_cap`` + 1 rows, reported as the cap beyond that
+    estimate  planner row estimate (pg_class.reltuples or EXPLAIN), exact for small results
+    cached    exact COUNT(*) cached for ``count_cache_timeout`` seconds per filter set
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    count_strategy = COUNT_EXACT
+    count_cap = 10_000
+    count_cache_timeout = 30
+    # below this many estimated rows an exact count is cheap and estimates are unreliable
+    estimate_threshold = 1_000
+
+    def __init__(self, count_strategy=None):
+        if count_strategy:
+            self.count_strategy = count_strategy
+        self.django_paginator_class = partial(CountingPaginator, counter=self.count_queryset)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        paginator = self.page.paginator
+        response.data['count_strategy'] = paginator.count_strategy
+        response.data['count_is_exact'] = paginator.count_is_exact
+        return response
+
+    def count_queryset(self, queryset):
+        """Return (count, strategy used, whether the count is exact)"""
+        counters = {
+            COUNT_EXACT: self.exact_count,
+            COUNT_CAPPED: self.capped_count,
+            COUNT_ESTIMATE: self.estimated_count,
+            COUNT_CACHED: self.cached_count,
+        }
+        return counters[self.count_strategy](queryset)
+
+    def exact_count(self, queryset):
+        return queryset.count(), COUNT_EXACT, True
+
+    def capped_count(self, queryset):
+        count = queryset.order_by()[:self.count_cap + 1].count()
+        if count > self.count_cap:
+            return self.count_cap, COUNT_CAPPED, False
+        return count, COUNT_CAPPED, True
+
+    def estimated_count(self, queryset):
+        estimate = planner_estimate(queryset)
+        if estimate is None or estimate < self.estimate_threshold:
+            return self.exact_count(queryset)
+        return estimate, COUNT_ESTIMATE, False
+
+    def cached_count(self, queryset):
+        sql, params = queryset.order_by().query.sql_with_params()
+        digest = hashlib.sha1(repr((sql, params)).encode()).hexdigest()
+        key = f'pagination:count:{queryset.model._meta.label_lower}:{digest}'
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, self.count_cache_timeout)
+        return count, COUNT_CACHED, True
+
+
+def planner_estimate(queryset):
+    """
+    Row estimate for a queryset without running it.
+    Unfiltered querysets read pg_class.reltuples; filtered ones ask EXPLAIN.
+    Returns None when the planner has no statistics for the table yet.
+    """
+    connection = connections[queryset.db]
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                           [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            estimate = row[0] if row else -1
+        else:
+            sql, params = queryset.order_by().query.sql_with_params()
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            estimate = plan[0]['Plan']['Plan Rows']
+    # reltuples is -1 for tables that were never vacuumed or analyzed
+    return int(estimate) if estimate >= 0 else None
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a unique sort key, e.g. (created_at, id).
+    Each page is a range scan on a matching composite index instead of an OFFSET,
+    so deep pages cost the same as the first one and no COUNT(*) is issued.
+    """
     page_size = 10
     page_size_query_param = 'page_size'
-    max_page_size = 100
\ No newline at end of file
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self, orderings, default_ordering=None):
+        # orderings maps the public sort key to the model fields it orders by;
+        # the last field must be unique (normally id) so positions are stable
+        self.orderings = orderings
+        self.default_ordering = default_ordering or next(iter(orderings))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering_key = request.query_params.get(self.ordering_query_param, self.default_ordering)
+        if self.ordering_key not in self.orderings:
+            raise ValidationError({self.ordering_query_param: f'Unsupported ordering for cursor pagination: {self.ordering_key}'})
+        self.ordering = self.orderings[self.ordering_key]
+
+        position, reverse = self.decode_cursor(request)
+        ordering = [self.flip(field) for field in self.ordering] if reverse else list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self.after(queryset.model, ordering, position))
+
+        # fetch one extra row to know whether there is a page beyond this one
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.has_next = has_more if not reverse else position is not None
+        self.has_previous = position is not None if not reverse else has_more
+        self.first_position = self.position_of(results[0]) if results else None
+        self.last_position = self.position_of(results[-1]) if results else None
+        if not results and position is not None:
+            # an empty page still needs a way back to where the client came from
+            self.first_position = self.last_position = position
+            self.has_next, self.has_previous = reverse, not reverse
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next or self.last_position is None:
+            return None
+        return self.build_link(self.last_position, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or self.first_position is None:
+            return None
+        return self.build_link(self.first_position, reverse=True)
+
+    def build_link(self, position, reverse):
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, 'page')
+        url = replace_query_param(url, 'pagination', 'cursor')
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(position, reverse))
+
+    def encode_cursor(self, position, reverse):
+        payload = {'o': self.ordering_key, 'p': position, 'r': reverse}
+        return urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+            position, reverse = payload['p'], bool(payload['r'])
+            # positions are only ever written as lists of strings, see position_of
+            valid = (payload['o'] == self.ordering_key and isinstance(position, list)
+                     and len(position) == len(self.ordering) and all(isinstance(value, str) for value in position))
+        except (TypeError, ValueError, KeyError):
+            valid = False
+        if not valid:
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def position_of(self, instance):
+        values = []
+        for field in self.ordering:
+            value = getattr(instance, field.lstrip('-'))
+            values.append(value.isoformat() if hasattr(value, 'isoformat') else str(value))
+        return values
+
+    def after(self, model, ordering, position):
+        """
+        Build (a, b) > (x, y) as (a > x) OR (a = x AND b > y), honouring each
+        field's direction, so mixed ASC/DESC keys can use the same index.
+        """
+        try:
+            values = [model._meta.get_field(field.lstrip('-')).to_python(value)
+                      for field, value in zip(ordering, position)]
+        except (DjangoValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+        clauses = []
+        for index, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {ordering[i].lstrip('-'): values[i] for i in range(index)}
+            clauses.append(Q(**equal, **{f'{name}__{lookup}': values[index]}))
+        return reduce(or_, clauses)
+
+    @staticmethod
+    def flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+
+def wants_cursor_pagination(request):
+    """Clients opt in with ?pagination=cursor, or by following a cursor link"""
+    return (request.query_params.get('pagination') == 'cursor'
+            or KeysetPagination.cursor_query_param in request.query_params)
+
+
+def get_paginator(request, cursor_orderings=None, count_strategy=None):
+    """Page-number pagination stays the default until clients ask for cursors"""
+    if cursor_orderings and wants_cursor_pagination(request):
+        return KeysetPagination(cursor_orderings)
+    return CustomPagination(count_strategy=count_strategy)
+
+
+async def apaginate(request, queryset, serialize):
+    """
+    Page-number pagination for the async views, in the response shape of
+    CustomPagination with the capped count strategy. The count and the page are
+    independent queries and are awaited together. Returns None for a page that
+    doesn't exist.
+    """
+    params = request.GET
+    try:
+        page_size = int(params[CustomPagination.page_size_query_param])
+    except (KeyError, ValueError):
+        page_size = CustomPagination.page_size
+    if page_size <= 0:
+        page_size = CustomPagination.page_size
+    page_size = min(page_size, CustomPagination.max_page_size)
+    try:
+        page = int(params.get('page', 1))
+    except ValueError:
+        return None
+    if page < 1:
+        return None
+
+    bottom = (page - 1) * page_size
+    cap = CustomPagination.count_cap
+    count, rows = await asyncio.gather(
+        queryset.order_by()[:cap + 1].acount(),
+        alist(queryset[bottom:bottom + page_size]),
+    )
+    count_is_exact = count <= cap
+    count = min(count, cap)
+    if not rows and page > 1:
+        return None
+
+    has_next = bottom + len(rows) < count if count_is_exact else len(rows) == page_size
+    url = request.build_absolute_uri()
+    next_link = replace_query_param(url, 'page', page + 1) if has_next else None
+    previous_link = None
+    if page == 2:
+        previous_link = remove_query_param(url, 'page')
+    elif page > 2:
+        previous_link = replace_query_param(url, 'page', page - 1)
+    return {
+        'count': count,
+        'next': next_link,
+        'previous': previous_link,
+        'results': serialize(rows),
+        'count_strategy': COUNT_CAPPED,
+        'count_is_exact': count_is_exact,
+    }
+
+
+async def alist(queryset):
+    return [item async for item in queryset]
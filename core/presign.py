@@ -0,0 +1,97 @@
+"""
+Where clients upload their images to, one target per file.
+
+With IS_LOCAL, files go to the local upload endpoint (see core.uploads);
+otherwise they go straight to S3 with a presigned PUT. Presigning is computed
+locally and needs no network round trip, so a batch of targets costs about as
+much as one. Creating the boto3 client is the expensive part, so it happens on
+first use and the client is then shared by every request of the process
+(boto3 clients are thread-safe).
+"""
+import threading
+import uuid
+
+import boto3
+from botocore.config import Config
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils.text import get_valid_filename
+
+from core import uploads
+
+_s3 = None
+_s3_lock = threading.Lock()
+
+
+def get_s3_client():
+    global _s3
+    with _s3_lock:
+        if _s3 is None:
+            _s3 = boto3.client(
+                "s3",
+                aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+                region_name=settings.AWS_S3_REGION_NAME,
+                config=Config(signature_version="s3v4"),
+            )
+        return _s3
+
+
+def reset_s3_client():
+    global _s3
+    with _s3_lock:
+        _s3 = None
+
+
+def unique_name(filename):
+    # the uuid keeps names from colliding; get_valid_filename keeps the client's name out of other directories
+    return f"{uuid.uuid4()}_{get_valid_filename(filename)}"
+
+
+class LocalStrategy:
+    """Targets on the local upload endpoint, for development and tests; no network involved"""
+    name = "local"
+
+    def target(self, request, filename, content_type):
+        name = unique_name(filename)
+        return {
+            "strategy": self.name,
+            "upload_url": request.build_absolute_uri("/api/media/upload/local"),
+            # sent back as the filename of the upload, so the file lands at image_url
+            "filename": name,
+            "image_url": request.build_absolute_uri(default_storage.url(uploads.storage_name(name))),
+        }
+
+
+class S3Strategy:
+    """Presigned PUTs straight to the bucket"""
+    name = "s3"
+
+    def __init__(self, client=None):
+        self.client = client
+
+    def target(self, request, filename, content_type):
+        key = uploads.storage_name(unique_name(filename))
+        client = self.client or get_s3_client()
+        upload_url = client.generate_presigned_url(
+            "put_object",
+            Params={
+                "Bucket": settings.AWS_STORAGE_BUCKET_NAME,
+                "Key": key,
+                "ContentType": content_type,
+            },
+            ExpiresIn=settings.S3_PRESIGN_EXPIRES,
+        )
+        return {
+            "strategy": self.name,
+            "upload_url": upload_url,
+            "image_url": f"https://{settings.AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com/{key}",
+        }
+
+
+def get_strategy():
+    return LocalStrategy() if settings.IS_LOCAL else S3Strategy()
+
+
+def existing_target(upload):
+    return {"strategy": "existing", "id": upload.id, "image_url": upload.image_url}
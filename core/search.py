@@ -0,0 +1,53 @@
+from django.contrib.postgres.search import (SearchQuery, SearchRank, SearchVector,
+                                            TrigramWordSimilarity)
+from django.db.models import CharField, F, FloatField, Q, Value
+from django.db.models.functions import Cast, Greatest, Log, Upper
+
+SEARCH_CONFIG = 'english'
+
+# relevance = text match blended with the product's rating and sales
+TEXT_WEIGHT = 0.7
+RATING_WEIGHT = 0.15
+SALES_WEIGHT = 0.15
+# log10(sold_count + 1) reaches 1.0 at this many sales
+SALES_SCALE = 6
+
+
+def product_search_vector(shop_name):
+    """
+    Build the SearchVector stored on Product.search_vector.
+    The shop name is passed in as a value because an UPDATE can't join core_shop.
+    """
+    return (SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector('category', weight='B', config=SEARCH_CONFIG)
+            + SearchVector(Value(shop_name, output_field=CharField()), weight='C', config=SEARCH_CONFIG))
+
+
+def refresh_search_vector(products, shop_name):
+    """Recompute the stored search vector for every product in the queryset"""
+    return products.update(search_vector=product_search_vector(shop_name))
+
+
+def search_products(queryset, term):
+    """
+    Filter and rank products matching a search term.
+    Full-text matches use the GIN index on search_vector; typos and partial words
+    fall back to the trigram index on UPPER(name).
+    """
+    query = SearchQuery(term, search_type='websearch', config=SEARCH_CONFIG)
+    text_score = Greatest(
+        SearchRank(F('search_vector'), query),
+        TrigramWordSimilarity(term, Upper('name')),
+    )
+    rating_score = Cast('rating', FloatField()) / 5
+    sales_score = Log(10, F('sold_count') + 1) / SALES_SCALE
+
+    return (queryset
+            .alias(name_upper=Upper('name'))
+            .filter(Q(search_vector=query)
+                    | Q(name_upper__trigram_word_similar=term)
+                    | Q(name_upper__contains=term.upper()))
+            .annotate(relevance=TEXT_WEIGHT * text_score
+                      + RATING_WEIGHT * rating_score
+                      + SALES_WEIGHT * sales_score)
+            .order_by('-relevance', '-id'))
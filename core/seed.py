@@ -0,0 +1,138 @@
+"""
+Large synthetic datasets for the benchmark commands.
+
+Rows are generated inside Postgres with INSERT ... SELECT over generate_series,
+a batch per statement, so seeding millions of rows never round-trips them
+through Python. Signals don't fire for these inserts; the stored counters and
+search vectors are rebuilt afterwards by finish_seed().
+"""
+from django.core.management import call_command
+from django.db import connection
+
+from core.models import Cart, Product, Review, Shop, Transaction, User
+from core.search import refresh_search_vector
+
+SEED_EMAIL_DOMAIN = 'seed.example.com'
+SEED_SHOP_PREFIX = 'Seed Shop'
+ADJECTIVES = ['red', 'blue', 'vintage', 'wireless', 'organic', 'leather', 'compact', 'smart',
+              'classic', 'portable', 'premium', 'ceramic', 'wooden', 'waterproof', 'silver']
+NOUNS = ['headphones', 'keyboard', 'backpack', 'kettle', 'sneakers', 'lamp', 'watch', 'jacket',
+         'speaker', 'notebook', 'bottle', 'charger', 'blender', 'camera', 'wallet']
+CATEGORIES = ['electronics', 'fashion', 'home', 'kitchen', 'outdoors', 'office', 'sports']
+
+DEFAULT_VOLUMES = {
+    'users': 100_000,
+    'shops': 5_000,
+    'products': 1_000_000,
+    'transactions': 10_000_000,
+    'reviews': 5_000_000,
+}
+
+
+def sql_array(values):
+    return 'ARRAY[' + ', '.join(f"'{value}'" for value in values) + ']'
+
+
+def pick(array_sql, seed_sql):
+    """SQL picking an element of a literal array from an integer expression"""
+    return f'({array_sql})[1 + ({seed_sql}) %% {array_sql.count(",") + 1}]'
+
+
+def id_range(cursor, table, where, params):
+    cursor.execute(f'SELECT min(id), max(id) FROM {table} WHERE {where}', params)
+    return cursor.fetchone()
+
+
+def random_id(bounds, skew=1):
+    """
+    SQL for a random id within bounds. skew > 1 favours low ids (random()^skew),
+    so a few products collect most of the sales and reviews, like a real catalog.
+    """
+    low, high = bounds
+    return f'{low} + floor(power(random(), {skew}) * {high - low + 1})::bigint'
+
+
+def insert_batches(cursor, total, batch_size, sql, progress=None):
+    for start in range(0, total, batch_size):
+        cursor.execute(sql, [start + 1, min(start + batch_size, total)])
+        if progress:
+            progress(min(start + batch_size, total), total)
+
+
+def seed(volumes=None, batch_size=500_000, random_seed=0.42, progress=None):
+    """
+    Insert users, shops, products, transactions and reviews in the given
+    volumes (see DEFAULT_VOLUMES). Returns the (min id, max id) of each table's
+    seeded rows.
+    """
+    volumes = {**DEFAULT_VOLUMES, **(volumes or {})}
+    report = (lambda table: (lambda done, total: progress(table, done, total))) if progress else (lambda table: None)
+    adjectives, nouns, categories = sql_array(ADJECTIVES), sql_array(NOUNS), sql_array(CATEGORIES)
+    ranges = {}
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT setseed(%s)', [random_seed])
+
+        # unusable password hashes: seeded users can't log in
+        insert_batches(cursor, volumes['users'], batch_size, f"""
+            INSERT INTO {User._meta.db_table} (password, is_superuser, email, name, is_staff, updated_at)
+            SELECT '!', false, 'user' || g || '@{SEED_EMAIL_DOMAIN}', 'Seed User ' || g, false, now()
+            FROM generate_series(%s, %s) g""", report('users'))
+        ranges['users'] = users = id_range(cursor, User._meta.db_table, 'email LIKE %s', [f'%@{SEED_EMAIL_DOMAIN}'])
+
+        insert_batches(cursor, volumes['shops'], batch_size, f"""
+            INSERT INTO {Shop._meta.db_table} (
+                name, description, user_id, created_by_id, created_at, updated_at,
+                product_count, in_stock_count, sold_count, rating_sum, rating_count, rating)
+            SELECT '{SEED_SHOP_PREFIX} ' || g, '', u, u, now(), now(), 0, 0, 0, 0, 0, 0
+            FROM generate_series(%s, %s) g CROSS JOIN LATERAL (SELECT {random_id(users)} + g * 0 AS u) owner""",
+                       report('shops'))
+        ranges['shops'] = shops = id_range(cursor, Shop._meta.db_table, 'name LIKE %s', [f'{SEED_SHOP_PREFIX} %'])
+
+        insert_batches(cursor, volumes['products'], batch_size, f"""
+            INSERT INTO {Product._meta.db_table} (
+                name, quantity, price, shop_id, variations, rating, category, sold_count,
+                rating_sum, rating_count, rating_1_count, rating_2_count, rating_3_count,
+                rating_4_count, rating_5_count, inventory_shards, image_variants, image_variants_source,
+                created_at, updated_at, created_by_id)
+            SELECT {pick(adjectives, 'g')} || ' ' || {pick(adjectives, 'g / 7')} || ' ' || {pick(nouns, 'g / 3')} || ' ' || g,
+                   (g * 7919) %% 60, round((1 + random() * 500)::numeric, 2), s.id, '{{}}', 0,
+                   {pick(categories, 'g / 11')}, 0, 0, 0, 0, 0, 0, 0, 0, 0, '{{}}', '',
+                   now() - (g || ' seconds')::interval, now(), s.user_id
+            FROM generate_series(%s, %s) g
+            JOIN {Shop._meta.db_table} s ON s.id = {shops[0]} + g %% {shops[1] - shops[0] + 1}""",
+                       report('products'))
+        ranges['products'] = products = id_range(cursor, Product._meta.db_table, 'shop_id BETWEEN %s AND %s', shops)
+
+        insert_batches(cursor, volumes['transactions'], batch_size, f"""
+            INSERT INTO {Transaction._meta.db_table} (
+                product_id, quantity, user_id, item_price_at_purchase, total, created_at, updated_at, created_by_id)
+            SELECT p.id, q, u, p.price, p.price * q, now(), now(), u
+            FROM generate_series(%s, %s) g
+            CROSS JOIN LATERAL (SELECT {random_id(products, skew=3)} + g * 0 AS product_id,
+                                       {random_id(users)} + g * 0 AS u, 1 + g %% 3 AS q) picked
+            JOIN {Product._meta.db_table} p ON p.id = picked.product_id""", report('transactions'))
+
+        insert_batches(cursor, volumes['reviews'], batch_size, f"""
+            INSERT INTO {Review._meta.db_table} (message, rating, product_id, user_id, created_at, updated_at, created_by_id)
+            SELECT 'seeded review ' || g, round((1 + random() * 4)::numeric, 1), picked.product_id, picked.u,
+                   now() - (g || ' seconds')::interval, now(), picked.u
+            FROM generate_series(%s, %s) g
+            CROSS JOIN LATERAL (SELECT {random_id(products, skew=3)} + g * 0 AS product_id,
+                                       {random_id(users)} + g * 0 AS u) picked""", report('reviews'))
+    return ranges
+
+
+def finish_seed(stdout=None):
+    """Rebuild what the signals would have maintained, then refresh planner statistics"""
+    call_command('reconcile_sold_count', stdout=stdout)
+    call_command('recompute_review_stats', stdout=stdout)
+    call_command('recompute_shop_stats', stdout=stdout)
+    for shop_id, name in Shop.objects.filter(name__startswith=SEED_SHOP_PREFIX).values_list('id', 'name').iterator():
+        refresh_search_vector(Product.objects.filter(shop_id=shop_id), name)
+    with connection.cursor() as cursor:
+        for model in (User, Shop, Product, Transaction, Review, Cart):
+            cursor.execute(f'ANALYZE {model._meta.db_table}')
+
+
+def is_seeded():
+    return User.objects.filter(email__endswith=f'@{SEED_EMAIL_DOMAIN}').exists()
@@ -0,0 +1,34 @@
+from django.conf import settings
+from rest_framework import serializers
+
+from core import uploads
+
+
+class UploadFileSerializer(serializers.Serializer):
+    filename = serializers.CharField(max_length=255)
+    content_type = serializers.CharField(max_length=255)
+    # hex SHA-256 of the file, to skip uploading bytes the server already has
+    sha256 = serializers.CharField(required=False, allow_blank=True)
+
+    def validate_content_type(self, value):
+        # parameters such as a charset don't change what the file is
+        value = value.split(';')[0].strip().lower()
+        if value not in settings.MEDIA_UPLOAD_CONTENT_TYPES:
+            raise serializers.ValidationError(
+                f"Expected one of {', '.join(settings.MEDIA_UPLOAD_CONTENT_TYPES)}.")
+        return value
+
+    def validate_sha256(self, value):
+        value = value.lower()
+        if value and not uploads.SHA256.match(value):
+            raise serializers.ValidationError('Expected the hex SHA-256 of the file.')
+        return value
+
+
+class UploadBatchSerializer(serializers.Serializer):
+    files = UploadFileSerializer(many=True, allow_empty=False)
+
+    def validate_files(self, value):
+        if len(value) > settings.MEDIA_UPLOAD_BATCH_MAX_FILES:
+            raise serializers.ValidationError(f'At most {settings.MEDIA_UPLOAD_BATCH_MAX_FILES} files per batch.')
+        return value
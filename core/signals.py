@@ -0,0 +1,352 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import transaction
+from django.db.models import (Case, Count, DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value,
+                              When)
+from django.db.models.functions import Coalesce, Now, Round
+from django.db.models.lookups import GreaterThan
+from django.db.models.signals import pre_delete, pre_save, post_save, post_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from core import images
+from core.authentication import invalidate_tokens, invalidate_user_tokens
+from core.cache import CATALOG_LIST, invalidate, product_namespace, shop_namespace
+from core.models import IN_STOCK, ImageUpload, InventoryShard, Product, Review, Shop, Transaction, User
+from core.search import refresh_search_vector
+
+SEARCH_FIELDS = {'name', 'category', 'shop', 'shop_id'}
+SHOP_STATS_FIELDS = {'quantity', 'inventory_shards', 'shop', 'shop_id'}
+
+
+def add_sold_count(product_id, quantity):
+    """Shift the stored sold_count of a product by ``quantity`` units"""
+    if not quantity:
+        return
+    # updated_at moves too: it is what conditional GETs validate against
+    Product.objects.filter(pk=product_id).update(sold_count=F('sold_count') + quantity, updated_at=Now())
+    shift_shop_stats(shop_of(product_id), sold_count=quantity)
+
+
+@receiver(pre_save, sender=Transaction)
+def remember_transaction_state(sender, instance, **kwargs):
+    # keep what the row looked like before this save so post_save can apply the delta
+    instance._sold_count_snapshot = None
+    if instance.pk:
+        instance._sold_count_snapshot = (
+            Transaction.objects.filter(pk=instance.pk).values_list('product_id', 'quantity').first()
+        )
+
+
+@receiver(post_save, sender=Transaction)
+def update_sold_count_on_save(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_sold_count_snapshot', None)
+    if created or previous is None:
+        add_sold_count(instance.product_id, instance.quantity)
+        return
+
+    previous_product_id, previous_quantity = previous
+    if previous_product_id != instance.product_id:
+        add_sold_count(previous_product_id, -previous_quantity)
+        add_sold_count(instance.product_id, instance.quantity)
+    else:
+        add_sold_count(instance.product_id, instance.quantity - previous_quantity)
+
+
+@receiver(post_delete, sender=Transaction)
+def update_sold_count_on_delete(sender, instance, origin=None, **kwargs):
+    if deleted_with_product(instance, origin):
+        return
+    add_sold_count(instance.product_id, -instance.quantity)
+
+
+@receiver(post_save, sender=Product)
+def update_search_vector_on_product_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not SEARCH_FIELDS.intersection(update_fields):
+        return
+    refresh_search_vector(Product.objects.filter(pk=instance.pk), instance.shop.name)
+
+
+@receiver(post_save, sender=Product)
+def build_image_variants_on_product_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    name = instance.image.name if instance.image else ''
+    if name and name != instance.image_variants_source:
+        # after commit, so the worker sees the row; robust, so a full pool can't fail the request
+        product_id = instance.pk
+        transaction.on_commit(lambda: images.schedule([product_id], name), robust=True)
+
+
+def shift_image_references(name, amount):
+    """Count a product starting (1) or stopping (-1) to use the upload stored as ``name``"""
+    if not name:
+        return
+    referenced = ImageUpload.objects.filter(path=name)
+    if amount < 0:
+        referenced = referenced.filter(ref_count__gte=-amount)
+    # updated_at too: a just released upload is only collected after the grace period
+    referenced.update(ref_count=F('ref_count') + amount, updated_at=Now())
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_image(sender, instance, update_fields=None, **kwargs):
+    instance._image_snapshot = None
+    if instance.pk and (update_fields is None or 'image' in update_fields):
+        instance._image_snapshot = Product.objects.filter(pk=instance.pk).values_list('image', flat=True).first()
+
+
+@receiver(post_save, sender=Product)
+def update_image_references_on_product_save(sender, instance, created, **kwargs):
+    name = instance.image.name if instance.image else ''
+    previous = '' if created else getattr(instance, '_image_snapshot', None)
+    if previous is None or previous == name:
+        return
+    shift_image_references(previous, -1)
+    shift_image_references(name, 1)
+
+
+@receiver(post_delete, sender=Product)
+def update_image_references_on_product_delete(sender, instance, **kwargs):
+    shift_image_references(instance.image.name if instance.image else '', -1)
+
+
+@receiver(post_save, sender=Shop)
+def update_search_vector_on_shop_save(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields is not None and 'name' not in update_fields):
+        return
+    refresh_search_vector(Product.objects.filter(shop=instance), instance.name)
+
+
+def rating_star(rating):
+    """Histogram bucket of a review rating: rounded half up and kept within 1..5"""
+    star = int(Decimal(rating).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+    return min(max(star, 1), 5)
+
+
+def derived_rating(rating_sum, rating_count):
+    """Product.rating as an expression of the running totals, 0 while there are no reviews"""
+    average = ExpressionWrapper(rating_sum / rating_count, output_field=DecimalField())
+    return Case(When(GreaterThan(rating_count, 0), then=Round(average, 1)), default=Value(Decimal('0')))
+
+
+def shift_review_stats(product_id, rating, sign):
+    """
+    Add (sign=1) or remove (sign=-1) one review from a product's stored stats.
+    Everything is a single UPDATE; its SET expressions see the pre-update row,
+    so the derived rating is computed from the new totals in the same statement.
+    """
+    rating = Decimal(rating)
+    field = f'rating_{rating_star(rating)}_count'
+    rating_sum = F('rating_sum') + sign * rating
+    rating_count = F('rating_count') + sign
+    Product.objects.filter(pk=product_id).update(**{
+        field: F(field) + sign,
+        'rating_sum': rating_sum,
+        'rating_count': rating_count,
+        'rating': derived_rating(rating_sum, rating_count),
+        'updated_at': Now(),
+    })
+    shift_shop_stats(shop_of(product_id), rating_sum=sign * rating, rating_count=sign)
+
+
+def shop_of(product_id):
+    return Subquery(Product.objects.filter(pk=product_id).values('shop_id')[:1])
+
+
+def shift_shop_stats(shop, **deltas):
+    """
+    Add deltas to a shop's stored directory stats in one UPDATE, e.g.
+    shift_shop_stats(shop_id, product_count=1). ``shop`` is an id or a subquery
+    yielding one (see shop_of). The rating follows the new totals.
+    """
+    deltas = {field: amount for field, amount in deltas.items() if amount}
+    if not deltas:
+        return
+    updates = {field: F(field) + amount for field, amount in deltas.items()}
+    if 'rating_sum' in deltas or 'rating_count' in deltas:
+        updates['rating'] = derived_rating(F('rating_sum') + deltas.get('rating_sum', Decimal('0')),
+                                           F('rating_count') + deltas.get('rating_count', 0))
+    Shop.objects.filter(pk=shop).update(**updates, updated_at=Now())
+
+
+def total(queryset, expression, default):
+    """Correlated subquery of one aggregate over ``queryset``, grouped on the outer row"""
+    return Coalesce(Subquery(queryset.annotate(total=expression).values('total')), Value(default))
+
+
+def shop_stats():
+    """Every stored shop stat as an expression over the shop's products, for recomputing them in an UPDATE"""
+    products = Product.objects.filter(shop=OuterRef('pk')).order_by().values('shop')
+    shards = InventoryShard.objects.filter(product__shop=OuterRef('pk')).order_by().values('product__shop')
+
+    rating_sum = total(products, Sum('rating_sum'), Decimal('0'))
+    rating_count = total(products, Sum('rating_count'), 0)
+    return {
+        'product_count': total(products, Count('id'), 0),
+        'in_stock_count': total(products, Count('id', filter=IN_STOCK), 0),
+        # shard sales are not in Product.sold_count (see core.inventory)
+        'sold_count': total(products, Sum('sold_count'), 0) + total(shards, Sum('sold'), 0),
+        'rating_sum': rating_sum,
+        'rating_count': rating_count,
+        'rating': derived_rating(rating_sum, rating_count),
+    }
+
+
+def recompute_shop_stats(shops):
+    """Rebuild the stats of a Shop queryset, for writes that bypass the signals (bulk writes, seeding)"""
+    return shops.update(**shop_stats(), updated_at=Now())
+
+
+def in_stock(quantity, inventory_shards):
+    # the Python side of IN_STOCK
+    return int(quantity > 0 or inventory_shards > 0)
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_shop_state(sender, instance, update_fields=None, **kwargs):
+    instance._shop_stats_snapshot = None
+    if instance.pk and (update_fields is None or SHOP_STATS_FIELDS.intersection(update_fields)):
+        instance._shop_stats_snapshot = (
+            Product.objects.filter(pk=instance.pk)
+            .values_list('shop_id', 'quantity', 'inventory_shards', 'sold_count', 'rating_sum', 'rating_count')
+            .first()
+        )
+
+
+@receiver(post_save, sender=Product)
+def update_shop_stats_on_product_save(sender, instance, created, **kwargs):
+    now_in_stock = in_stock(instance.quantity, instance.inventory_shards)
+    if created:
+        shift_shop_stats(instance.shop_id, product_count=1, in_stock_count=now_in_stock)
+        return
+    previous = getattr(instance, '_shop_stats_snapshot', None)
+    if previous is None:
+        return
+    shop_id, quantity, inventory_shards, sold_count, rating_sum, rating_count = previous
+    was_in_stock = in_stock(quantity, inventory_shards)
+    if shop_id == instance.shop_id:
+        shift_shop_stats(shop_id, in_stock_count=now_in_stock - was_in_stock)
+        return
+    # the product moved: its sales and reviews move with it
+    sold_count += sum(InventoryShard.objects.filter(product_id=instance.pk).values_list('sold', flat=True))
+    shift_shop_stats(shop_id, product_count=-1, in_stock_count=-was_in_stock, sold_count=-sold_count,
+                     rating_sum=-rating_sum, rating_count=-rating_count)
+    shift_shop_stats(instance.shop_id, product_count=1, in_stock_count=now_in_stock, sold_count=sold_count,
+                     rating_sum=rating_sum, rating_count=rating_count)
+
+
+def deleted_with_product(instance, origin):
+    """
+    Whether a review or transaction is going because its product is. The
+    product's delete then takes its stats off the shop in one UPDATE, instead
+    of two UPDATEs for every row of the product's history.
+    """
+    return instance.product_id in getattr(origin, '_deleting_product_ids', ())
+
+
+@receiver(pre_delete, sender=Product)
+def remember_deleted_product(sender, instance, origin=None, **kwargs):
+    # every pre_delete of a delete() runs before the first row goes, so the
+    # cascaded reviews and transactions see the mark; it lives on the origin
+    # (the deleted object or queryset), so a rolled back delete leaves nothing behind
+    if origin is not None:
+        if not hasattr(origin, '_deleting_product_ids'):
+            origin._deleting_product_ids = set()
+        origin._deleting_product_ids.add(instance.pk)
+    # totalled from the rows, as their own signals would have taken them off one by one
+    # (every sale has a Transaction, shard sales included)
+    reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    sales = Transaction.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    instance._deleted_stats_snapshot = (
+        Product.objects.filter(pk=instance.pk)
+        .annotate(history_rating_sum=total(reviews, Sum('rating'), Decimal('0')),
+                  history_rating_count=total(reviews, Count('id'), 0),
+                  history_sold=total(sales, Sum('quantity'), 0))
+        .values('quantity', 'inventory_shards', 'history_rating_sum', 'history_rating_count', 'history_sold')
+        .first()
+    )
+
+
+@receiver(post_delete, sender=Product)
+def update_shop_stats_on_product_delete(sender, instance, origin=None, **kwargs):
+    snapshot = getattr(instance, '_deleted_stats_snapshot', None)
+    if snapshot is None:
+        return
+    history = {}
+    if origin is not None:
+        # without an origin nothing was marked, and the rows' own signals took them off the shop
+        history = dict(sold_count=-snapshot['history_sold'], rating_sum=-snapshot['history_rating_sum'],
+                       rating_count=-snapshot['history_rating_count'])
+    shift_shop_stats(instance.shop_id, product_count=-1,
+                     in_stock_count=-in_stock(snapshot['quantity'], snapshot['inventory_shards']), **history)
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_state(sender, instance, **kwargs):
+    instance._review_stats_snapshot = None
+    if instance.pk:
+        instance._review_stats_snapshot = (
+            Review.objects.filter(pk=instance.pk).values_list('product_id', 'rating').first()
+        )
+
+
+@receiver(post_save, sender=Review)
+def update_review_stats_on_save(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_review_stats_snapshot', None)
+    if not created and previous is not None:
+        previous_product_id, previous_rating = previous
+        if previous_product_id == instance.product_id and Decimal(previous_rating) == Decimal(instance.rating):
+            return
+        shift_review_stats(previous_product_id, previous_rating, -1)
+    shift_review_stats(instance.product_id, instance.rating, 1)
+
+
+@receiver(post_delete, sender=Review)
+def update_review_stats_on_delete(sender, instance, origin=None, **kwargs):
+    if deleted_with_product(instance, origin):
+        return
+    shift_review_stats(instance.product_id, instance.rating, -1)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_cached_product(sender, instance, **kwargs):
+    invalidate(product_namespace(instance.pk), CATALOG_LIST)
+
+
+@receiver(post_save, sender=Shop)
+@receiver(post_delete, sender=Shop)
+def invalidate_cached_shop(sender, instance, **kwargs):
+    invalidate(shop_namespace(instance.pk), CATALOG_LIST)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+def invalidate_cached_product_stats(sender, instance, origin=None, **kwargs):
+    if deleted_with_product(instance, origin):
+        # invalidate_cached_product covers it
+        return
+    # reviews and sales change the rating and sold_count shown with the product. List pages
+    # show them too but catch up at their soft TTL: bumping CATALOG_LIST here would empty
+    # every cached list page on each sale
+    product_ids = {instance.product_id}
+    snapshot = getattr(instance, '_review_stats_snapshot', None) or getattr(instance, '_sold_count_snapshot', None)
+    if snapshot is not None:
+        product_ids.add(snapshot[0])
+    invalidate(*(product_namespace(product_id) for product_id in product_ids))
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_cached_token(sender, instance, **kwargs):
+    invalidate_tokens([instance.key])
+
+
+@receiver(post_save, sender=User)
+def invalidate_cached_user_tokens(sender, instance, created, update_fields=None, **kwargs):
+    # cached tokens carry their user, so a password or is_active change must not wait for the TTL
+    if created or (update_fields is not None and set(update_fields) <= {'last_login'}):
+        return
+    invalidate_user_tokens(instance.pk)
@@ -0,0 +1,110 @@
+from unittest import TestCase, mock
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.authentication import LocalTokenCache, get_cache, local_tokens, token_cache_key
+from core.utils.test.test_utils import assert_max_queries, create_user
+
+ME_URL = reverse('user:me')
+
+
+class TestLocalTokenCache(TestCase):
+
+    def test_least_recently_used_entry_is_evicted(self):
+        tokens = LocalTokenCache(maxsize=2, timeout=60)
+        tokens.set('a', 'token a')
+        tokens.set('b', 'token b')
+        tokens.get('a')
+        tokens.set('c', 'token c')
+        self.assertIsNone(tokens.get('b'))
+        self.assertEqual(tokens.get('a'), 'token a')
+
+    def test_entries_expire(self):
+        tokens = LocalTokenCache(maxsize=2, timeout=5)
+        with mock.patch('core.authentication.time.monotonic', return_value=100):
+            tokens.set('a', 'token a')
+        with mock.patch('core.authentication.time.monotonic', return_value=106):
+            self.assertIsNone(tokens.get('a'))
+
+
+@pytest.mark.django_db
+class TestCachedTokenAuthentication(TestCase):
+
+    def setUp(self):
+        self.user = create_user()
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_cached_token_skips_the_database(self):
+        self.assertEqual(self.client.get(ME_URL).status_code, status.HTTP_200_OK)
+        with assert_max_queries(0):
+            res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['email'], self.user.email)
+
+    def test_shared_tier_refills_the_local_one(self):
+        self.client.get(ME_URL)
+        local_tokens.clear()
+        with assert_max_queries(0):
+            res = self.client.get(ME_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_cache_holds_no_credentials(self):
+        self.client.get(ME_URL)
+        key = token_cache_key(self.token.key)
+        for entry in (get_cache().get(key), local_tokens.get(key)):
+            self.assertNotIn(self.token.key, repr(entry))
+            self.assertNotIn(self.user.password, repr(entry))
+            self.assertEqual(entry['user']['id'], self.user.id)
+
+    def test_rebuilt_user_defers_the_password(self):
+        self.client.get(ME_URL)
+        res = self.client.get(ME_URL)
+        user = res.wsgi_request.user
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertIn('password', user.get_deferred_fields())
+        self.assertTrue(user.check_password('test123'))
+
+    def test_saving_a_rebuilt_user_keeps_the_password(self):
+        self.client.get(ME_URL)
+        user = self.client.get(ME_URL).wsgi_request.user
+        # changed behind the cached copy, e.g. by a password reset in another process
+        get_user_model().objects.filter(pk=self.user.pk).update(password='changed-hash')
+        user.name = 'Renamed'
+        with CaptureQueriesContext(connection) as queries:
+            user.save()
+        updates = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"password"', updates[0])
+        self.assertEqual(get_user_model().objects.values_list('name', 'password').get(pk=self.user.pk),
+                         ('Renamed', 'changed-hash'))
+
+    def test_invalid_token(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token nope')
+        self.assertEqual(self.client.get(ME_URL).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deleted_token_is_rejected(self):
+        self.client.get(ME_URL)
+        self.token.delete()
+        self.assertEqual(self.client.get(ME_URL).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_change_invalidates(self):
+        self.client.get(ME_URL)
+        self.user.set_password('changed123')
+        self.user.save()
+        key = token_cache_key(self.token.key)
+        self.assertIsNone(get_cache().get(key))
+        self.assertIsNone(local_tokens.get(key))
+
+    def test_inactive_user_is_rejected(self):
+        self.client.get(ME_URL)
+        with mock.patch.object(type(self.user), 'is_active', False, create=True):
+            self.assertEqual(self.client.get(ME_URL).status_code, status.HTTP_401_UNAUTHORIZED)
@@ -0,0 +1,52 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest import TestCase
+
+import pytest
+from django.core.management import call_command
+
+from core.benchmark import find_regressions
+
+
+def results(**endpoints):
+    return {'endpoints': {name: {'p95_ms': p95, 'queries': queries} for name, (p95, queries) in endpoints.items()}}
+
+
+class TestFindRegressions(TestCase):
+
+    def test_within_threshold(self):
+        baseline = results(product_list=(10.0, 3))
+        self.assertEqual(find_regressions(baseline, results(product_list=(12.0, 3)), threshold=0.25), [])
+
+    def test_slower_p95(self):
+        baseline = results(product_list=(10.0, 3))
+        regressions = find_regressions(baseline, results(product_list=(13.0, 3)), threshold=0.25)
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('p95', regressions[0])
+
+    def test_extra_queries(self):
+        baseline = results(product_list=(10.0, 3))
+        current = results(product_list=(10.0, 5))
+        self.assertEqual(len(find_regressions(baseline, current, threshold=0.25)), 1)
+        self.assertEqual(find_regressions(baseline, current, threshold=0.25, query_slack=2), [])
+
+    def test_new_endpoints_are_ignored(self):
+        self.assertEqual(find_regressions(results(), results(checkout=(50.0, 9)), threshold=0.25), [])
+
+
+@pytest.mark.django_db
+class TestBenchmarkEndpoints(TestCase):
+
+    def test_seed_and_measure_every_route(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            call_command('benchmark_endpoints', scale=0.0005, runs=1, warmup=0, output=output, stdout=StringIO())
+            with open(output) as results:
+                endpoints = json.load(results)['endpoints']
+        self.assertIn('upload info', endpoints)
+        self.assertIn('upload info batch', endpoints)
+        # a tiny catalogue has no page 500
+        failing = {name for name, summary in endpoints.items() if summary['errors']}
+        self.assertEqual(failing - {'product list page 500'}, set())
@@ -0,0 +1,73 @@
+import random
+from collections import Counter
+from unittest import TestCase
+
+import pytest
+
+from core import datagen
+from core.models import Cart, Product, Review, Shop, Transaction, User
+
+VOLUMES = {'users': 50, 'shops': 5, 'products': 200, 'carts': 40, 'reviews': 300, 'transactions': 500}
+
+
+def plan(seed=42):
+    first_ids = {table: 1000 * (index + 1) for index, table in enumerate(datagen.DEFAULT_VOLUMES)}
+    return datagen.Plan(seed, first_ids, dict(VOLUMES))
+
+
+def rows(plan, table, start=0, stop=100):
+    return list(datagen.TABLES[table][1](plan, random.Random(f'{plan.seed}:{table}:{start}'), start, stop))
+
+
+class TestDataGenerator(TestCase):
+
+    def test_zipf_popularity(self):
+        population = datagen.Population(first=1, count=10_000, exponent=1.1)
+        rng = random.Random(1)
+        picks = Counter(population.pick(rng) for _ in range(20_000))
+        self.assertTrue(all(1 <= product_id <= 10_000 for product_id in picks))
+        # the hottest 1% of the products take a large share of the picks
+        hottest = sum(count for _, count in picks.most_common(100))
+        self.assertGreater(hottest / 20_000, 0.4)
+
+    def test_same_seed_same_rows(self):
+        for table in datagen.TABLES:
+            with self.subTest(table):
+                self.assertEqual(rows(plan(), table), rows(plan(), table))
+        self.assertNotEqual(rows(plan(1), 'transactions'), rows(plan(2), 'transactions'))
+
+    def test_rows_reference_generated_ids(self):
+        generated = plan()
+        product_ids = range(generated.first_ids['products'], generated.first_ids['products'] + VOLUMES['products'])
+        for transaction in rows(generated, 'transactions'):
+            product_id, quantity, price, total = transaction[4], transaction[5], transaction[7], transaction[8]
+            self.assertIn(product_id, product_ids)
+            self.assertEqual(total, price * quantity)
+
+    def test_cart_lines_are_unique_per_user(self):
+        lines = rows(plan(), 'carts', 0, plan().cart_owners)
+        self.assertEqual(len(lines), VOLUMES['carts'])
+        self.assertEqual(len({(line[4], line[5]) for line in lines}), len(lines))
+
+    def test_copy_stream(self):
+        stream = datagen.CopyStream([(1, None, True, ['S', 'M'], 'tab\there')])
+        self.assertEqual(stream.read(4) + stream.read(), b'1\t\\N\tt\t{S,M}\ttab\\there\n')
+        self.assertEqual(stream.read(), b'')
+
+
+@pytest.mark.django_db
+class TestGenerate(TestCase):
+
+    def test_generate(self):
+        copied = datagen.generate(VOLUMES, seed=7, workers=0, chunk_size=64)
+
+        self.assertEqual(copied, VOLUMES)
+        for model, table in ((User, 'users'), (Shop, 'shops'), (Product, 'products'), (Cart, 'carts'),
+                             (Review, 'reviews'), (Transaction, 'transactions')):
+            self.assertEqual(model.objects.count(), VOLUMES[table])
+        transaction = Transaction.objects.select_related('product').first()
+        self.assertEqual(transaction.item_price_at_purchase, transaction.product.price)
+        # the sequences moved past the copied ids
+        self.assertGreater(Product.objects.create(name='new', price=1, quantity=1, shop=Shop.objects.first(),
+                                                  created_by=User.objects.first()).id,
+                           max(Product.objects.exclude(name='new').values_list('id', flat=True)))
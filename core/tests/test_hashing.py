@@ -0,0 +1,80 @@
+from unittest import TestCase
+
+import pytest
+from django.contrib.auth.hashers import make_password
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import hashing
+from core.utils.test.test_utils import create_user
+
+TOKEN_URL = reverse('user:token')
+CURRENT_AND_LEGACY_HASHERS = ['django.contrib.auth.hashers.PBKDF2PasswordHasher',
+                              'django.contrib.auth.hashers.MD5PasswordHasher']
+
+
+def hash_inline(test, **overrides):
+    overridden = override_settings(PASSWORD_HASHING_WORKERS=0, **overrides)
+    overridden.enable()
+    test.addCleanup(overridden.disable)
+
+
+class TestRun(TestCase):
+
+    def setUp(self):
+        hash_inline(self)
+
+    def test_hash_and_verify(self):
+        encoded = hashing.hash_password('secret123')
+        self.assertEqual(hashing.verify('secret123', encoded), (True, None))
+        self.assertFalse(hashing.verify('wrong', encoded)[0])
+
+    def test_back_pressure(self):
+        rejected = hashing.stats.rejected
+        with override_settings(PASSWORD_HASHING_MAX_PENDING=0, PASSWORD_HASHING_QUEUE_TIMEOUT=0):
+            with self.assertRaises(hashing.PasswordHashingBusy):
+                hashing.hash_password('secret123')
+        self.assertEqual(hashing.stats.rejected, rejected + 1)
+        self.assertEqual(hashing.stats.pending, 0)
+
+    def test_stats(self):
+        hashing.hash_password('secret123')
+        stats = hashing.get_stats()
+        self.assertGreater(stats['completed'], 0)
+        self.assertGreater(stats['hash_time']['p50_ms'], 0)
+
+
+@pytest.mark.django_db
+class TestLogin(TestCase):
+
+    def setUp(self):
+        hash_inline(self, PASSWORD_HASHERS=CURRENT_AND_LEGACY_HASHERS)
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='test123')
+
+    def test_login(self):
+        res = self.client.post(TOKEN_URL, {'email': 'user@example.com', 'password': 'test123'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn('token', res.data)
+
+    def test_wrong_password(self):
+        res = self.client.post(TOKEN_URL, {'email': 'user@example.com', 'password': 'nope123'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_outdated_hash_is_upgraded_on_login(self):
+        self.user.password = make_password('test123', hasher='md5')
+        self.user.save()
+
+        res = self.client.post(TOKEN_URL, {'email': 'user@example.com', 'password': 'test123'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$'))
+
+    def test_busy(self):
+        with override_settings(PASSWORD_HASHING_MAX_PENDING=0, PASSWORD_HASHING_QUEUE_TIMEOUT=0):
+            res = self.client.post(TOKEN_URL, {'email': 'user@example.com', 'password': 'test123'})
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(res['Retry-After'], '1')
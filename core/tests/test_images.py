@@ -0,0 +1,111 @@
+import io
+from concurrent.futures import Future
+from io import StringIO
+from unittest import TestCase, mock
+
+import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.urls import reverse
+from PIL import Image
+from rest_framework.test import APIClient
+
+from core import images
+from core.models import Product
+from core.utils.test.test_utils import create_product, create_shop, create_user, temporary_media
+from product.serializers import ProductSerializer
+
+
+def image_file(size=(2000, 1000), mode='RGB', format='PNG', name='photo.png'):
+    output = io.BytesIO()
+    Image.new(mode, size, (200, 30, 30, 128) if mode == 'RGBA' else (200, 30, 30)).save(output, format=format)
+    return SimpleUploadedFile(name, output.getvalue())
+
+
+def run_on_commit(func, robust=False):
+    func()
+
+
+class TestRender(TestCase):
+
+    def test_variants_fit_their_box(self):
+        rendered = images.render(image_file())
+        self.assertEqual(set(rendered), {(variant, name) for variant in images.VARIANTS for name in images.FORMATS})
+        for (variant, name), content in rendered.items():
+            with self.subTest(variant=variant, format=name), Image.open(io.BytesIO(content)) as variant_image:
+                self.assertEqual(variant_image.format, images.FORMATS[name][1]['format'])
+                width, height = images.VARIANTS[variant]
+                self.assertEqual(variant_image.size, (width, height // 2))
+
+    def test_never_upscales(self):
+        with Image.open(io.BytesIO(images.render(image_file(size=(100, 80)))['full', 'webp'])) as variant_image:
+            self.assertEqual(variant_image.size, (100, 80))
+
+    def test_transparency(self):
+        rendered = images.render(image_file(mode='RGBA'))
+        with Image.open(io.BytesIO(rendered['card', 'jpeg'])) as jpeg, \
+                Image.open(io.BytesIO(rendered['card', 'webp'])) as webp:
+            self.assertEqual(jpeg.mode, 'RGB')
+            self.assertEqual(webp.mode, 'RGBA')
+
+
+@pytest.mark.django_db
+class TestImageVariants(TestCase):
+
+    def setUp(self):
+        temporary_media(self, IMAGE_VARIANT_WORKERS=0)
+        self.user = create_user()
+        self.shop = create_shop(self.user)
+
+    def create_product(self, **params):
+        with mock.patch('django.db.transaction.on_commit', run_on_commit):
+            return create_product(self.user, self.shop, image=image_file(), **params)
+
+    def test_built_when_the_image_is_saved(self):
+        """should build the variants after a product gets an image and expose their URLs"""
+        product = self.create_product()
+        product.refresh_from_db()
+        self.assertEqual(product.image_variants_source, product.image.name)
+        data = ProductSerializer(product).data
+        self.assertEqual(set(data['image_variants']), set(images.VARIANTS))
+        self.assertTrue(data['image_variants']['thumbnail']['webp'].endswith('/thumbnail.webp'))
+
+    def test_replaced_image_hides_old_variants(self):
+        product = self.create_product()
+        product.refresh_from_db()
+        product.image = image_file(name='other.png')
+        # the commit callback never runs, as if the build were still queued
+        product.save()
+        self.assertIsNone(ProductSerializer(product).data['image_variants'])
+
+    def test_backfill(self):
+        """should build variants of images that have none, and count unreadable ones"""
+        built = self.create_product()
+        pending = create_product(self.user, self.shop, image=image_file(name='pending.png'))
+        broken = create_product(self.user, self.shop, image=SimpleUploadedFile('broken.png', b'not an image'))
+        out = StringIO()
+        call_command('build_image_variants', '--workers', '0', stdout=out)
+
+        self.assertIn('Built variants of 1 image(s); 1 could not be read', out.getvalue())
+        pending.refresh_from_db()
+        self.assertEqual(pending.image_variants_source, pending.image.name)
+        self.assertEqual(Product.objects.get(pk=broken.pk).image_variants, {})
+        self.assertEqual(Product.objects.get(pk=built.pk).image_variants_source,
+                         Product.objects.get(pk=built.pk).image.name)
+
+    def test_cached_detail_shows_built_variants(self):
+        """should drop the cached detail once the variants are built"""
+        product = create_product(self.user, self.shop, image=image_file())
+        url = reverse('product:product-detail', args=[product.id])
+        client = APIClient()
+        self.assertIsNone(client.get(url).data['image_variants'])
+        images.schedule([product.id], product.image.name)
+        self.assertEqual(set(client.get(url).data['image_variants']), set(images.VARIANTS))
+
+    def test_pool_builds_are_invalidated_by_the_scheduling_process(self):
+        """a worker's cache may be its own copy, so the done callback invalidates"""
+        future = Future()
+        future.set_result([7])
+        with mock.patch('core.images.invalidate') as invalidate:
+            images.report(future)
+        invalidate.assert_called_once_with('product:7', 'catalog:list')
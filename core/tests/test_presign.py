@@ -0,0 +1,124 @@
+import hashlib
+from unittest import TestCase, mock
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test.utils import override_settings
+from rest_framework import status
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core import presign
+from core.utils.test.test_utils import create_user, temporary_media
+from core.views import FileLocalUploadAPIView, GenerateUploadInfo, GenerateUploadInfoBatch
+
+BATCH_URL = '/api/media/upload/batch'
+S3_SETTINGS = {'IS_LOCAL': False, 'AWS_ACCESS_KEY_ID': 'AKIDEXAMPLE', 'AWS_SECRET_ACCESS_KEY': 'secret',
+               'AWS_S3_REGION_NAME': 'eu-west-1', 'AWS_STORAGE_BUCKET_NAME': 'emporium-test'}
+
+
+class TestS3Strategy(TestCase):
+
+    def setUp(self):
+        presign.reset_s3_client()
+        self.addCleanup(presign.reset_s3_client)
+        self.request = APIRequestFactory().post(BATCH_URL)
+
+    @override_settings(**S3_SETTINGS)
+    def test_presigned_target(self):
+        """should sign a PUT of the sanitized key, without any network round trip"""
+        target = presign.S3Strategy().target(self.request, '../my photo.jpg', 'image/jpeg')
+        url = urlparse(target['upload_url'])
+        key = url.path.lstrip('/')
+        self.assertEqual(target['strategy'], 's3')
+        prefix, name = key.split('/', 1)
+        self.assertEqual(prefix, 'media')
+        self.assertNotIn('/', name)
+        self.assertTrue(name.endswith('my_photo.jpg'), name)
+        self.assertEqual(target['image_url'], f'https://emporium-test.s3.amazonaws.com/{key}')
+        query = parse_qs(url.query)
+        self.assertEqual(query['X-Amz-Expires'], ['1800'])
+        self.assertIn('X-Amz-Signature', query)
+
+    @override_settings(**S3_SETTINGS)
+    def test_client_reused(self):
+        """should create the S3 client once and share it between requests"""
+        with mock.patch('core.presign.boto3.client', wraps=presign.boto3.client) as client:
+            strategy = presign.S3Strategy()
+            urls = {strategy.target(self.request, 'photo.jpg', 'image/jpeg')['upload_url'] for _ in range(3)}
+            presign.get_strategy().target(self.request, 'photo.jpg', 'image/jpeg')
+        self.assertEqual(client.call_count, 1)
+        self.assertEqual(len(urls), 3)
+
+
+@pytest.mark.django_db
+class TestBatchUploadInfo(TestCase):
+
+    def setUp(self):
+        temporary_media(self, IS_LOCAL=True)
+        self.user = create_user()
+        self.factory = APIRequestFactory()
+
+    def post_batch(self, files, user=True):
+        request = self.factory.post(BATCH_URL, {'files': files}, format='json')
+        if user:
+            force_authenticate(request, self.user)
+        return GenerateUploadInfoBatch.as_view()(request)
+
+    def test_targets_in_order(self):
+        """should return one target per file, in the order they were sent"""
+        res = self.post_batch([{'filename': f'photo-{i}.jpg', 'content_type': 'image/jpeg'} for i in range(3)])
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([target['strategy'] for target in res.data['uploads']], ['local'] * 3)
+        for i, target in enumerate(res.data['uploads']):
+            self.assertTrue(target['filename'].endswith(f'_photo-{i}.jpg'))
+            self.assertTrue(target['image_url'].endswith(target['filename']))
+
+    def test_known_hash(self):
+        """should point files the server already has at the existing upload, looked up in one go"""
+        request = self.factory.post('/api/media/upload/local', {
+            'filename': 'photo.jpg', 'file': SimpleUploadedFile('photo.jpg', b'same bytes')})
+        force_authenticate(request, self.user)
+        existing = FileLocalUploadAPIView.as_view()(request).data
+
+        with mock.patch('core.uploads.find_duplicate') as find_duplicate:
+            res = self.post_batch([
+                {'filename': 'new.jpg', 'content_type': 'image/jpeg', 'sha256': hashlib.sha256(b'new').hexdigest()},
+                {'filename': 'copy.jpg', 'content_type': 'image/jpeg',
+                 'sha256': hashlib.sha256(b'same bytes').hexdigest()},
+            ])
+        find_duplicate.assert_not_called()
+        self.assertEqual(res.data['uploads'][0]['strategy'], 'local')
+        self.assertEqual(res.data['uploads'][1], {'strategy': 'existing', 'id': existing['id'],
+                                                  'image_url': existing['image_url']})
+
+    def test_invalid_batches(self):
+        """should reject empty, oversized and malformed batches, and anonymous users"""
+        file = {'filename': 'photo.jpg', 'content_type': 'image/jpeg'}
+        with override_settings(MEDIA_UPLOAD_BATCH_MAX_FILES=2):
+            self.assertEqual(self.post_batch([file] * 3).status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(self.post_batch([file] * 2).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.post_batch([]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.post_batch([{**file, 'sha256': 'abc'}]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(self.post_batch([file], user=False).status_code,
+                      (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN))
+
+    def test_single_target(self):
+        """should keep the single-file endpoint answering with one target"""
+        request = self.factory.post('/api/media/upload', {'filename': 'photo.jpg', 'content_type': 'image/jpeg'},
+                                    format='json')
+        force_authenticate(request, self.user)
+        res = GenerateUploadInfo.as_view()(request)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['strategy'], 'local')
+
+    def test_single_target_validates_like_a_batch(self):
+        """should answer 400 for a missing field or a content type the batch endpoint also rejects"""
+        for data in ({'content_type': 'image/jpeg'}, {'filename': 'photo.jpg'},
+                     {'filename': 'script.js', 'content_type': 'text/javascript'}):
+            with self.subTest(data=data):
+                request = self.factory.post('/api/media/upload', data, format='json')
+                force_authenticate(request, self.user)
+                self.assertEqual(GenerateUploadInfo.as_view()(request).status_code, status.HTTP_400_BAD_REQUEST)
+        file = {'filename': 'script.js', 'content_type': 'text/javascript'}
+        self.assertEqual(self.post_batch([file]).status_code, status.HTTP_400_BAD_REQUEST)
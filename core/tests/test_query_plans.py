@@ -0,0 +1,120 @@
+import json
+from unittest import TestCase
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection
+
+from core.models import Cart, InventoryShard, Product, Review, Shop, Transaction
+from core.search import refresh_search_vector
+from core.utils.test.test_utils import create_user
+from product.views import catalog_products
+
+CATEGORIES = ['home', 'kitchen', 'outdoors', 'office']
+
+
+def foreign_key_index(model, field):
+    """Name of the index Django creates for a ForeignKey column"""
+    column = model._meta.get_field(field).column
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+    return next(name for name, constraint in constraints.items()
+                if constraint['index'] and constraint['columns'] == [column]
+                and not constraint['unique'] and not constraint['primary_key'])
+
+
+def plan_nodes(queryset):
+    """Every node of the plan Postgres picks for a queryset"""
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    nodes = [plan[0]['Plan']]
+    for node in nodes:
+        nodes.extend(node.get('Plans', []))
+    return nodes
+
+
+@pytest.mark.django_db
+class TestQueryPlans(TestCase):
+    """
+    The hot queries of the API must be answered from the index made for them.
+    Sequential scans are priced out for the test, and every plan must use the
+    expected indexes: with one dropped or unusable, the planner falls back to
+    some other index (a foreign key or the primary key) and the test fails.
+    """
+
+    def setUp(self):
+        # large enough that the planner prefers each targeted index over a full scan of a small table
+        self.user = create_user()
+        shops = Shop.objects.bulk_create([Shop(name=f'Shop {i}', user=self.user, created_by=self.user)
+                                          for i in range(50)])
+        products = Product.objects.bulk_create([
+            Product(name=f'lamp {i}', quantity=i % 3, price=i + 1, category=CATEGORIES[i % len(CATEGORIES)],
+                    shop=shops[i % len(shops)], created_by=self.user)
+            for i in range(20000)
+        ])
+        self.shop, self.product = shops[0], products[0]
+        # a rare word, so the search indexes are worth using
+        Product.objects.filter(pk=products[7].pk).update(name='brass lantern')
+        refresh_search_vector(Product.objects.all(), 'Shop')
+        Review.objects.bulk_create([Review(product=product, user=self.user, created_by=self.user, rating=4)
+                                    for product in products[:50]])
+        # several users' carts, so a user's lines are a small part of the table
+        buyers = [self.user] + [create_user(email=f'buyer{i}@example.com') for i in range(4)]
+        Cart.objects.bulk_create([Cart(product=product, user=buyer, quantity=1, created_by=buyer)
+                                  for buyer in buyers for product in products[:2000]])
+        Transaction.objects.bulk_create([
+            Transaction(product=product, user=self.user, created_by=self.user, quantity=1,
+                        item_price_at_purchase=product.price, total=product.price)
+            for product in products[:50]
+        ])
+        with connection.cursor() as cursor:
+            for model in (get_user_model(), Shop, Product, Review, Cart, Transaction, InventoryShard):
+                cursor.execute(f'ANALYZE {model._meta.db_table}')
+            # rows earlier tests rolled back linger in the GIN pending lists and inflate index scan costs
+            cursor.execute("""SELECT gin_clean_pending_list(indexrelid) FROM pg_index JOIN pg_class ON indexrelid = oid
+                              WHERE indrelid = %s::regclass AND relam = (SELECT oid FROM pg_am WHERE amname = 'gin')""",
+                           [Product._meta.db_table])
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def hot_queries(self):
+        """{label: (queryset, names of the indexes its plan must use)}"""
+        ordered = ('-created_at', '-id')
+        return {
+            'catalog listing': (catalog_products({})[:10], {'product_in_stock_created_idx'}),
+            'catalog listing by shop': (catalog_products({'shop': str(self.shop.id)})[:10],
+                                        {'product_shop_in_stock_idx'}),
+            'catalog listing by category': (catalog_products({'category': 'Home'})[:10],
+                                            {'product_category_in_stock_idx'}),
+            'catalog search': (catalog_products({'search': 'lantern'})[:10],
+                               {'product_search_vector_idx', 'product_name_trgm_idx'}),
+            'catalog cursor page': (catalog_products({}).order_by(*ordered)[:11], {'product_in_stock_created_idx'}),
+            'catalog cursor page by price': (catalog_products({}).order_by('price', 'id')[:11],
+                                             {'product_price_id_idx'}),
+            'product detail': (Product.objects.with_stock().select_related('shop').filter(pk=self.product.pk),
+                               {'core_product_pkey', foreign_key_index(InventoryShard, 'product')}),
+            'review listing': (Review.objects.select_related('user').order_by(*ordered)[:11],
+                               {'review_created_id_idx'}),
+            'product reviews': (Review.objects.filter(product=self.product).select_related('user').order_by(*ordered)[:11],
+                                {'review_product_created_id_idx'}),
+            'cart listing': (Cart.objects.select_related('product').filter(user=self.user).order_by(*ordered)[:11],
+                             {'cart_user_created_id_idx'}),
+            'checkout cart lines': (Cart.objects.filter(user=self.user).order_by('product_id'),
+                                    {foreign_key_index(Cart, 'user')}),
+            'product sales': (Transaction.objects.filter(product=self.product),
+                              {foreign_key_index(Transaction, 'product')}),
+            'inventory shards': (InventoryShard.objects.filter(product=self.product).order_by('index'),
+                                 {'inventory_shard_unique_index'}),
+        }
+
+    def test_hot_queries_use_indexes(self):
+        for label, (queryset, expected) in self.hot_queries().items():
+            with self.subTest(label):
+                nodes = plan_nodes(queryset)
+                scans = [node.get('Relation Name') for node in nodes if node['Node Type'] == 'Seq Scan']
+                self.assertEqual(scans, [], f'{label} falls back to a sequential scan')
+                used = {node['Index Name'] for node in nodes if 'Index Name' in node}
+                self.assertLessEqual(expected, used, f'{label} does not use {sorted(expected - used)}')
@@ -0,0 +1,164 @@
+import hashlib
+from io import StringIO
+from unittest import TestCase, mock
+
+import pytest
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from rest_framework import status
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from core import uploads
+from core.models import ImageUpload, Product
+from core.utils.test.test_utils import create_shop, create_user, temporary_media
+from core.views import (ChunkedLocalUploadAPIView, ChunkedLocalUploadDetailAPIView, FileLocalUploadAPIView,
+                        GenerateUploadInfo)
+from product.serializers import ProductCreateSerializer
+
+UPLOAD_URL = '/api/media/upload/local'
+CHUNKED_URL = '/api/media/upload/local/chunked'
+
+
+class TestMaxSizeUploadHandler(TestCase):
+
+    def test_stops_past_the_limit(self):
+        handler = uploads.MaxSizeUploadHandler(max_size=10)
+        self.assertEqual(handler.receive_data_chunk(b'x' * 6, 0), b'x' * 6)
+        with self.assertRaises(uploads.UploadTooLarge):
+            handler.receive_data_chunk(b'x' * 6, 6)
+
+    def test_content_range(self):
+        self.assertEqual(uploads.parse_content_range('bytes 0-9/20'), (0, 9, 20))
+        self.assertEqual(uploads.parse_content_range('bytes 10-19/*'), (10, 19, None))
+        for header in (None, 'bytes 5-4/20', 'bytes 0-20/20', 'items 0-1/2'):
+            with self.subTest(header), self.assertRaises(uploads.exceptions.ParseError):
+                uploads.parse_content_range(header)
+
+
+@pytest.mark.django_db
+class TestLocalUploads(TestCase):
+
+    def setUp(self):
+        temporary_media(self, MEDIA_UPLOAD_MAX_SIZE=100)
+        self.user = create_user()
+        self.factory = APIRequestFactory()
+
+    def post_file(self, content, filename='photo.jpg'):
+        request = self.factory.post(UPLOAD_URL, {'filename': filename,
+                                                 'file': SimpleUploadedFile(filename, content)})
+        force_authenticate(request, self.user)
+        return FileLocalUploadAPIView.as_view()(request)
+
+    def open_chunked(self, size=None):
+        request = self.factory.post(CHUNKED_URL, {'filename': 'photo.jpg', 'size': size}, format='json')
+        force_authenticate(request, self.user)
+        return ChunkedLocalUploadAPIView.as_view()(request)
+
+    def put_chunk(self, upload_id, content, content_range):
+        request = self.factory.put(f'{CHUNKED_URL}/{upload_id}', content, content_type='application/octet-stream',
+                                   HTTP_CONTENT_RANGE=content_range)
+        force_authenticate(request, self.user)
+        return ChunkedLocalUploadDetailAPIView.as_view()(request, pk=upload_id)
+
+    def test_upload_file(self):
+        """should stream the file to storage and record its size"""
+        res = self.post_file(b'x' * 100)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        upload = ImageUpload.objects.get(pk=res.data['id'])
+        self.assertEqual((upload.size, upload.created_by), (100, self.user))
+        self.assertIsNotNone(upload.completed_at)
+        with default_storage.open(upload.path) as stored:
+            self.assertEqual(stored.read(), b'x' * 100)
+
+    def test_upload_file_too_large(self):
+        res = self.post_file(b'x' * 101)
+        self.assertEqual(res.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertFalse(ImageUpload.objects.exists())
+
+    def test_chunked_upload(self):
+        """should assemble the chunks, resuming from the recorded offset"""
+        res = self.open_chunked(size=10)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        upload_id = res.data['id']
+
+        res = self.put_chunk(upload_id, b'01234', 'bytes 0-4/10')
+        self.assertEqual((res.data['offset'], res.data['complete']), (5, False))
+        res = self.put_chunk(upload_id, b'01234', 'bytes 0-4/10')
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(res.data['offset'], 5)
+        res = self.put_chunk(upload_id, b'56789', 'bytes 5-9/10')
+        self.assertEqual((res.data['offset'], res.data['complete']), (10, True))
+
+        upload = ImageUpload.objects.get(pk=upload_id)
+        self.assertEqual(upload.size, 10)
+        with default_storage.open(upload.path) as stored:
+            self.assertEqual(stored.read(), b'0123456789')
+
+    def test_chunked_upload_too_large(self):
+        self.assertEqual(self.open_chunked(size=101).status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        upload_id = self.open_chunked().data['id']
+        res = self.put_chunk(upload_id, b'x' * 50, 'bytes 60-109/*')
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        res = self.put_chunk(upload_id, b'x' * 101, 'bytes 0-100/*')
+        self.assertEqual(res.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertEqual(ImageUpload.objects.get(pk=upload_id).size, 0)
+
+    def test_chunked_upload_of_another_user(self):
+        upload_id = self.open_chunked(size=10).data['id']
+        self.user = create_user(email='other@example.com')
+        res = self.put_chunk(upload_id, b'01234', 'bytes 0-4/10')
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_duplicate_upload_file(self):
+        """should store the same bytes once and return the existing upload"""
+        first = self.post_file(b'same bytes')
+        res = self.post_file(b'same bytes', filename='copy.jpg')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.data['duplicate'])
+        self.assertEqual((res.data['id'], res.data['image_url']), (first.data['id'], first.data['image_url']))
+        self.assertEqual(ImageUpload.objects.get().content_hash, hashlib.sha256(b'same bytes').hexdigest())
+        self.assertFalse(default_storage.exists('media/copy.jpg'))
+
+    def test_duplicate_chunked_upload(self):
+        first = self.post_file(b'0123456789')
+        upload_id = self.open_chunked(size=10).data['id']
+        res = self.put_chunk(upload_id, b'0123456789', 'bytes 0-9/10')
+        self.assertEqual((res.data['id'], res.data['complete']), (first.data['id'], True))
+        self.assertFalse(ImageUpload.objects.filter(pk=upload_id).exists())
+
+    def test_upload_info_for_known_hash(self):
+        """should skip the upload when the server already has the bytes"""
+        first = self.post_file(b'same bytes')
+        request = self.factory.post('/api/media/upload', {
+            'filename': 'photo.jpg', 'content_type': 'image/jpeg',
+            'sha256': hashlib.sha256(b'same bytes').hexdigest().upper()}, format='json')
+        force_authenticate(request, self.user)
+        res = GenerateUploadInfo.as_view()(request)
+        self.assertEqual(res.data, {'strategy': 'existing', 'id': first.data['id'],
+                                    'image_url': first.data['image_url']})
+
+        request = self.factory.post('/api/media/upload', {'filename': 'photo.jpg', 'content_type': 'image/jpeg',
+                                                          'sha256': 'abc'}, format='json')
+        force_authenticate(request, self.user)
+        self.assertEqual(GenerateUploadInfo.as_view()(request).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_references_and_collection(self):
+        """should count the products using an upload and collect it once none does"""
+        used = ImageUpload.objects.get(pk=self.post_file(b'used').data['id'])
+        unused = ImageUpload.objects.get(pk=self.post_file(b'unused').data['id'])
+        serializer = ProductCreateSerializer(data={'name': 'Lamp', 'price': '10.00', 'quantity': 1,
+                                                   'shop': create_shop(self.user).id, 'image_upload': used.id})
+        serializer.is_valid(raise_exception=True)
+        product = serializer.save(created_by=self.user)
+        self.assertEqual(product.image.name, used.path)
+        self.assertEqual(ImageUpload.objects.get(pk=used.pk).ref_count, 1)
+
+        with mock.patch('django.db.transaction.on_commit', lambda func, robust=False: func()):
+            call_command('collect_image_uploads', '--grace-hours', '0', stdout=StringIO())
+        self.assertEqual(list(ImageUpload.objects.values_list('pk', flat=True)), [used.pk])
+        self.assertFalse(default_storage.exists(unused.path))
+        self.assertTrue(default_storage.exists(used.path))
+
+        Product.objects.get(pk=product.pk).delete()
+        self.assertEqual(ImageUpload.objects.get(pk=used.pk).ref_count, 0)
@@ -0,0 +1,270 @@
+"""
+Local uploads streamed to storage in constant memory.
+
+A single-request upload (multipart, field ``file``) is spooled to a temporary
+file as it arrives and then moved into storage; it is never held in memory.
+
+A chunked upload opens a session (an ImageUpload) and then sends the file in
+pieces, each a raw request body with a ``Content-Range: bytes start-end/total``
+header. The session's ``size`` is the offset to resume from after an
+interruption. The upload is complete once ``total`` bytes have arrived.
+
+MEDIA_UPLOAD_MAX_SIZE is enforced while the bytes arrive, so an oversized
+body is cut off at the limit rather than read to the end.
+
+Completed uploads are content-addressed: the server hashes the bytes (SHA-256)
+and keeps one upload per hash. Uploading bytes that are already stored returns
+the existing upload, and a client that knows the hash up front can skip the
+upload entirely (see find_duplicate). Hashes sent by clients are only ever
+looked up, never stored. Products reference uploads by their path
+(ImageUpload.ref_count); collect_image_uploads deletes those no product uses.
+"""
+import hashlib
+import re
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import FileUploadHandler, TemporaryFileUploadHandler
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Now
+from django.utils import timezone
+from rest_framework import exceptions, status
+
+from core import images
+from core.models import IMAGE_UPLOAD_HASH_CONSTRAINT, ImageUpload
+
+# bytes read from the request per write to storage
+CHUNK_SIZE = 64 * 1024
+CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+|\*)$')
+SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+
+class UploadTooLarge(exceptions.APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_code = 'upload_too_large'
+
+    def __init__(self, max_size=None):
+        max_size = settings.MEDIA_UPLOAD_MAX_SIZE if max_size is None else max_size
+        super().__init__(f'Uploads are limited to {max_size} bytes.')
+
+
+class OffsetMismatch(exceptions.APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_code = 'offset_mismatch'
+
+    def __init__(self, upload):
+        super().__init__('Upload already complete.' if upload.completed_at else 'Chunk does not start at the offset.')
+        # the client resumes from the offset given next to the message (kept an int, not an error string)
+        self.detail = {'detail': self.detail, 'offset': upload.size}
+
+
+class UploadBusy(exceptions.APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Another chunk of this upload is in progress.'
+    default_code = 'upload_busy'
+
+
+class MaxSizeUploadHandler(FileUploadHandler):
+    """First in the handler chain: counts the file bytes of a request and stops it past the limit"""
+
+    def __init__(self, request=None, max_size=None):
+        super().__init__(request)
+        self.max_size = settings.MEDIA_UPLOAD_MAX_SIZE if max_size is None else max_size
+        self.received = 0
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # a body that can't fit even with the largest allowed form fields is turned away unread
+        fields_limit = settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+        if fields_limit is not None and content_length > self.max_size + fields_limit:
+            raise UploadTooLarge(self.max_size)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            raise UploadTooLarge(self.max_size)
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """Hashes each file as it streams past, so duplicates are found without reading it again"""
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.hashes = {}
+        self.digest = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        return raw_data
+
+    def file_complete(self, file_size):
+        self.hashes[self.field_name] = self.digest.hexdigest()
+        return None
+
+
+def upload_handlers(request):
+    # no MemoryFileUploadHandler: even small files go to disk, so memory per upload stays at one chunk
+    return [MaxSizeUploadHandler(request), HashingUploadHandler(request), TemporaryFileUploadHandler(request)]
+
+
+def content_hash(request, field_name):
+    """SHA-256 of an uploaded file, computed by the HashingUploadHandler of upload_handlers()"""
+    for handler in request.upload_handlers:
+        if isinstance(handler, HashingUploadHandler):
+            return handler.hashes.get(field_name)
+    return None
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with default_storage.open(path) as stored:
+        for chunk in stored.chunks(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_duplicates(content_hashes):
+    """
+    {hash: completed upload} for those of ``content_hashes`` that are already
+    stored. They are marked as just used, so collect_image_uploads leaves them
+    alone while the caller attaches them.
+    """
+    if not content_hashes:
+        return {}
+    found = {upload.content_hash: upload for upload in
+             ImageUpload.objects.filter(content_hash__in=content_hashes, completed_at__isnull=False)}
+    if found:
+        ImageUpload.objects.filter(pk__in=[upload.pk for upload in found.values()]).update(updated_at=Now())
+    return found
+
+
+def find_duplicate(content_hash):
+    """The completed upload of these bytes, if any (see find_duplicates)"""
+    return find_duplicates([content_hash]).get(content_hash)
+
+
+def is_duplicate(error):
+    return IMAGE_UPLOAD_HASH_CONSTRAINT in str(error)
+
+
+def storage_name(filename):
+    return f'{settings.S3_KEY_PREFIX}/{filename}'
+
+
+def record(request, filename, path, **fields):
+    return ImageUpload.objects.create(name=filename, path=path, created_by=request.user,
+                                      image_url=request.build_absolute_uri(default_storage.url(path)), **fields)
+
+
+def save_file(request, file, filename, content_hash):
+    """
+    Store a file parsed by upload_handlers(); the spooled temporary file is
+    moved, not copied. Returns (upload, created): bytes that are already
+    stored aren't stored again, and the existing upload is returned instead.
+    """
+    existing = find_duplicate(content_hash)
+    if existing is not None:
+        return existing, False
+    path = default_storage.save(storage_name(filename), file)
+    try:
+        with transaction.atomic():
+            return record(request, filename, path, size=file.size, expected_size=file.size,
+                          content_hash=content_hash, completed_at=timezone.now()), True
+    except IntegrityError as error:
+        if not is_duplicate(error):
+            raise
+    # the same bytes finished uploading concurrently
+    default_storage.delete(path)
+    return find_duplicate(content_hash), False
+
+
+def start_upload(request, filename, expected_size=None):
+    if expected_size is not None and expected_size > settings.MEDIA_UPLOAD_MAX_SIZE:
+        raise UploadTooLarge()
+    # reserves the name; chunks are written into this empty file
+    path = default_storage.save(storage_name(filename), ContentFile(b''))
+    return record(request, filename, path, expected_size=expected_size,
+                  completed_at=timezone.now() if expected_size == 0 else None)
+
+
+def parse_content_range(header):
+    """(start, end, total) of a ``bytes start-end/total`` header, total None for ``*``"""
+    match = CONTENT_RANGE.match(header or '')
+    if match is None:
+        raise exceptions.ParseError('Expected a "Content-Range: bytes start-end/total" header.')
+    start, end = int(match[1]), int(match[2])
+    total = None if match[3] == '*' else int(match[3])
+    if end < start or (total is not None and end >= total):
+        raise exceptions.ParseError('Invalid Content-Range.')
+    return start, end, total
+
+
+def write_chunk(upload, stream, content_range):
+    """
+    Write one chunk from ``stream`` into ``upload``, which the caller has
+    locked. A body cut short still advances the offset by what arrived.
+    """
+    start, end, total = content_range
+    if upload.completed_at is not None or start != upload.size:
+        raise OffsetMismatch(upload)
+    if total is not None:
+        if upload.expected_size is not None and total != upload.expected_size:
+            raise exceptions.ParseError(f'Content-Range total differs from the announced {upload.expected_size}.')
+        upload.expected_size = total
+    if end + 1 > settings.MEDIA_UPLOAD_MAX_SIZE:
+        raise UploadTooLarge()
+    if upload.expected_size is not None and end >= upload.expected_size:
+        raise exceptions.ParseError('Content-Range goes past the end of the upload.')
+
+    remaining = end - start + 1
+    with default_storage.open(upload.path, 'r+b') as destination:
+        # bytes past the offset are leftovers of a chunk that failed before the offset was saved
+        destination.seek(start)
+        while remaining:
+            data = stream.read(min(CHUNK_SIZE, remaining))
+            if not data:
+                break
+            destination.write(data)
+            remaining -= len(data)
+        destination.truncate()
+        upload.size = destination.tell()
+
+    if upload.size == upload.expected_size:
+        return complete(upload)
+    upload.save(update_fields=['size', 'expected_size', 'updated_at'])
+    return upload
+
+
+def complete(upload):
+    """
+    Finish a chunked upload. Returns it, or the existing upload of the same
+    bytes, in which case this one and its file are dropped.
+    """
+    upload.content_hash = hash_file(upload.path)
+    upload.completed_at = timezone.now()
+    try:
+        with transaction.atomic():
+            upload.save(update_fields=['size', 'expected_size', 'content_hash', 'completed_at', 'updated_at'])
+            return upload
+    except IntegrityError as error:
+        if not is_duplicate(error):
+            raise
+    path = upload.path
+    upload.delete()
+    transaction.on_commit(lambda: delete_stored([path]))
+    return find_duplicate(upload.content_hash)
+
+
+def delete_stored(paths):
+    """Delete uploaded files and their image variants"""
+    for path in paths:
+        default_storage.delete(path)
+        images.delete_variants(path)
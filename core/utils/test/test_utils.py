@@ -1,13 +1,21 @@
+import tempfile
+from contextlib import contextmanager
+from itertools import count
 from core.models import Shop, Product, Review
 from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
 
 def create_user(**params):
     defaults = dict(email='user@example.com', password='test123', name='Test User')
     defaults.update(params)
     return get_user_model().objects.create_user(**defaults)
 
+shop_numbers = count(1)
+
 def create_shop(user, **params):
-    defaults = dict(name='Test Shop', description='Hello world')
+    # shop names are unique, case-insensitively
+    defaults = dict(name=f'Test Shop {next(shop_numbers)}', description='Hello world')
     defaults.update(params)
     return Shop.objects.create( user=user, created_by=user, **defaults)
 
@@ -19,4 +27,41 @@ def create_product(user, shop, **params):
 def create_review(user, product, **params):
     defaults = dict(rating='2.5', message='Hello World')
     defaults.update(params)
-    return Review.objects.create(user=user, product=product, **defaults)
\ No newline at end of file
+    return Review.objects.create(user=user, product=product, **defaults)
+
+
+def temporary_media(test, **overrides):
+    """Point default_storage at a directory removed after ``test``, with optional other settings"""
+    media_root = tempfile.TemporaryDirectory()
+    test.addCleanup(media_root.cleanup)
+    overridden = override_settings(MEDIA_ROOT=media_root.name, **overrides)
+    overridden.enable()
+    test.addCleanup(overridden.disable)
+
+
+def _format_queries(context):
+    return '\n'.join(f"{i}. {query['sql']}" for i, query in enumerate(context.captured_queries, start=1))
+
+@contextmanager
+def assert_max_queries(max_queries):
+    """Fail if the block runs more than ``max_queries`` SQL queries"""
+    with CaptureQueriesContext(connection) as context:
+        yield context
+    executed = len(context.captured_queries)
+    if executed > max_queries:
+        raise AssertionError(f'{executed} queries executed, budget is {max_queries}:\n{_format_queries(context)}')
+
+def assert_constant_queries(fetch, grow):
+    """
+    Fail if fetch() runs more queries after grow() adds rows than before.
+    Use it to prove an endpoint loads its relations in a fixed number of queries.
+    """
+    with CaptureQueriesContext(connection) as before:
+        fetch()
+    grow()
+    with CaptureQueriesContext(connection) as after:
+        fetch()
+    if len(after.captured_queries) > len(before.captured_queries):
+        raise AssertionError(
+            f'query count grew from {len(before.captured_queries)} to {len(after.captured_queries)}:\n'
+            f'{_format_queries(after)}')
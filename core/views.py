@@ -1,73 +1,148 @@
 import logging
 
 from django.conf import settings
+from django.db import OperationalError, transaction
 from rest_framework.response import Response
-from rest_framework import views
-from django.core.files.storage import default_storage
-from django.core.files.base import ContentFile
+from rest_framework import exceptions, status, views
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 
-import boto3
-import uuid
+from core import cache as catalog_cache
+from core import hashing, presign, uploads
+from core.models import ImageUpload
+from core.serializers import UploadBatchSerializer, UploadFileSerializer
 
 logger = logging.getLogger(__name__)
 
-s3 = boto3.client(
-    "s3",
-    aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
-    region_name=settings.AWS_S3_REGION_NAME,
-)
-
 class GenerateUploadInfo(views.APIView):
+    # a presigned URL lets its holder write to the bucket
+    permission_classes = [IsAuthenticated]
 
     def post(self, request):
-        upload_info = self.generate_upload_url(request, settings.IS_LOCAL)
+        # the same rules as every file of a batch
+        serializer = UploadFileSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        file = serializer.validated_data
+
+        # bytes that are already stored need no upload at all
+        existing = uploads.find_duplicate(file["sha256"]) if file.get("sha256") else None
+        if existing is not None:
+            return Response(presign.existing_target(existing))
+
+        upload_info = self.generate_upload_url(request, file["filename"], file["content_type"], settings.IS_LOCAL)
         return Response(upload_info)
 
 
-    def generate_upload_url(self, request, is_local=True) -> dict:
-        filename = request.data['filename']
-        content_type = request.data['content_type']
-
-        # TODO: add content type validation
-
-        unique_name = f"{uuid.uuid4()}_{filename}"
-
-        if is_local:
-            # for local testing
-            return {
-                "upload_url": "/media/upload/local/",
-                "image_url": request.build_absolute_uri(f"/media/{unique_name}")
-            }
-        
-        # upload to s3 info
-        s3_key = f"{settings.S3_KEY_PREFIX}/{unique_name}"
-        image_url = f"https://{settings.AWS_STORAGE_BUCKET_NAME}.s3.amazonaws.com/{s3_key}"
-        upload_url = s3.generate_presigned_url(
-            "put_object",
-            Params={
-                "Bucket": settings.AWS_STORAGE_BUCKET_NAME,
-                "Key": s3_key,
-                "ContentType": content_type
-            },
-            ExpireseIn=1800
-        )
+    def generate_upload_url(self, request, filename, content_type, is_local=True) -> dict:
+        # local for testing, s3 otherwise
+        strategy = presign.LocalStrategy() if is_local else presign.S3Strategy()
+        return strategy.target(request, filename, content_type)
 
-        return Response({
-            "strategy": "s3",
-            "upload_url": upload_url,
-            "image_url": image_url,
-        })
+
+class GenerateUploadInfoBatch(views.APIView):
+    """Upload targets for many files in one request, in the order they were sent"""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = UploadBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        files = serializer.validated_data["files"]
+
+        # one query for every hash in the batch
+        existing = uploads.find_duplicates({file["sha256"] for file in files if file.get("sha256")})
+        strategy = presign.get_strategy()
+        targets = [
+            presign.existing_target(existing[file["sha256"]]) if file.get("sha256") in existing
+            else strategy.target(request, file["filename"], file["content_type"])
+            for file in files
+        ]
+        return Response({"uploads": targets})
+
+
+def upload_status(upload):
+    return {
+        "id": upload.id,
+        "image_url": upload.image_url,
+        "offset": upload.size,
+        "size": upload.expected_size,
+        "complete": upload.completed_at is not None,
+    }
 
 
 class FileLocalUploadAPIView(views.APIView):
-    # upload files locally
+    # upload files locally, streamed to disk (see core.uploads)
+    permission_classes = [IsAuthenticated]
+
+    def initialize_request(self, request, *args, **kwargs):
+        # must be in place before anything reads the body
+        request.upload_handlers = uploads.upload_handlers(request)
+        return super().initialize_request(request, *args, **kwargs)
+
     def post(self, request):
         file = request.FILES["file"]
         filename = request.data["filename"]
 
-        path = f"{settings.S3_KEY_PREFIX}/{filename}"
+        upload, created = uploads.save_file(request, file, filename, uploads.content_hash(request, "file"))
 
-        default_storage.save(path, ContentFile(file.read()))
+        return Response({"status": "ok", "duplicate": not created, **upload_status(upload)})
 
-        return Response({"status": "ok"})
+
+class ChunkedLocalUploadAPIView(views.APIView):
+    """Open a resumable upload; the chunks are then PUT to its upload_url"""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        filename = request.data["filename"]
+        size = request.data.get("size")
+        try:
+            size = None if size in (None, "") else int(size)
+        except (TypeError, ValueError):
+            raise exceptions.ValidationError({"size": ["A valid integer is required."]})
+
+        upload = uploads.start_upload(request, filename, size)
+
+        return Response({
+            **upload_status(upload),
+            "upload_url": request.build_absolute_uri(f"{request.path.rstrip('/')}/{upload.id}"),
+        }, status=status.HTTP_201_CREATED)
+
+
+class ChunkedLocalUploadDetailAPIView(views.APIView):
+    """GET the offset to resume from, PUT a raw chunk with a Content-Range header"""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        try:
+            upload = ImageUpload.objects.get(pk=pk, created_by=request.user)
+        except ImageUpload.DoesNotExist:
+            raise exceptions.NotFound()
+        return Response(upload_status(upload))
+
+    def put(self, request, pk):
+        content_range = uploads.parse_content_range(request.headers.get("Content-Range"))
+        if request.stream is None:
+            raise exceptions.ParseError("Empty chunk.")
+
+        # the row lock keeps two chunks of one upload from writing at once
+        with transaction.atomic():
+            try:
+                upload = ImageUpload.objects.select_for_update(nowait=True).get(pk=pk, created_by=request.user)
+            except ImageUpload.DoesNotExist:
+                raise exceptions.NotFound()
+            except OperationalError:
+                raise uploads.UploadBusy()
+            # the last chunk may turn out to repeat stored bytes; the response is then about that upload
+            upload = uploads.write_chunk(upload, request.stream, content_range)
+
+        return Response(upload_status(upload))
+
+
+class MetricsAPIView(views.APIView):
+    """Runtime counters for operators"""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response({
+            'catalog_cache': catalog_cache.get_stats(),
+            # this process only: the pool and its queue are per process
+            'password_hashing': hashing.get_stats(),
+        })
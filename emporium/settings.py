@@ -43,6 +43,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'core',
@@ -99,6 +100,47 @@ DATABASES = {
     }
 }
 
+# Cache
+# locmem by default; point CACHE_URL at a shared backend (e.g. redis://) in production
+
+CACHES = {
+    'default': env.cache('CACHE_URL', default='locmemcache://'),
+}
+
+# catalog response cache (see core.cache)
+CATALOG_CACHE_ALIAS = 'default'
+# entries are refreshed after the soft timeout and dropped after the hard one;
+# in between, stale copies are served while a single worker rebuilds them
+CATALOG_CACHE_TIMEOUT = env.int('CATALOG_CACHE_TIMEOUT', default=300)
+CATALOG_CACHE_SOFT_TIMEOUT = env.int('CATALOG_CACHE_SOFT_TIMEOUT', default=60)
+CATALOG_CACHE_EARLY_REFRESH_BETA = 1.0
+CATALOG_CACHE_LOCK_TIMEOUT = 10
+CATALOG_CACHE_LOCK_WAIT = 2.0
+
+# resolved auth tokens (see core.authentication): a per-process LRU in front of the shared cache
+AUTH_TOKEN_CACHE_ALIAS = 'default'
+AUTH_TOKEN_CACHE_TIMEOUT = env.int('AUTH_TOKEN_CACHE_TIMEOUT', default=60)
+AUTH_TOKEN_CACHE_LOCAL_TIMEOUT = env.int('AUTH_TOKEN_CACHE_LOCAL_TIMEOUT', default=5)
+AUTH_TOKEN_CACHE_LOCAL_SIZE = 10_000
+
+# password hashing runs on a process pool so logins don't pin request workers (see core.hashing);
+# 0 workers hashes inline
+PASSWORD_HASHING_WORKERS = env.int('PASSWORD_HASHING_WORKERS', default=2)
+# hashes queued or running per process before further logins wait, then get a 503
+PASSWORD_HASHING_MAX_PENDING = env.int('PASSWORD_HASHING_MAX_PENDING', default=16)
+PASSWORD_HASHING_QUEUE_TIMEOUT = 0.5
+
+AUTHENTICATION_BACKENDS = ['core.hashing.PooledModelBackend']
+
+# processes building resized product image variants off the request path (see core.images); 0 builds inline
+IMAGE_VARIANT_WORKERS = env.int('IMAGE_VARIANT_WORKERS', default=2)
+
+# largest file accepted by the local upload endpoints, enforced while the body streams in (see core.uploads)
+MEDIA_UPLOAD_MAX_SIZE = env.int('MEDIA_UPLOAD_MAX_SIZE', default=25 * 1024 * 1024)
+
+# largest catalog sync accepted by POST /api/product/bulk
+PRODUCT_BULK_MAX_ROWS = 100_000
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -144,7 +186,7 @@ AUTH_USER_MODEL = 'core.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication'
+        'core.authentication.CachedTokenAuthentication'
     ]
 }
 
@@ -161,4 +203,10 @@ AWS_ACCESS_KEY_ID = ''
 AWS_SECRET_ACCESS_KEY = ''
 AWS_S3_REGION_NAME = 'ap-southeast-1'
 AWS_STORAGE_BUCKET_NAME = 'emporium-data'
-S3_KEY_PREFIX = 'media'
\ No newline at end of file
+S3_KEY_PREFIX = 'media'
+# lifetime of presigned upload URLs, in seconds
+S3_PRESIGN_EXPIRES = 1800
+# files per POST /api/media/upload/batch
+MEDIA_UPLOAD_BATCH_MAX_FILES = 50
+# content types the upload endpoints hand out targets for: uploads become product images
+MEDIA_UPLOAD_CONTENT_TYPES = ['image/jpeg', 'image/png', 'image/webp', 'image/gif']
@@ -6,7 +6,8 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 
-from core.views import FileLocalUploadAPIView, GenerateUploadInfo
+from core.views import (ChunkedLocalUploadAPIView, ChunkedLocalUploadDetailAPIView, FileLocalUploadAPIView,
+                        GenerateUploadInfo, GenerateUploadInfoBatch, MetricsAPIView)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -14,13 +15,20 @@ urlpatterns = [
     path('api/shop', include('shop.urls')),
     path('api/product', include('product.urls')),
     path('api/cart', include('cart.urls')),
-    path('api/review', include('review.urls'))
+    path('api/review', include('review.urls')),
+    path('api/metrics', MetricsAPIView.as_view(), name='metrics'),
+    # generate upload url info: presigned S3 uploads, or the local endpoints below with IS_LOCAL
+    path('api/media/upload', GenerateUploadInfo.as_view(), name='upload-info'),
+    path('api/media/upload/batch', GenerateUploadInfoBatch.as_view(), name='upload-info-batch'),
 ]
 
 if settings.DEBUG:
     # serve image
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-    # generate upload url info
-    urlpatterns.append(path('api/media/upload', GenerateUploadInfo.as_view()))
     # endpoint for upload file locally
-    urlpatterns.append(path('api/media/upload/local', FileLocalUploadAPIView.as_view()))
+    urlpatterns.append(path('api/media/upload/local', FileLocalUploadAPIView.as_view(), name='upload-local'))
+    # resumable uploads: open a session, then PUT the chunks to it
+    urlpatterns.append(path('api/media/upload/local/chunked', ChunkedLocalUploadAPIView.as_view(),
+                            name='upload-chunked'))
+    urlpatterns.append(path('api/media/upload/local/chunked/<int:pk>', ChunkedLocalUploadDetailAPIView.as_view(),
+                            name='upload-chunked-detail'))
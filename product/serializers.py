@@ -1,16 +1,54 @@
+from django.urls import reverse
 from rest_framework import serializers
-from core.models import Product, Shop
+from core import images
+from core.models import ImageUpload, Product, Shop
 from review.serializers import ReviewSerializer
 from shop.serializers import ShopShortInfoSerializer
 
-class ProductSerializer(serializers.ModelSerializer):
+# the detail response embeds this many reviews; the rest are paged from reviews_url
+LATEST_REVIEWS_LIMIT = 5
+
+class StockMixin:
+    """Add flash-sale shard totals (see ProductQuerySet.with_stock) to quantity and sold_count"""
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        if hasattr(instance, 'shard_quantity'):
+            if 'quantity' in data:
+                data['quantity'] += instance.shard_quantity
+            if 'sold_count' in data:
+                data['sold_count'] += instance.shard_sold
+        return data
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    """URLs of the resized copies of the product image (see core.images), null until they are built"""
+
+    def __init__(self, **kwargs):
+        super().__init__(source='*', **kwargs)
+
+    def to_representation(self, product):
+        return images.variant_urls(product, self.context.get('request'))
+
+class ProductSerializer(StockMixin, serializers.ModelSerializer):
     shop = ShopShortInfoSerializer(read_only=True)
     sold_count = serializers.IntegerField(read_only=True, default=0)
+    image_variants = ImageVariantsField()
+    # an already uploaded image (see core.uploads), instead of sending the file again
+    image_upload = serializers.PrimaryKeyRelatedField(
+        queryset=ImageUpload.objects.filter(completed_at__isnull=False).exclude(path=''),
+        write_only=True, required=False, error_messages={'does_not_exist': 'Image upload not found'})
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'price', 'quantity', 'shop', 'image', 'variations', 'rating', 'category', 'sold_count', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        fields = ['id', 'name', 'price', 'quantity', 'shop', 'image', 'image_variants', 'image_upload', 'variations', 'rating', 'category', 'sold_count', 'created_at', 'updated_at']
+        # rating is kept in step with the product's reviews (see core.signals)
+        read_only_fields = ['id', 'rating', 'created_at', 'updated_at']
+
+    def validate(self, attrs):
+        upload = attrs.pop('image_upload', None)
+        if upload is not None:
+            attrs['image'] = upload.path
+        return attrs
 
     def validate_price(self, value):
         if value <= 0:
@@ -32,11 +70,6 @@ class ProductSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError('Product name is invalid')
         return value
 
-    def validate_rating(self, value):
-        if 0 <= value <= 5:
-            return value
-        raise serializers.ValidationError('Product rating is invalid')
-
 class ProductCreateSerializer(ProductSerializer):
     shop = serializers.PrimaryKeyRelatedField(queryset=Shop.objects.all(), error_messages={
         'does_not_exist': 'Shop not found',
@@ -47,18 +80,54 @@ class ProductCreateSerializer(ProductSerializer):
         fields = ProductSerializer.Meta.fields
 
 
+class ProductBulkItemSerializer(ProductSerializer):
+    """
+    One row of a bulk sync. Shops are plain ids here and are resolved for the
+    whole batch in a single query by the view.
+    """
+    id = serializers.IntegerField(required=False)
+    shop = serializers.IntegerField()
+
+    class Meta(ProductSerializer.Meta):
+        fields = ['id', 'name', 'price', 'quantity', 'shop', 'variations', 'category']
+        read_only_fields = []
+
+
 class ProductShortInfoSerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Product
-        fields = ['id', 'name', 'price', 'image']
+        fields = ['id', 'name', 'price', 'image', 'image_variants']
 
-class ProductDetailSerializer(serializers.ModelSerializer):
+class ProductDetailSerializer(StockMixin, serializers.ModelSerializer):
     shop = ShopShortInfoSerializer(read_only=True)
-    reviews = ReviewSerializer(many=True, read_only=True)
+    reviews = serializers.SerializerMethodField()
+    rating_summary = serializers.SerializerMethodField()
+    reviews_url = serializers.SerializerMethodField()
     sold_count = serializers.IntegerField(read_only=True, default=0)
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Product
-        fields = ProductSerializer.Meta.fields + ['sold_count', 'reviews']
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        fields = ([field for field in ProductSerializer.Meta.fields if field != 'image_upload']
+                  + ['sold_count', 'reviews', 'rating_summary', 'reviews_url'])
+        read_only_fields = ProductSerializer.Meta.read_only_fields
+
+    def get_reviews(self, product):
+        """Latest reviews only; the view prefetches them into latest_reviews"""
+        reviews = getattr(product, 'latest_reviews', None)
+        if reviews is None:
+            reviews = product.reviews.select_related('user').order_by('-created_at', '-id')[:LATEST_REVIEWS_LIMIT]
+        return ReviewSerializer(reviews, many=True).data
+
+    def get_rating_summary(self, product):
+        histogram = {str(star): getattr(product, f'rating_{star}_count') for star in range(1, 6)}
+        return {
+            'count': product.rating_count,
+            'average': str(product.rating),
+            'histogram': histogram,
+        }
+
+    def get_reviews_url(self, product):
+        return reverse('review:product-reviews', args=[product.id])
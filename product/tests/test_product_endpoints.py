@@ -1,14 +1,27 @@
 from unittest import TestCase
+from itertools import count
+from io import StringIO
+from unittest import mock
+import time
 from django.urls import reverse
-from core.models import Product, Shop
+from core.models import Cart, Product, Transaction
+from django.core.management import call_command
 import pytest
+import json
 from rest_framework import status
 from django.contrib.auth import get_user_model
 from rest_framework.test import APIClient
 from urllib.parse import urlencode
-from product.serializers import ProductSerializer
+from product.serializers import ProductSerializer, LATEST_REVIEWS_LIMIT
+from core.models import Review
+from core.utils.test.test_utils import assert_constant_queries, assert_max_queries, create_shop
+from core import cache as catalog_cache
+from core.checkout import checkout
+from core.inventory import reshard, take_from_shards
+from django.db import transaction
 
 PRODUCTS_URL = reverse('product:product-list-create')
+PRODUCTS_BULK_URL = reverse('product:product-bulk')
 
 def products_url_with_query_param(**query_param):
     return f'{PRODUCTS_URL}?{urlencode(query_param)}'
@@ -19,12 +32,10 @@ def get_product_detail_url(id):
 def create_user(**params):
     return get_user_model().objects.create_user(**params)
 
-def create_shop(user, **params):
-    defaults = dict(
-        name='Shop1',
-    )
+def create_transaction(user, product, **params):
+    defaults = dict(quantity=1, item_price_at_purchase=product.price, total=product.price)
     defaults.update(params)
-    return Shop.objects.create(user=user, created_by=user, **defaults)
+    return Transaction.objects.create(user=user, created_by=user, product=product, **defaults)
 
 def create_product(user, **params):
     defaults = dict(
@@ -68,6 +79,26 @@ class TestProductEndpoints(TestCase):
         product_ids = [product['id'] for product in res.data['results']]
         self.assertIn(product_to_find.id, product_ids)
 
+    def test_list_products_by_search_with_typo(self):
+        """should still find products when the search keyword has a typo"""
+        shop = create_shop(user=self.user)
+        product_to_find = create_product(user=self.user, name='Wireless Headphones', shop=shop)
+        create_product(user=self.user, name='Kettle', shop=shop)
+        res = self.client.get(products_url_with_query_param(search='headphnes'))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        product_ids = [product['id'] for product in res.data['results']]
+        self.assertEqual(product_ids, [product_to_find.id])
+
+    def test_list_products_by_search_ranked(self):
+        """should list products whose name matches the search before shop or category matches"""
+        shop = create_shop(user=self.user, name='Lamp Emporium')
+        category_match = create_product(user=self.user, name='Desk', category='lamp', shop=shop)
+        name_match = create_product(user=self.user, name='Lamp', shop=shop)
+        res = self.client.get(products_url_with_query_param(search='lamp'))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        product_ids = [product['id'] for product in res.data['results']]
+        self.assertEqual(product_ids, [name_match.id, category_match.id])
+
     def test_list_products_with_stocks(self):
         """should only list products with quantity greater than 0"""
         shop = create_shop(user=self.user)
@@ -78,6 +109,23 @@ class TestProductEndpoints(TestCase):
         product_ids = [product['id'] for product in res.data['results']]
         self.assertNotIn(invalid_product.id, product_ids)
 
+    def test_list_products_with_cursor_by_price(self):
+        """should page through products by price when cursor pagination is requested"""
+        shop = create_shop(user=self.user)
+        expensive = create_product(user=self.user, shop=shop, price=30)
+        cheap = create_product(user=self.user, shop=shop, price=10)
+        middle = create_product(user=self.user, shop=shop, price=20)
+        res = self.client.get(products_url_with_query_param(pagination='cursor', ordering='price', page_size=2))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([product['id'] for product in res.data['results']], [cheap.id, middle.id])
+        res = self.client.get(res.data['next'])
+        self.assertEqual([product['id'] for product in res.data['results']], [expensive.id])
+
+    def test_list_products_with_cursor_and_search(self):
+        """should reject cursor pagination on ranked search results"""
+        res = self.client.get(products_url_with_query_param(pagination='cursor', search='foo'))
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_get_product_detail(self):
         shop = create_shop(user=self.user)
         product = create_product(user=self.user, shop=shop)
@@ -86,6 +134,58 @@ class TestProductEndpoints(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(res.data, serializer.data)
 
+    def test_list_products_query_count(self):
+        """should load the shop of every listed product without extra queries"""
+        def grow():
+            for _ in range(5):
+                create_product(user=self.user, shop=create_shop(self.user))
+
+        grow()
+        assert_constant_queries(lambda: self.client.get(products_url_with_query_param(page_size=20)), grow)
+
+    def test_get_product_detail_query_count(self):
+        """should load the reviews of a product and their users without extra queries"""
+        product = create_product(user=self.user, shop=create_shop(user=self.user))
+
+        reviewer_numbers = count()
+
+        def grow():
+            # called again by assert_constant_queries, so every call adds new reviewers
+            for _ in range(5):
+                reviewer = create_user(email=f'reviewer{next(reviewer_numbers)}@example.com', password='test123')
+                Review.objects.create(user=reviewer, product=product, rating='4.0', created_by=reviewer)
+
+        grow()
+        assert_constant_queries(lambda: self.client.get(get_product_detail_url(product.id)), grow)
+
+    def test_get_product_detail_latest_reviews(self):
+        """
+        GIVEN a product with more reviews than the detail response embeds
+        WHEN the product detail is requested
+        THEN only the latest reviews and the rating summary should be returned
+        """
+        product = create_product(user=self.user, shop=create_shop(user=self.user))
+        ratings = ['5.0', '4.5', '4.0', '1.0', '2.4', '3.0', '5.0']
+        reviews = [Review.objects.create(user=self.user, product=product, rating=rating, created_by=self.user)
+                   for rating in ratings]
+        res = self.client.get(get_product_detail_url(product.id))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        review_ids = [review['id'] for review in res.data['reviews']]
+        self.assertEqual(review_ids, [review.id for review in reversed(reviews)][:LATEST_REVIEWS_LIMIT])
+        summary = res.data['rating_summary']
+        self.assertEqual(summary['count'], len(ratings))
+        self.assertEqual(summary['histogram'], {'1': 1, '2': 1, '3': 1, '4': 1, '5': 3})
+        self.assertEqual(res.data['reviews_url'], reverse('review:product-reviews', args=[product.id]))
+
+    def test_recompute_review_stats(self):
+        """should repair a drifted rating histogram from the review rows"""
+        product = create_product(user=self.user, shop=create_shop(user=self.user))
+        Review.objects.create(user=self.user, product=product, rating='3.5', created_by=self.user)
+        Product.objects.filter(pk=product.pk).update(rating_4_count=0, rating_1_count=7)
+        call_command('recompute_review_stats', stdout=StringIO())
+        product.refresh_from_db()
+        self.assertEqual((product.rating_1_count, product.rating_4_count), (0, 1))
+
     def test_get_product_by_category(self):
         shop = create_shop(user=self.user)
         create_product(user=self.user, shop=shop, category='test')
@@ -166,19 +266,335 @@ class TestProductSecuredEndpoints(TestCase):
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn('variations', res.data)
 
-    def test_create_product_with_invalid_rating(self):
+    def test_create_product_ignores_rating(self):
         """
-        GiVEN a product data with invalid rating
-        WHEN user tries to create the product
-        THEN the product should not be created and return an error
+        GiVEN a product data with a rating
+        WHEN user creates or updates the product
+        THEN the rating should be ignored, since it is derived from the reviews
         """
-        payload = dict(name='Test Product', price=10, rating=-1, quantity=1, shop=self.shop.id)
+        payload = dict(name='Test Product', price=10, rating='4.5', quantity=1, shop=self.shop.id)
         res = self.client.post(PRODUCTS_URL, payload)
-        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
-        self.assertIn('rating', res.data)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        product = Product.objects.get(id=res.data['id'])
+        self.assertEqual(product.rating, 0)
+
+        res = self.client.patch(get_product_detail_url(product.id), dict(rating='5.0'))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        product.refresh_from_db()
+        self.assertEqual((product.rating, product.rating_count), (0, 0))
 
     def test_create_product_with_invalid_shop(self):
         payload = dict(name='Test Product', price=10, rating=-1, quantity=1, shop='2')
         res = self.client.post(PRODUCTS_URL, payload)
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn('shop', res.data)
+
+
+    def test_bulk_create_and_update_products(self):
+        """
+        GIVEN a batch with new products, an update and invalid rows
+        WHEN the batch is posted to the bulk endpoint
+        THEN the valid rows should be written and the invalid ones reported by index
+        """
+        existing = create_product(user=self.user, shop=self.shop, name='Old Name')
+        payload = [
+            dict(name='Bulk Lamp', price='10.00', quantity=3, shop=self.shop.id, category='home'),
+            dict(id=existing.id, name='New Name'),
+            dict(name='Bad Price', price='-1', quantity=3, shop=self.shop.id),
+            dict(name='Missing Shop', price='5.00', quantity=3, shop=self.shop.id + 1000),
+            dict(id=existing.id + 1000, name='Missing Product'),
+        ]
+        res = self.client.post(PRODUCTS_BULK_URL, payload, format='json')
+        self.assertEqual(res.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual((res.data['created'], res.data['updated']), (1, 1))
+        self.assertEqual([error['index'] for error in res.data['errors']], [2, 3, 4])
+        self.assertIn('price', res.data['errors'][0]['errors'])
+
+        created = Product.objects.get(id=res.data['ids'][0])
+        self.assertEqual((created.name, created.created_by_id), ('Bulk Lamp', self.user.id))
+        existing.refresh_from_db()
+        self.assertEqual(existing.name, 'New Name')
+
+        res = self.client.get(products_url_with_query_param(search='lamp'))
+        self.assertEqual([product['id'] for product in res.data['results']], [created.id])
+
+    def test_bulk_create_products_from_ndjson(self):
+        """should accept newline-delimited JSON payloads"""
+        lines = [json.dumps(dict(name=f'Product {i}', price='1.00', quantity=1, shop=self.shop.id))
+                 for i in range(3)]
+        res = self.client.post(PRODUCTS_BULK_URL, '\n'.join(lines), content_type='application/x-ndjson')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data['created'], 3)
+        self.assertEqual(Product.objects.filter(shop=self.shop).count(), 3)
+
+@pytest.mark.django_db
+class TestProductSoldCount(TestCase):
+
+    def setUp(self):
+        self.user = create_user(email='user@example.com', password='test123')
+        self.client = APIClient()
+        self.shop = create_shop(self.user)
+        self.product = create_product(user=self.user, shop=self.shop)
+
+    def test_sold_count_follows_transaction_writes(self):
+        """
+        GIVEN a product
+        WHEN transactions are created, changed and deleted
+        THEN the stored sold_count should follow the transaction quantities
+        """
+        first = create_transaction(self.user, self.product, quantity=3)
+        second = create_transaction(self.user, self.product, quantity=2)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.sold_count, 5)
+
+        first.quantity = 1
+        first.save()
+        second.delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.sold_count, 1)
+
+    def test_sold_count_in_listing(self):
+        """should return the stored sold_count in the product listing"""
+        create_transaction(self.user, self.product, quantity=4)
+        res = self.client.get(products_url_with_query_param(shop=self.shop.id))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['results'][0]['sold_count'], 4)
+
+    def test_reconcile_sold_count(self):
+        """should repair a drifted sold_count from the transaction rows"""
+        create_transaction(self.user, self.product, quantity=2)
+        Product.objects.filter(pk=self.product.pk).update(sold_count=99)
+        call_command('reconcile_sold_count', stdout=StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.sold_count, 2)
+
+
+@pytest.mark.django_db
+class TestProductAsyncEndpoints(TestCase):
+
+    def setUp(self):
+        self.user = create_user(email='user@example.com', password='test123')
+        self.client = APIClient()
+        self.shop = create_shop(self.user)
+
+    def test_async_list_matches_sync_list(self):
+        """
+        GIVEN products in a shop
+        WHEN the async listing is requested with the same filters as the sync one
+        THEN both should return the same page of products
+        """
+        for i in range(3):
+            create_product(user=self.user, shop=self.shop, name=f'Product {i}')
+        params = dict(shop=self.shop.id, page_size=2)
+        sync = self.client.get(PRODUCTS_URL, params).json()
+        res = self.client.get(reverse('product:product-list-async'), params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        data = res.json()
+        self.assertEqual(data['results'], sync['results'])
+        self.assertEqual((data['count'], data['count_is_exact']), (3, True))
+        self.assertIsNotNone(data['next'])
+
+        res = self.client.get(reverse('product:product-list-async'), dict(params, page=9))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_async_detail_matches_sync_detail(self):
+        """should return the same product detail, and honour the ETag, from the async view"""
+        product = create_product(user=self.user, shop=self.shop)
+        Review.objects.create(product=product, user=self.user, created_by=self.user, rating=4, message='ok')
+        url = reverse('product:product-detail-async', args=[product.id])
+        res = self.client.get(url)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json(), self.client.get(get_product_detail_url(product.id)).json())
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        res = self.client.get(reverse('product:product-detail-async', args=[999999]))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@pytest.mark.django_db
+class TestProductFlashSale(TestCase):
+
+    def setUp(self):
+        self.user = create_user(email='user@example.com', password='test123')
+        self.client = APIClient()
+        self.shop = create_shop(self.user)
+        self.product = create_product(user=self.user, shop=self.shop, quantity=10)
+
+    def test_reshard_keeps_stock_visible(self):
+        """
+        GIVEN a product in flash-sale mode
+        WHEN units are sold from its shards
+        THEN reads should report the shard totals as quantity and sold_count
+        """
+        call_command('flash_sale', self.product.id, shards=4, stdout=StringIO())
+        self.assertEqual(list(self.product.inventory.order_by('index').values_list('quantity', flat=True)),
+                         [3, 3, 2, 2])
+        with transaction.atomic():
+            self.assertTrue(take_from_shards(self.product.id, 1))
+            # more than any single shard holds
+            self.assertTrue(take_from_shards(self.product.id, 5))
+            self.assertFalse(take_from_shards(self.product.id, 5))
+
+        res = self.client.get(get_product_detail_url(self.product.id))
+        self.assertEqual((res.data['quantity'], res.data['sold_count']), (4, 6))
+        res = self.client.get(products_url_with_query_param(shop=self.shop.id))
+        self.assertEqual(res.data['results'][0]['quantity'], 4)
+
+    def test_reshard_back_to_product_row(self):
+        """should fold shard stock and sales back into the product row"""
+        reshard(self.product.id, 4)
+        with transaction.atomic():
+            take_from_shards(self.product.id, 3)
+        reshard(self.product.id, 0)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.quantity, self.product.sold_count), (7, 3))
+        self.assertFalse(self.product.inventory.exists())
+
+    def test_restock_goes_to_shards(self):
+        """should spread a quantity PATCH over the shards of a flash-sale product"""
+        reshard(self.product.id, 2)
+        self.client.force_authenticate(user=self.user)
+        res = self.client.patch(get_product_detail_url(self.product.id), dict(quantity=50))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['quantity'], 50)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.quantity, 0)
+        self.assertEqual(sorted(self.product.inventory.values_list('quantity', flat=True)), [25, 25])
+
+
+@pytest.mark.django_db
+class TestProductResponseCache(TestCase):
+
+    def setUp(self):
+        self.user = create_user(email='user@example.com', password='test123')
+        self.client = APIClient()
+        self.shop = create_shop(self.user)
+        self.product = create_product(user=self.user, shop=self.shop)
+
+    def test_list_products_served_from_cache(self):
+        """should answer a repeated listing without touching the database"""
+        first = self.client.get(products_url_with_query_param(shop=self.shop.id, page=1))
+        with assert_max_queries(0):
+            second = self.client.get(products_url_with_query_param(page=1, shop=self.shop.id))
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(catalog_cache.get_stats()['hits'], 1)
+
+    def test_product_detail_invalidated_by_writes(self):
+        """
+        GIVEN a cached product detail
+        WHEN the product, its shop or its sales change
+        THEN the next request should return the fresh data
+        """
+        url = get_product_detail_url(self.product.id)
+        self.client.get(url)
+
+        self.product.name = 'Renamed Product'
+        self.product.save()
+        self.assertEqual(self.client.get(url).data['name'], 'Renamed Product')
+
+        self.shop.name = 'Renamed Shop'
+        self.shop.save()
+        self.assertEqual(self.client.get(url).data['shop']['name'], 'Renamed Shop')
+
+        create_transaction(self.user, self.product, quantity=2)
+        self.assertEqual(self.client.get(url).data['sold_count'], 2)
+
+    def test_sales_leave_list_pages_cached(self):
+        """
+        GIVEN a cached product list
+        WHEN products sell or get reviewed without selling out
+        THEN the list should still be served from the cache while the detail is refreshed
+        """
+        list_url = products_url_with_query_param(shop=self.shop.id, page=1)
+        self.client.get(list_url)
+        detail_url = get_product_detail_url(self.product.id)
+        self.client.get(detail_url)
+
+        create_transaction(self.user, self.product, quantity=2)
+        Review.objects.create(user=self.user, product=self.product, rating=4, created_by=self.user)
+        Cart.objects.create(user=self.user, product=self.product, quantity=1, created_by=self.user)
+        checkout(self.user)
+
+        with assert_max_queries(0):
+            self.client.get(list_url)
+        self.assertEqual(self.client.get(detail_url).data['sold_count'], 3)
+
+    def test_selling_out_refreshes_list_pages(self):
+        list_url = products_url_with_query_param(shop=self.shop.id, page=1)
+        self.assertEqual(len(self.client.get(list_url).data['results']), 1)
+        Cart.objects.create(user=self.user, product=self.product, quantity=self.product.quantity,
+                            created_by=self.user)
+        checkout(self.user)
+        self.assertEqual(self.client.get(list_url).data['results'], [])
+
+    def test_cache_metrics_require_admin(self):
+        self.client.force_authenticate(user=self.user)
+        res = self.client.get(reverse('metrics'))
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.user.is_staff = True
+        self.user.save()
+        res = self.client.get(reverse('metrics'))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(res.data['catalog_cache']), set(catalog_cache.STATS))
+
+    def test_product_detail_serves_stale_copy_during_rebuild(self):
+        """
+        GIVEN a cached product detail that has just been invalidated
+        WHEN another worker holds the rebuild lock
+        THEN the stale copy should be served without querying the database
+        """
+        url = get_product_detail_url(self.product.id)
+        self.client.get(url)
+        self.product.name = 'Renamed Product'
+        self.product.save()
+
+        cache = catalog_cache.get_cache()
+        add = cache.add
+        def add_without_locks(key, *args, **kwargs):
+            return False if key.startswith('lock:') else add(key, *args, **kwargs)
+
+        with mock.patch.object(cache, 'add', side_effect=add_without_locks):
+            with assert_max_queries(0):
+                res = self.client.get(url)
+        self.assertEqual(res.data['name'], 'Product1')
+        self.assertEqual(catalog_cache.get_stats()['stale'], 1)
+        self.assertEqual(self.client.get(url).data['name'], 'Renamed Product')
+
+    def test_early_refresh_near_soft_expiry(self):
+        """should refresh entries past their soft expiry and keep fresh ones"""
+        now = time.time()
+        expired = dict(build_seconds=0.01, soft_expires_at=now - 1)
+        fresh = dict(build_seconds=0.01, soft_expires_at=now + 3600)
+        self.assertTrue(catalog_cache.should_refresh(expired, now))
+        self.assertFalse(catalog_cache.should_refresh(fresh, now))
+
+    def test_product_detail_conditional_get(self):
+        """
+        GIVEN a client holding the ETag of a product detail
+        WHEN it asks again with If-None-Match
+        THEN it should get 304 until the product changes
+        """
+        url = get_product_detail_url(self.product.id)
+        res = self.client.get(url)
+        etag = res['ETag']
+        self.assertIn('Last-Modified', res)
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        create_transaction(self.user, self.product, quantity=1)
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'], etag)
+
+    def test_list_products_conditional_get(self):
+        """should answer 304 for an unchanged listing page and 200 once a product is added"""
+        url = products_url_with_query_param(shop=self.shop.id)
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertNotEqual(self.client.get(products_url_with_query_param(shop=self.shop.id, page_size=5))['ETag'], etag)
+
+        create_product(user=self.user, shop=self.shop, name='Product2')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
@@ -1,9 +1,14 @@
 from django.urls import path
-from product.views import ListProductView, CreateProductView, ProductAPIView, ProductDetailAPIView
+from product.views import (ListProductView, CreateProductView, ProductAPIView, ProductDetailAPIView,
+                           ProductBulkAPIView, AsyncProductListView, AsyncProductDetailView)
 
 app_name = 'product'
 
 urlpatterns = [
     path('', ProductAPIView.as_view(), name='product-list-create'),
+    path('/bulk', ProductBulkAPIView.as_view(), name='product-bulk'),
+    # native async reads for ASGI deployments
+    path('/async', AsyncProductListView.as_view(), name='product-list-async'),
+    path('/async/<str:product_id>', AsyncProductDetailView.as_view(), name='product-detail-async'),
     path('/<str:product_id>', ProductDetailAPIView.as_view(), name='product-detail'),
 ]
\ No newline at end of file
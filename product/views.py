@@ -1,15 +1,52 @@
+import asyncio
+
 from rest_framework import generics, views
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.db.models import Prefetch
+from django.conf import settings
+from django.utils import timezone
+from django.http import JsonResponse
+from django.views import View
+from rest_framework.parsers import JSONParser
 from product.serializers import (ProductDetailSerializer, ProductSerializer,
-                                 ProductCreateSerializer)
-from core.models import Product
-from core.pagination import CustomPagination
-from django.db.models import Sum, Value
-from django.db.models.functions import Coalesce
+                                 ProductCreateSerializer, ProductBulkItemSerializer,
+                                 LATEST_REVIEWS_LIMIT)
+from core.authentication import CachedTokenAuthentication
+from core.models import IN_STOCK, Product, Review, Shop
+from core.pagination import (COUNT_ESTIMATE, CustomPagination, alist, apaginate, get_paginator,
+                             wants_cursor_pagination)
+from core.search import refresh_search_vector, search_products
+from core.parsers import NDJSONParser
+from core.inventory import ashard_state, reshard, shard_state
+from core.cache import (CATALOG_LIST, cached_response_data, invalidate_many, product_namespace,
+                        shop_namespace)
+from core.signals import recompute_shop_stats
+from core.conditional import aget_validators, conditional_response, get_validators, not_modified, set_validators
+
+
+def catalog_products(query_params):
+    """The products listed for a set of query parameters, shared by the sync and async views"""
+    # flash-sale products keep their stock in shards, not in Product.quantity
+    products = Product.objects.select_related('shop').filter(IN_STOCK)
+    shop = query_params.get('shop')
+    search_param = query_params.get('search')
+    category_param = query_params.get('category')
+    if shop:
+        products = products.filter(shop__id__exact=shop)
+    if search_param:
+        products = search_products(products, search_param)
+    if category_param:
+        products = products.filter(category__iexact=category_param)
+    return products
+
+
+def latest_reviews(product_id):
+    return Review.objects.filter(product_id=product_id).select_related('user').order_by('-created_at', '-id')[:LATEST_REVIEWS_LIMIT]
 
 
 class ListProductView(generics.ListAPIView):
@@ -17,7 +54,7 @@ class ListProductView(generics.ListAPIView):
     pagination_class = CustomPagination
 
     def get_queryset(self):
-        queryset = Product.objects.all()
+        queryset = Product.objects.select_related('shop')
         shop = self.request.query_params.get('shop')
         if shop:
             queryset = queryset.filter(shop__id__exact=shop)
@@ -27,13 +64,22 @@ class ListProductView(generics.ListAPIView):
 class CreateProductView(generics.CreateAPIView):
     serializer_class = ProductSerializer
     queryset = Product.objects.all()
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
     def perform_create(self, serializer):
         return serializer.save(created_by=self.request.user)
 
 class ProductAPIView(views.APIView):
+    # sort keys available with ?pagination=cursor, each backed by a composite index
+    cursor_orderings = {
+        '-created_at': ('-created_at', '-id'),
+        'created_at': ('created_at', 'id'),
+        'price': ('price', 'id'),
+        '-price': ('-price', '-id'),
+    }
+    # the catalog is large and barely filtered, so page totals come from the planner
+    count_strategy = COUNT_ESTIMATE
 
     def get_permissions(self):
         if self.request.method == 'POST':
@@ -41,22 +87,19 @@ class ProductAPIView(views.APIView):
         return [AllowAny()]
 
     def get(self, request):
-        paginator = CustomPagination()
-        products = Product.objects.all().filter(quantity__gt=0).annotate(
-            sold_count=Coalesce(Sum('transaction__quantity'), Value(0))
-        )
-        shop = request.query_params.get('shop')
-        search_param = request.query_params.get('search')
-        category_param = request.query_params.get('category')
-        if shop:
-            products = products.filter(shop__id__exact=shop)
-        if search_param:
-            products = products.filter(name__icontains=search_param)
-        if category_param:
-            products = products.filter(category__iexact=category_param)
-        paginated_products = paginator.paginate_queryset(products, request)
+        payload = cached_response_data('product-list', request, [CATALOG_LIST],
+                                       lambda: (self.list_products(request), []))
+        return conditional_response(request, payload['validators'], lambda: Response(payload['data']))
+
+    def list_products(self, request):
+        paginator = get_paginator(request, self.cursor_orderings, self.count_strategy)
+        if request.query_params.get('search') and wants_cursor_pagination(request):
+            raise ValidationError({'search': 'Search results are ranked and only support page-number pagination'})
+        products = catalog_products(request.query_params)
+        validators = get_validators(request, products, related=['shop'], extra=shard_state(products))
+        paginated_products = paginator.paginate_queryset(products.with_stock(), request)
         serializer = ProductSerializer(paginated_products, many=True)
-        return paginator.get_paginated_response(serializer.data)
+        return {'data': paginator.get_paginated_response(serializer.data).data, 'validators': validators}
 
     def post(self, request):
         serializer = ProductCreateSerializer(data=request.data)
@@ -79,15 +122,32 @@ class ProductDetailAPIView(views.APIView):
             return [AllowAny()]
 
     def get(self, request, product_id):
-        product = get_object_or_404(Product.objects.annotate(sold_count=Coalesce(Sum('transaction__quantity'), Value(0))), pk=product_id)
+        payload = cached_response_data('product-detail', request, [product_namespace(product_id)],
+                                       lambda: self.retrieve_product(request, product_id))
+        return conditional_response(request, payload['validators'],
+                                    lambda: Response(payload['data'], status=status.HTTP_200_OK))
+
+    def retrieve_product(self, request, product_id):
+        queryset = Product.objects.with_stock().select_related('shop').prefetch_related(
+            Prefetch('reviews',
+                     queryset=Review.objects.select_related('user').order_by('-created_at', '-id')[:LATEST_REVIEWS_LIMIT],
+                     to_attr='latest_reviews')
+        )
+        product = get_object_or_404(queryset, pk=product_id)
+        row = Product.objects.filter(pk=product.pk)
+        validators = get_validators(request, row, related=['shop'], extra=shard_state(row))
         serializer = ProductDetailSerializer(product)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return {'data': serializer.data, 'validators': validators}, [shop_namespace(product.shop_id)]
 
     def patch(self, request, product_id):
         product = get_object_or_404(Product, pk=product_id)
         serializer = ProductCreateSerializer(product, data=request.data, partial=True)
         if serializer.is_valid():
             product = serializer.save()
+            if product.inventory_shards and 'quantity' in serializer.validated_data:
+                # a flash-sale product is restocked through its shards
+                reshard(product.id, product.inventory_shards, quantity=product.quantity)
+                product = Product.objects.with_stock().select_related('shop').get(pk=product.pk)
             response_serializer = ProductSerializer(product)
             return Response(response_serializer.data, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -95,4 +155,150 @@ class ProductDetailAPIView(views.APIView):
     def delete(self, request, product_id):
         product = get_object_or_404(Product, pk=product_id)
         product.delete()
-        return Response({'message': 'Product successfully deleted'}, status=status.HTTP_200_OK)
\ No newline at end of file
+        return Response({'message': 'Product successfully deleted'}, status=status.HTTP_200_OK)
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class ProductBulkAPIView(views.APIView):
+    """
+    Create and update many products in one request, as a JSON array or NDJSON.
+    Rows with an id update that product, the others are created. Invalid rows
+    are reported by index and the valid ones are still written.
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [JSONParser, NDJSONParser]
+    chunk_size = 1000
+
+    def post(self, request):
+        rows = request.data
+        if not isinstance(rows, list):
+            return Response({'detail': 'Expected a list of products'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(rows) > settings.PRODUCT_BULK_MAX_ROWS:
+            return Response({'detail': f'At most {settings.PRODUCT_BULK_MAX_ROWS} products per request'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        errors = {}
+        validated = self.validate_rows(rows, errors)
+        existing = Product.objects.in_bulk([data['id'] for data in validated.values() if 'id' in data])
+        shop_ids = {data['shop'] for data in validated.values() if 'shop' in data}
+        shop_ids.update(product.shop_id for product in existing.values())
+        shops = Shop.objects.in_bulk(shop_ids)
+
+        to_create, to_update, update_fields = {}, {}, {'updated_at'}
+        restocked = []
+        now = timezone.now()
+        for index, data in validated.items():
+            if 'shop' in data and data['shop'] not in shops:
+                errors[index] = {'shop': ['Shop not found']}
+                continue
+            if 'shop' in data:
+                data['shop'] = shops[data['shop']]
+            if 'id' not in data:
+                to_create[index] = Product(created_by=request.user, **data)
+                continue
+            product = existing.get(data.pop('id'))
+            if product is None:
+                errors[index] = {'id': ['Product not found']}
+                continue
+            for field, value in data.items():
+                setattr(product, field, value)
+            # bulk_update bypasses auto_now
+            product.updated_at = now
+            update_fields.update(data)
+            to_update[index] = product
+            if product.inventory_shards and 'quantity' in data:
+                restocked.append(product)
+
+        with transaction.atomic():
+            for chunk in chunked(list(to_create.values()), self.chunk_size):
+                Product.objects.bulk_create(chunk)
+            if to_update:
+                Product.objects.bulk_update(list(to_update.values()), sorted(update_fields),
+                                            batch_size=self.chunk_size)
+            for product in restocked:
+                reshard(product.id, product.inventory_shards, quantity=product.quantity)
+            written = list(to_create.values()) + list(to_update.values())
+            self.after_write(written, shops)
+
+        ids = [None] * len(rows)
+        for index, product in (to_create | to_update).items():
+            ids[index] = product.id
+        result = {
+            'created': len(to_create),
+            'updated': len(to_update),
+            'ids': ids,
+            'errors': [{'index': index, 'errors': errors[index]} for index in sorted(errors)],
+        }
+        return Response(result, status=status.HTTP_207_MULTI_STATUS if errors else status.HTTP_201_CREATED)
+
+    def validate_rows(self, rows, errors):
+        """Run the field validation of every row, collecting errors by row index"""
+        create_serializer = ProductBulkItemSerializer()
+        update_serializer = ProductBulkItemSerializer(partial=True)
+        validated = {}
+        for index, row in enumerate(rows):
+            if not isinstance(row, dict):
+                errors[index] = {'non_field_errors': ['Expected a product object']}
+                continue
+            serializer = update_serializer if 'id' in row else create_serializer
+            try:
+                validated[index] = dict(serializer.run_validation(row))
+            except ValidationError as exc:
+                errors[index] = exc.detail
+        return validated
+
+    def after_write(self, products, shops):
+        """bulk_create and bulk_update skip signals, so do their work set-based here"""
+        by_shop = {}
+        for product in products:
+            by_shop.setdefault(product.shop_id, []).append(product.id)
+        for shop_id, product_ids in by_shop.items():
+            for chunk in chunked(product_ids, self.chunk_size):
+                refresh_search_vector(Product.objects.filter(pk__in=chunk), shops[shop_id].name)
+        # includes the shops products moved away from
+        recompute_shop_stats(Shop.objects.filter(pk__in=shops))
+        invalidate_many([CATALOG_LIST] + [product_namespace(product.id) for product in products])
+
+
+class AsyncProductListView(View):
+    """
+    Native async variant of the product listing for ASGI servers. Same filters
+    and response shape as ProductAPIView.get with page-number pagination; the
+    page, the count and the ETag queries are awaited together.
+    """
+
+    async def get(self, request):
+        products = catalog_products(request.GET)
+        validators = await aget_validators(request, products, related=['shop'], extra=ashard_state(products))
+        response = not_modified(request, validators)
+        if response is None:
+            data = await apaginate(request, products.with_stock(),
+                                   lambda rows: ProductSerializer(rows, many=True).data)
+            if data is None:
+                return JsonResponse({'detail': 'Invalid page.'}, status=status.HTTP_404_NOT_FOUND)
+            response = JsonResponse(data)
+        return set_validators(response, validators)
+
+
+class AsyncProductDetailView(View):
+    """Native async variant of ProductDetailAPIView.get; the product, its latest reviews and the ETag load concurrently"""
+
+    async def get(self, request, product_id):
+        try:
+            row = Product.objects.filter(pk=product_id)
+            product, reviews, validators = await asyncio.gather(
+                Product.objects.with_stock().select_related('shop').aget(pk=product_id),
+                alist(latest_reviews(product_id)),
+                aget_validators(request, row, related=['shop'], extra=ashard_state(row)),
+            )
+        except (Product.DoesNotExist, ValueError):
+            return JsonResponse({'detail': 'No Product matches the given query.'}, status=status.HTTP_404_NOT_FOUND)
+        response = not_modified(request, validators)
+        if response is None:
+            product.latest_reviews = reviews
+            response = JsonResponse(ProductDetailSerializer(product).data)
+        return set_validators(response, validators)
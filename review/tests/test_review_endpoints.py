@@ -1,9 +1,14 @@
+import json
+from base64 import urlsafe_b64encode
 from unittest import TestCase
 import pytest
+from decimal import Decimal
+from core.models import Review
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
-from core.utils.test.test_utils import create_user, create_shop, create_product, create_review
+from core.utils.test.test_utils import (create_user, create_shop, create_product, create_review,
+                                        assert_constant_queries)
 
 REVIEWS_URL = reverse('review:review-list-create')
 
@@ -24,6 +29,86 @@ class TestReviewPublicEndpoints(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(len(res.data['results']), 2)
 
+    def test_get_review_query_count(self):
+        """should load the user of every review without extra queries"""
+        def grow():
+            for i in range(5):
+                reviewer = create_user(email=f'reviewer{i}@example.com')
+                create_review(reviewer, self.product, created_by=reviewer)
+
+        create_review(self.user, self.product, created_by=self.user)
+        assert_constant_queries(lambda: self.client.get(REVIEWS_URL, dict(page_size=20)), grow)
+
+    def test_get_product_reviews_async(self):
+        """should page the reviews of a product from the async view"""
+        for message in ('foo', 'bar', 'baz'):
+            create_review(self.user, self.product, message=message, created_by=self.user)
+        url = reverse('review:product-reviews-async', args=[self.product.id])
+        res = self.client.get(url, dict(page_size=2))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        data = res.json()
+        self.assertEqual([review['message'] for review in data['results']], ['baz', 'bar'])
+        self.assertEqual((data['count'], data['count_is_exact']), (3, True))
+        self.assertIsNotNone(data['next'])
+        res = self.client.get(reverse('review:product-reviews-async', args=[999999]))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_review_with_cursor(self):
+        """should walk the reviews newest first with opaque cursors"""
+        reviews = [create_review(self.user, self.product, message=f'review {i}', created_by=self.user)
+                   for i in range(3)]
+        res = self.client.get(REVIEWS_URL, dict(pagination='cursor', page_size=2))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([review['id'] for review in res.data['results']], [reviews[2].id, reviews[1].id])
+        self.assertIsNone(res.data['previous'])
+        self.assertNotIn('count', res.data)
+
+        res = self.client.get(res.data['next'])
+        self.assertEqual([review['id'] for review in res.data['results']], [reviews[0].id])
+        self.assertIsNone(res.data['next'])
+
+        res = self.client.get(res.data['previous'])
+        self.assertEqual([review['id'] for review in res.data['results']], [reviews[2].id, reviews[1].id])
+
+    def test_get_review_with_invalid_cursor(self):
+        """should return not found for a cursor that can't be decoded"""
+        res = self.client.get(REVIEWS_URL, dict(cursor='not-a-cursor'))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+        # a well-formed cursor whose position isn't made of strings, or can't be parsed
+        for position in ([[1], [1]], ['not-a-date', '1']):
+            payload = json.dumps({'o': '-created_at', 'p': position, 'r': False}).encode()
+            res = self.client.get(REVIEWS_URL, dict(cursor=urlsafe_b64encode(payload).decode()))
+            self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_reviewer_rename_changes_etag(self):
+        """
+        GIVEN a client holding the ETag of a review listing
+        WHEN the reviewer is renamed
+        THEN the listing should be sent again with the new name
+        """
+        create_review(self.user, self.product, created_by=self.user)
+        urls = [REVIEWS_URL, reverse('review:product-reviews', args=[self.product.id]),
+                reverse('review:product-reviews-async', args=[self.product.id])]
+        etags = [self.client.get(url)['ETag'] for url in urls]
+        self.user.name = 'Renamed Reviewer'
+        self.user.save()
+        for url, etag in zip(urls, etags):
+            with self.subTest(url=url):
+                res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(res.status_code, status.HTTP_200_OK)
+                self.assertEqual(res.json()['results'][0]['user']['name'], 'Renamed Reviewer')
+
+    def test_get_product_reviews(self):
+        """should list only the reviews of the requested product"""
+        other_product = create_product(user=self.user, shop=self.shop, name='Other Product')
+        review = create_review(self.user, self.product, created_by=self.user)
+        create_review(self.user, other_product, created_by=self.user)
+        res = self.client.get(reverse('review:product-reviews', args=[self.product.id]))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in res.data['results']], [review.id])
+        self.assertIsNone(res.data['next'])
+
     def test_unauthorized_create_review(self):
         """
         GIVEN an unauthenticated user
@@ -82,4 +167,26 @@ class TestReviewPrivateEndpoints(TestCase):
         payload = dict(rating=-1, product=self.product.id)
         res = self.client.post(REVIEWS_URL, payload)
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
-        self.assertIn('rating', res.data)
\ No newline at end of file
+        self.assertIn('rating', res.data)
+
+    def test_create_review_updates_product_rating(self):
+        """
+        GIVEN a product
+        WHEN reviews are created, edited and deleted
+        THEN the product rating should follow the average of its reviews
+        """
+        self.client.post(REVIEWS_URL, dict(rating='4.5', product=self.product.id))
+        res = self.client.post(REVIEWS_URL, dict(rating='2.0', product=self.product.id))
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_count, self.product.rating), (2, Decimal('3.3')))
+
+        review = Review.objects.get(id=res.data['id'])
+        review.rating = Decimal('3.5')
+        review.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating, Decimal('4.0'))
+
+        Review.objects.filter(product=self.product).delete()
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_count, self.product.rating_sum, self.product.rating),
+                         (0, Decimal('0'), Decimal('0')))
@@ -1,8 +1,10 @@
 from django.urls import path
-from review.views import ReviewAPIView
+from review.views import ReviewAPIView, ProductReviewAPIView, AsyncProductReviewView
 
 app_name = 'review'
 
 urlpatterns = [
-    path('', ReviewAPIView.as_view(), name='review-list-create')
+    path('', ReviewAPIView.as_view(), name='review-list-create'),
+    path('/product/<str:product_id>', ProductReviewAPIView.as_view(), name='product-reviews'),
+    path('/async/product/<str:product_id>', AsyncProductReviewView.as_view(), name='product-reviews-async'),
 ]
\ No newline at end of file
@@ -1,15 +1,26 @@
 # get paginated reviews based on product
 # create review
 # delete review
+import asyncio
+
+from django.http import JsonResponse
+from django.views import View
 from rest_framework import views, status
 from rest_framework.response import Response
-from core.pagination import CustomPagination
+from django.shortcuts import get_object_or_404
+from core.pagination import COUNT_ESTIMATE, KeysetPagination, apaginate, get_paginator
 from review.serializers import ReviewSerializer, ReviewCreateSerializer
-from core.models import Review
+from core.models import Product, Review
+from core.conditional import aget_validators, conditional_response, get_validators, not_modified, set_validators
 from rest_framework.permissions import IsAuthenticated, AllowAny
 
 
 class ReviewAPIView(views.APIView):
+    cursor_orderings = {
+        '-created_at': ('-created_at', '-id'),
+        'created_at': ('created_at', 'id'),
+    }
+    count_strategy = COUNT_ESTIMATE
 
     def get_permissions(self):
         if self.request.method == 'POST':
@@ -17,11 +28,15 @@ class ReviewAPIView(views.APIView):
         return [AllowAny()]
 
     def get(self, request):
-        paginator = CustomPagination()
-        reviews = Review.objects.all().order_by('-created_at')
-        paginated_reviews = paginator.paginate_queryset(reviews, request)
-        serializer = ReviewSerializer(paginated_reviews, many=True)
-        return paginator.get_paginated_response(serializer.data)
+        paginator = get_paginator(request, self.cursor_orderings, self.count_strategy)
+        reviews = Review.objects.select_related('user').order_by('-created_at')
+
+        def build():
+            paginated_reviews = paginator.paginate_queryset(reviews, request)
+            serializer = ReviewSerializer(paginated_reviews, many=True)
+            return paginator.get_paginated_response(serializer.data)
+
+        return conditional_response(request, get_validators(request, reviews, related=['user']), build)
 
     def post(self, request):
         serializer = ReviewCreateSerializer(data=request.data)
@@ -29,4 +44,50 @@ class ReviewAPIView(views.APIView):
             review = serializer.save(user=self.request.user, created_by=self.request.user)
             response_serializer = ReviewSerializer(review)
             return Response(response_serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class ProductReviewAPIView(views.APIView):
+    """Reviews of one product, always cursor paginated so deep pages stay cheap"""
+    permission_classes = [AllowAny]
+    cursor_orderings = ReviewAPIView.cursor_orderings
+
+    def get(self, request, product_id):
+        product = get_object_or_404(Product.objects.only('id'), pk=product_id)
+        paginator = KeysetPagination(self.cursor_orderings)
+        reviews = Review.objects.filter(product=product).select_related('user')
+
+        def build():
+            paginated_reviews = paginator.paginate_queryset(reviews, request)
+            serializer = ReviewSerializer(paginated_reviews, many=True)
+            return paginator.get_paginated_response(serializer.data)
+
+        return conditional_response(request, get_validators(request, reviews, related=['user']), build)
+
+
+
+class AsyncProductReviewView(View):
+    """
+    Native async variant of ProductReviewAPIView for ASGI servers. Pages are
+    numbered here, and the product check, the ETag, the page and the count are
+    awaited together.
+    """
+
+    async def get(self, request, product_id):
+        try:
+            reviews = Review.objects.filter(product_id=product_id).select_related('user').order_by('-created_at', '-id')
+            exists, validators, data = await asyncio.gather(
+                Product.objects.filter(pk=product_id).aexists(),
+                aget_validators(request, reviews, related=['user']),
+                apaginate(request, reviews, lambda rows: ReviewSerializer(rows, many=True).data),
+            )
+        except ValueError:
+            exists = False
+        if not exists:
+            return JsonResponse({'detail': 'No Product matches the given query.'}, status=status.HTTP_404_NOT_FOUND)
+        response = not_modified(request, validators)
+        if response is None:
+            if data is None:
+                return JsonResponse({'detail': 'Invalid page.'}, status=status.HTTP_404_NOT_FOUND)
+            response = JsonResponse(data)
+        return set_validators(response, validators)
@@ -5,13 +5,11 @@ class ShopSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Shop
-        fields = ['id', 'name', 'user', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'user', 'created_at', 'updated_at']
-
-    def validate_name(self, value):
-        if Shop.objects.filter(name=value).exists():
-            raise serializers.ValidationError('Shop name already exists')
-        return value
+        # name uniqueness is enforced case-insensitively by the database (see CreateShopView)
+        fields = ['id', 'name', 'user', 'product_count', 'in_stock_count', 'sold_count', 'rating',
+                  'created_at', 'updated_at']
+        read_only_fields = ['id', 'user', 'product_count', 'in_stock_count', 'sold_count', 'rating',
+                            'created_at', 'updated_at']
 
 class ShopShortInfoSerializer(serializers.ModelSerializer):
 
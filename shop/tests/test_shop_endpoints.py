@@ -1,10 +1,15 @@
 from unittest import TestCase
+from io import StringIO
+from django.core.management import call_command
 from rest_framework.test import APIClient
 from django.urls import reverse
 from django.contrib.auth import get_user_model
-from core.models import Shop
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from core.models import Product, Review, Shop, Transaction
 from rest_framework import status
 import pytest
+from core.utils.test.test_utils import assert_constant_queries
 
 SHOPS_URL = reverse('shop:shop-list')
 CREATE_SHOP_URL = reverse('shop:create')
@@ -40,7 +45,7 @@ class TestShopPublicEndpoints(TestCase):
                     name='Shop1')
         res = self.client.get(SHOPS_URL)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 1)
+        self.assertEqual(len(res.data['results']), 1)
 
     def test_list_shop_with_filters(self):
         """should return filtered shops"""
@@ -52,7 +57,46 @@ class TestShopPublicEndpoints(TestCase):
         query_params = dict(name='test')
         res = self.client.get(SHOPS_URL, query_params)
         self.assertEqual(res.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(res.data), 1)
+        self.assertEqual(len(res.data['results']), 1)
+
+    def test_list_shop_pages(self):
+        """should page shops by name, with a cursor for other sort keys"""
+        user = create_user()
+        for name in ('b shop', 'c shop', 'a shop'):
+            create_shop(user=user, name=name)
+        res = self.client.get(SHOPS_URL, dict(page_size=2))
+        self.assertEqual([shop['name'] for shop in res.data['results']], ['a shop', 'b shop'])
+        self.assertIsNotNone(res.data['next'])
+
+        res = self.client.get(SHOPS_URL, dict(pagination='cursor', ordering='-created_at', page_size=2))
+        self.assertEqual([shop['name'] for shop in res.data['results']], ['a shop', 'c shop'])
+        res = self.client.get(res.data['next'])
+        self.assertEqual([shop['name'] for shop in res.data['results']], ['b shop'])
+
+    def test_list_shop_async_invalid_page(self):
+        res = self.client.get(reverse('shop:shop-list-async'), dict(page=5))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_shop_query_count(self):
+        """should list shops in a fixed number of queries"""
+        user = create_user()
+
+        def grow():
+            for i in range(5):
+                create_shop(user=user, name=f'Shop {i}')
+
+        create_shop(user=user, name='Shop')
+        assert_constant_queries(lambda: self.client.get(SHOPS_URL), grow)
+
+    def test_list_shop_async(self):
+        """should return the same shops from the async view as from the sync one"""
+        user = create_user()
+        create_shop(user=user, name='Shop1')
+        create_shop(user=user, name='Shoptest')
+        sync = self.client.get(SHOPS_URL, dict(name='test'))
+        res = self.client.get(reverse('shop:shop-list-async'), dict(name='test'))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.json(), sync.json())
 
 @pytest.mark.django_db
 class TestShopPrivateEndpoints(TestCase):
@@ -81,9 +125,91 @@ class TestShopPrivateEndpoints(TestCase):
         error_fields = res.data
         self.assertIn('name', error_fields)
 
+    def test_create_shop_with_duplicate_name_other_case(self):
+        create_shop(user=self.user, name='Shop1')
+        res = self.client.post(CREATE_SHOP_URL, dict(name='SHOP1'))
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('name', res.data)
+        self.assertEqual(Shop.objects.count(), 1)
+
     def test_create_shop_with_empty_name(self):
         payload = dict(name='', user=self.user)
         res = self.client.post(CREATE_SHOP_URL, payload)
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
         error_fields = res.data
         self.assertIn('name', error_fields)
+
+
+@pytest.mark.django_db
+class TestShopStats(TestCase):
+
+    def setUp(self):
+        self.user = create_user()
+        self.shop = create_shop(user=self.user, name='Shop1')
+
+    def create_product(self, shop=None, **params):
+        defaults = dict(name='Lamp', price=10, quantity=5)
+        defaults.update(params)
+        return Product.objects.create(shop=shop or self.shop, created_by=self.user, **defaults)
+
+    def test_stats_follow_writes(self):
+        """should keep the shop stats in step with its products, reviews and transactions"""
+        product = self.create_product()
+        self.create_product(quantity=0)
+        Review.objects.create(product=product, user=self.user, rating=4, created_by=self.user)
+        Transaction.objects.create(product=product, user=self.user, quantity=2, item_price_at_purchase=10,
+                                   total=20, created_by=self.user)
+        self.shop.refresh_from_db()
+        self.assertEqual((self.shop.product_count, self.shop.in_stock_count), (2, 1))
+        self.assertEqual((self.shop.sold_count, self.shop.rating_count, self.shop.rating), (2, 1, 4))
+
+        other_shop = create_shop(user=self.user, name='Shop2')
+        product.shop = other_shop
+        product.save()
+        self.shop.refresh_from_db()
+        other_shop.refresh_from_db()
+        self.assertEqual((self.shop.product_count, self.shop.in_stock_count, self.shop.sold_count), (1, 0, 0))
+        self.assertEqual((other_shop.product_count, other_shop.sold_count, other_shop.rating), (1, 2, 4))
+
+        product.delete()
+        other_shop.refresh_from_db()
+        self.assertEqual((other_shop.product_count, other_shop.sold_count, other_shop.rating_count), (0, 0, 0))
+
+    def test_product_delete_takes_history_off_shop(self):
+        """should take a deleted product's reviews and sales off its shop without a query per row"""
+        def delete_with_history(size):
+            product = self.create_product()
+            for _ in range(size):
+                Review.objects.create(product=product, user=self.user, rating=4, created_by=self.user)
+                Transaction.objects.create(product=product, user=self.user, quantity=2, item_price_at_purchase=10,
+                                           total=20, created_by=self.user)
+            with CaptureQueriesContext(connection) as context:
+                product.delete()
+            return len(context.captured_queries)
+
+        self.assertEqual(delete_with_history(1), delete_with_history(5))
+        self.shop.refresh_from_db()
+        self.assertEqual((self.shop.product_count, self.shop.in_stock_count, self.shop.sold_count), (0, 0, 0))
+        self.assertEqual((self.shop.rating_sum, self.shop.rating_count, self.shop.rating), (0, 0, 0))
+
+        # a reviewer's own delete still goes row by row
+        product = self.create_product()
+        reviewer = create_user(email='reviewer@example.com')
+        Review.objects.create(product=product, user=reviewer, rating=4, created_by=self.user)
+        reviewer.delete()
+        product.refresh_from_db()
+        self.shop.refresh_from_db()
+        self.assertEqual((product.rating_count, self.shop.rating_count), (0, 0))
+
+    def test_recompute_shop_stats(self):
+        """should repair shop stats that drifted, e.g. after bulk writes"""
+        self.create_product()
+        Shop.objects.filter(pk=self.shop.pk).update(product_count=7, sold_count=3)
+        out = StringIO()
+        call_command('recompute_shop_stats', '--dry-run', stdout=out)
+        self.assertIn('1 shop', out.getvalue())
+        self.assertEqual(Shop.objects.get(pk=self.shop.pk).product_count, 7)
+
+        call_command('recompute_shop_stats', stdout=StringIO())
+        self.shop.refresh_from_db()
+        self.assertEqual((self.shop.product_count, self.shop.in_stock_count, self.shop.sold_count), (1, 1, 0))
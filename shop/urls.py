@@ -1,9 +1,10 @@
 from django.urls import path
-from shop.views import ListShopView, CreateShopView
+from shop.views import AsyncListShopView, ListShopView, CreateShopView
 
 app_name = 'shop'
 
 urlpatterns = [
     path('', ListShopView.as_view(), name='shop-list'),
+    path('/async', AsyncListShopView.as_view(), name='shop-list-async'),
     path('/create', CreateShopView.as_view(), name='create')
 ]
\ No newline at end of file
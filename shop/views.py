@@ -1,24 +1,73 @@
-from rest_framework import generics
+from django.db import IntegrityError, transaction
+from django.http import JsonResponse
+from django.views import View
+from rest_framework import generics, status
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
-from core.models import Shop
+from core.models import SHOP_NAME_CONSTRAINT, Shop
 from shop.serializers import ShopSerializer
-from rest_framework.authentication import TokenAuthentication
+from core.authentication import CachedTokenAuthentication
+from core.conditional import aget_validators, conditional_response, get_validators, not_modified, set_validators
+from core.pagination import COUNT_CAPPED, apaginate, get_paginator
+
+def filter_shops(query_params):
+    """The shop directory for a set of query parameters, shared by the sync and async views"""
+    queryset = Shop.objects.order_by('name', 'id')
+    shop_name = query_params.get('name')
+    if shop_name:
+        # served by the trigram index on UPPER(name)
+        queryset = queryset.filter(name__icontains=shop_name)
+    return queryset
 
 class ListShopView(generics.ListAPIView):
     serializer_class = ShopSerializer
+    # sort keys available with ?pagination=cursor, each backed by a composite index
+    cursor_orderings = {
+        'name': ('name', 'id'),
+        '-created_at': ('-created_at', '-id'),
+        '-sold_count': ('-sold_count', '-id'),
+    }
+    count_strategy = COUNT_CAPPED
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            self._paginator = get_paginator(self.request, self.cursor_orderings, self.count_strategy)
+        return self._paginator
 
     def get_queryset(self):
-        queryset = Shop.objects.all()
-        shop_name = self.request.query_params.get('name')
-        if shop_name:
-            queryset = queryset.filter(name__icontains=shop_name)
-        return queryset
+        return filter_shops(self.request.query_params)
+
+    def list(self, request, *args, **kwargs):
+        validators = get_validators(request, self.filter_queryset(self.get_queryset()))
+        return conditional_response(request, validators, lambda: super(ListShopView, self).list(request, *args, **kwargs))
+
+class AsyncListShopView(View):
+    """Native async variant of ListShopView for ASGI servers, with page-number pagination"""
+
+    async def get(self, request):
+        shops = filter_shops(request.GET)
+        validators = await aget_validators(request, shops)
+        response = not_modified(request, validators)
+        if response is None:
+            data = await apaginate(request, shops, lambda rows: ShopSerializer(rows, many=True).data)
+            if data is None:
+                return JsonResponse({'detail': 'Invalid page.'}, status=status.HTTP_404_NOT_FOUND)
+            response = JsonResponse(data)
+        return set_validators(response, validators)
 
 class CreateShopView(generics.CreateAPIView):
     queryset = Shop.objects.all()
     serializer_class = ShopSerializer
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
     def perform_create(self, serializer):
-        return serializer.save(user=self.request.user, created_by=self.request.user)
+        # the unique index decides, so two concurrent creates can't both pass a pre-check
+        try:
+            with transaction.atomic():
+                return serializer.save(user=self.request.user, created_by=self.request.user)
+        except IntegrityError as error:
+            if SHOP_NAME_CONSTRAINT not in str(error):
+                raise
+            raise ValidationError({'name': ['Shop name already exists']})
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model, authenticate
 
+from core.hashing import set_password
 from core.models import User
 
 class UserSerializer(serializers.ModelSerializer):
@@ -11,15 +12,20 @@ class UserSerializer(serializers.ModelSerializer):
         extra_kwargs = {'password': {'write_only': True, 'min_length': 5}}
 
     def create(self, validated_data):
+        password = validated_data.pop('password')
+        user = get_user_model()(**validated_data)
+        user.email = get_user_model().objects.normalize_email(user.email)
+        set_password(user, password)
+        user.save()
 
-        return get_user_model().objects.create_user(**validated_data)
+        return user
 
     def update(self, instance, validated_data):
         password = validated_data.pop('password', None)
         user = super().update(instance, validated_data)
 
         if password:
-            user.set_password(password)
+            set_password(user, password)
             user.save()
 
         return user